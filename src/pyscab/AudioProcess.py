@@ -0,0 +1,668 @@
+import numpy as np
+import time
+import heapq
+import threading
+import multiprocessing
+from logging import getLogger
+from .HardwareController import AudioInterface, check_channels, callback_params
+from .Telemetry import Telemetry
+logger = getLogger('pyscab.'+__name__)
+
+# dtypes of audio data which can be passed through CommandRing
+DTYPES = [np.dtype("int16"), np.dtype("uint8"), np.dtype("int32"), np.dtype("float32"), np.dtype("float64")]
+
+OP_PLAY = 1
+OP_STOP = 2
+
+# layout of a record of CommandRing
+# op, seq, block, offset, n_frames, n_ch, stride of frame, stride of channel, dtype, volume, start frame, n_route, ch...
+_REC_HEADER = 12
+
+# layout of status written by the engine process
+_ST_SEQ = 0
+_ST_FRAME_REF = 1
+_ST_CURRENT_TIME = 2
+_ST_DAC_TIME = 3
+_ST_ADC_TIME = 4
+_ST_TIME_OFFSET = 5
+_ST_N_ACTIVE = 6
+_ST_N_CLIPPED = 7
+_ST_FRAME = 8
+_ST_HAS_CLOCK = 9
+_ST_STOP_SEQ = 10
+_ST_STOP_FRAME = 11
+_ST_SIZE = 16
+
+class CommandRing(object):
+    """
+    Lock-free ring of fixed size records in shared memory, for a single producer and a single consumer.
+
+    The producer writes a record before it increments the write index,
+    and the consumer reads a record before it increments the read index,
+    so that neither of them waits for the other unless the ring is full or empty.
+
+    Parameters
+    ----------
+    size : int
+        number of records.
+    width : int
+        number of float64 values in a record.
+    name : str, default=None
+        name of shared memory to attach. If it's None, new shared memory is created.
+    """
+    def __init__(self, size, width, name=None):
+        from multiprocessing import shared_memory
+        n_bytes = 16 + size*width*8
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=n_bytes)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.name = self._shm.name
+        self.size = size
+        self.width = width
+        # write index and read index
+        self._index = np.ndarray(2, dtype=np.int64, buffer=self._shm.buf)
+        self._records = np.ndarray((size, width), dtype=np.float64, buffer=self._shm.buf, offset=16)
+        if self._owner:
+            self._index.fill(0)
+
+    def push(self, record, timeout=1.0):
+        """
+        write a record. It waits while the ring is full.
+
+        Parameters
+        ----------
+        record : np.ndarray
+            record which has a length of width.
+        timeout : float, default=1.0
+            time in seconds to wait for the consumer.
+
+        Raises
+        ------
+        RuntimeError
+            Raises RuntimeError if the ring is still full after timeout.
+        """
+        w = int(self._index[0])
+        deadline = None
+        while w - int(self._index[1]) >= self.size:
+            if deadline is None:
+                deadline = time.perf_counter() + timeout
+            elif time.perf_counter() > deadline:
+                raise RuntimeError("command ring is full.")
+            time.sleep(0.0005)
+        self._records[w % self.size] = record
+        self._index[0] = w + 1
+
+    def pop(self, out):
+        """
+        read a record.
+
+        Parameters
+        ----------
+        out : np.ndarray
+            array which the record is copied into.
+
+        Returns
+        -------
+        popped : bool
+            False if the ring is empty.
+        """
+        r = int(self._index[1])
+        if r == int(self._index[0]):
+            return False
+        out[:] = self._records[r % self.size]
+        self._index[1] = r + 1
+        return True
+
+    def close(self):
+        self._index = self._records = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+class VoiceHandle(object):
+    """
+    handle of audio data played by pyscab.AudioProcess.
+
+    Attributes
+    ----------
+    seq : int
+        sequence number of the play command.
+    onset_frame : int or None
+        frame of the stream at which the mixer started audio data. None until it's started.
+    """
+    def __init__(self, seq, onsets):
+        self.seq = seq
+        self._onsets = onsets
+
+    @property
+    def onset_frame(self):
+        row = self._onsets[self.seq % self._onsets.shape[0]]
+        frame = row[1]
+        if row[0] > self.seq:
+            raise ValueError("onset of voice " + str(self.seq) + " was overwritten by a later voice. "
+                             "onset_size of AudioProcess should be larger than number of voices in flight.")
+        if row[0] != self.seq or frame < 0:
+            return None
+        return int(frame)
+
+class StopHandle(object):
+    """
+    handle of stop command sent to pyscab.AudioProcess.
+
+    Attributes
+    ----------
+    seq : int
+        sequence number of the stop command.
+    frame : int or None
+        frame of the stream at which audio data was stopped. None until it's stopped. See pyscab.StopRequest.
+    """
+    def __init__(self, seq, ahc):
+        self.seq = seq
+        self._ahc = ahc
+
+    @property
+    def frame(self):
+        status = self._ahc._read_status()
+        if status[_ST_STOP_SEQ] != self.seq:
+            return None
+        return int(status[_ST_STOP_FRAME])
+
+class AudioProcess(object):
+    """
+    Running pyscab.AudioInterface and its mixer in a dedicated process.
+
+    Audio data is published once into shared memory by publish(), and play or stop commands are sent to
+    the process through pyscab.CommandRing, so that heavy computation in the calling process doesn't disturb the callback.
+    It can be used in place of pyscab.AudioInterface, e.g. for pyscab.StimulationController.
+
+    Parameters
+    ----------
+    device_name : str, default=None
+        device name to be opened. See pyscab.AudioInterface.
+    n_ch : int, default=2
+        number of channels to be opened
+    format : {'INT16', 'UINT8'}, default='INT16'
+        audio data fortmat to be played
+    frame_rate : int, default=44100
+        frame rate of audio device.
+    frames_per_buffer : int, default=512
+        frames per buffer of audio device.
+    limiter : {None, 'clip', 'soft'}, default=None
+        conversion of mixed audio data to format. See pyscab.Mixer.
+    backend : {'pyaudio', 'null'} or pyscab.NullBackend, default='pyaudio'
+        audio backend used in the process. It should be picklable.
+    telemetry : pyscab.Telemetry or bool, default=None
+        If it's set, callbacks are recorded. It should be created with shared=True. If it's True, pyscab.Telemetry(shared=True) is used.
+    ring_size : int, default=1024
+        number of commands which can be queued.
+    onset_size : int, default=65536
+        number of voices whose onset frames are kept. Onset frame of a voice can be read from its pyscab.VoiceHandle
+        until onset_size later voices are started. If it's overwritten before it's read, VoiceHandle raises ValueError.
+    poll_interval : float, default=0.0005
+        interval in seconds at which the process reads commands and updates status.
+
+    Examples
+    --------
+    >>> ahc = pyscab.AudioProcess(device_name = 'default', n_ch = 2)
+    >>> stc = pyscab.StimulationController(ahc, marker_send=marker.send)
+    >>> stc.open()
+    >>> ahc.publish(dh)
+    >>> stc.play(audio_plan, dh)
+    >>> stc.close()
+    """
+    def __init__(self,
+                 device_name=None,
+                 n_ch=2,
+                 format="INT16",
+                 frame_rate=44100,
+                 frames_per_buffer=512,
+                 limiter=None,
+                 backend='pyaudio',
+                 telemetry=None,
+                 ring_size=1024,
+                 onset_size=65536,
+                 poll_interval=0.0005):
+        self.device_name = device_name
+        self.num_channels = n_ch
+        self.format = format
+        if format.upper() == "INT16":
+            self.format_np = np.dtype("int16")
+        elif format.upper() == "UINT8":
+            self.format_np = np.dtype("uint8")
+        else:
+            raise ValueError("Unknown Format : " + format + ". It can only take INT16 or UINT8.")
+        self.frame_rate = frame_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.limiter = limiter
+        self.backend = backend
+        if telemetry is True:
+            telemetry = Telemetry(shared=True)
+        elif telemetry is False:
+            telemetry = None
+        self.telemetry = telemetry
+        self.ring_size = ring_size
+        self.onset_size = onset_size
+        self.poll_interval = poll_interval
+        self.device = None
+        self.blocks = list()
+        self.process = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._record = np.zeros(_REC_HEADER + n_ch, dtype=np.float64)
+
+    def open(self):
+        """
+        start the process and open audio device in it.
+        """
+        from multiprocessing import shared_memory
+        self._ring = CommandRing(self.ring_size, _REC_HEADER + self.num_channels)
+        # status and onset frames of the latest onset_size voices
+        self._status_shm = shared_memory.SharedMemory(create=True, size=(_ST_SIZE + self.onset_size*2)*8)
+        buf = np.ndarray(_ST_SIZE + self.onset_size*2, dtype=np.float64, buffer=self._status_shm.buf)
+        buf.fill(0)
+        self._status = buf[:_ST_SIZE]
+        self._onsets = buf[_ST_SIZE:].reshape(self.onset_size, 2)
+        self._onsets[:, 0] = -1
+        self._status[_ST_STOP_SEQ] = -1
+        self._seq = 0
+
+        params = {'device_name': self.device_name,
+                  'n_ch': self.num_channels,
+                  'format': self.format,
+                  'frame_rate': self.frame_rate,
+                  'frames_per_buffer': self.frames_per_buffer,
+                  'limiter': self.limiter,
+                  'backend': self.backend,
+                  'telemetry': self.telemetry}
+        self._conn, conn_child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_run_engine,
+                                               args=(conn_child, params, self._ring.name, self._status_shm.name,
+                                                     self.ring_size, self.onset_size, self.poll_interval),
+                                               daemon=True)
+        self.process.start()
+        self.device = self._request(('open',))
+        for block in self.blocks:
+            self._request(('attach', block[0].name))
+        logger.debug("Audio process %d was started.", self.process.pid)
+
+    def _request(self, message):
+        self._conn.send(message)
+        reply = self._conn.recv()
+        if isinstance(reply, BaseException):
+            raise reply
+        return reply
+
+    def publish(self, data):
+        """
+        copy audio data into shared memory, so that it can be played by the process.
+
+        Audio data held by data is replaced with read-only views of shared memory.
+        Only audio data which is published can be played.
+        If data was packed into shared memory by DataHandler.pack(shared=True), the arena is attached by the process without copying.
+
+        Parameters
+        ----------
+        data : pyscab.DataHandler
+            audio data to be published.
+        """
+        from multiprocessing import shared_memory
+        arena = getattr(data, 'arena', None)
+        if arena is not None and arena.name is not None and arena.buffer is not None \
+                and all(block[0] is not arena._shm for block in self.blocks):
+            address = arena.buffer.__array_interface__['data'][0]
+            # shared memory of the arena is released by the arena
+            self.blocks.append((arena._shm, address, arena.n_bytes, False))
+            if self.process is not None:
+                self._request(('attach', arena.name))
+            logger.debug("arena (%d bytes) was published.", arena.n_bytes)
+        # streamed audio data is not published
+        stimuli = [stimulus for stimulus in data.stimuli.values()
+                   if isinstance(stimulus.data, np.ndarray) and self._find_block(stimulus.data) is None]
+        if len(stimuli) == 0:
+            return
+        offsets = list()
+        n_bytes = 0
+        for stimulus in stimuli:
+            offsets.append(n_bytes)
+            # align each audio data to 64 bytes
+            n_bytes += -(-stimulus.data.nbytes//64)*64
+        shm = shared_memory.SharedMemory(create=True, size=max(n_bytes, 1))
+        for stimulus, offset in zip(stimuli, offsets):
+            view = np.ndarray(stimulus.data.shape, dtype=stimulus.data.dtype, buffer=shm.buf, offset=offset)
+            view[:] = stimulus.data
+            view.flags.writeable = False
+            stimulus.data = view
+        address = np.frombuffer(shm.buf, dtype=np.uint8).__array_interface__['data'][0]
+        self.blocks.append((shm, address, n_bytes, True))
+        if self.process is not None:
+            self._request(('attach', shm.name))
+        logger.debug("%d audio data (%d bytes) were published.", len(stimuli), n_bytes)
+
+    def _find_block(self, data):
+        address = data.__array_interface__['data'][0]
+        for idx, (shm, base, n_bytes, owned) in enumerate(self.blocks):
+            if base <= address < base + n_bytes:
+                return idx, address - base
+        return None
+
+    def _send_play(self, data, ch, volume, frame):
+        check_channels(ch, self.num_channels)
+        if not isinstance(data, np.ndarray):
+            raise ValueError("only published audio data can be played by AudioProcess.")
+        located = self._find_block(data)
+        if located is None:
+            raise ValueError("audio data is not published. call publish() before play().")
+        if data.ndim != 2 or data.dtype not in DTYPES:
+            raise ValueError("audio data should be 2 dimensional array of " + str(DTYPES) + ".")
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+            rec = self._record
+            rec[:] = 0
+            rec[0:_REC_HEADER] = (OP_PLAY, seq, located[0], located[1], data.shape[0], data.shape[1],
+                                  data.strides[0], data.strides[1], DTYPES.index(data.dtype), volume,
+                                  -1 if frame is None else frame, len(ch))
+            rec[_REC_HEADER:_REC_HEADER+len(ch)] = ch
+            self._ring.push(rec)
+        return VoiceHandle(seq, self._onsets)
+
+    def play(self, data, ch, volume=1.0, frame=None):
+        """
+        play audio data from specified channel. See pyscab.AudioInterface.play().
+
+        Parameters
+        ----------
+        data : np.ndarray
+            published audio data which have a shape of (number of samples, number of channels)
+        ch : list of int
+            channel number of audio device to be played (start from 1)
+        volume : float, default=1.0
+            gain applied to audio data while mixing.
+        frame : int, default=None
+            frame of the stream at which audio data will be started.
+
+        Returns
+        -------
+        voice : pyscab.VoiceHandle
+        """
+        return self._send_play(data, ch, volume, frame)
+
+    def schedule(self, events, relative=False):
+        """
+        schedule multiple audio data at once for sample-accurate playing. See pyscab.AudioInterface.schedule().
+
+        Parameters
+        ----------
+        events : list of tuple
+            list of (frame, data, ch) or (frame, data, ch, volume).
+        relative : bool, default=False
+            If True, frame of events are relative to the base frame, which is set to two buffers after
+            the next buffer at the time all events were prepared.
+
+        Returns
+        -------
+        base_frame : int
+        """
+        base_frame = 0
+        if relative:
+            # commands are read by the process once per poll_interval
+            margin = int(self.poll_interval*self.frame_rate)
+            base_frame = self.get_frame() + 2*self.frames_per_buffer + margin
+        for event in events:
+            volume = event[3] if len(event) > 3 else 1.0
+            self._send_play(event[1], event[2], volume, event[0] + base_frame)
+        return base_frame
+
+    def stop(self, fade=0.0):
+        """
+        stop all playing and scheduled audio data at the beginning of the next buffer.
+
+        Parameters
+        ----------
+        fade : float, default=0.0
+            length of fade-out in seconds applied to audio data which is already sounding.
+
+        Returns
+        -------
+        request : pyscab.StopHandle
+        """
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+            rec = self._record
+            rec[:] = 0
+            rec[0:2] = (OP_STOP, seq)
+            rec[9] = fade
+            self._ring.push(rec)
+        return StopHandle(seq, self)
+
+    def _read_status(self):
+        # status is written with a sequence counter, which is odd while it's written
+        status = self._status
+        while True:
+            seq = status[_ST_SEQ]
+            values = status.copy()
+            if seq % 2 == 0 and seq == status[_ST_SEQ]:
+                return values
+            time.sleep(0)
+
+    def get_frame(self):
+        """
+        get frame of the stream at the beginning of the next buffer to be mixed.
+
+        Returns
+        -------
+        frame : int
+        """
+        return int(self._read_status()[_ST_FRAME])
+
+    def get_time_info(self):
+        """
+        get time information of the last callback.
+
+        Returns
+        -------
+        time_info : dict or None
+        """
+        status = self._read_status()
+        if status[_ST_HAS_CLOCK] == 0:
+            return None
+        return {'input_buffer_adc_time': status[_ST_ADC_TIME],
+                'current_time': status[_ST_CURRENT_TIME],
+                'output_buffer_dac_time': status[_ST_DAC_TIME]}
+
+    def get_time(self):
+        """
+        get current time of the stream.
+
+        It's computed from the offset between the stream time and time.perf_counter() measured by the process.
+
+        Returns
+        -------
+        time : float
+            time in seconds.
+        """
+        return time.perf_counter() + self._status[_ST_TIME_OFFSET]
+
+    def frame2time(self, frame):
+        """
+        convert frame of the stream to the stream time at which the frame is mixed. See pyscab.AudioInterface.frame2time().
+        """
+        status = self._read_status()
+        if status[_ST_HAS_CLOCK] == 0:
+            return None
+        return status[_ST_CURRENT_TIME] + (frame - status[_ST_FRAME_REF])/self.frame_rate
+
+    def frame2dac_time(self, frame):
+        """
+        convert frame of the stream to the stream time at which the frame is output by DAC. See pyscab.AudioInterface.frame2dac_time().
+        """
+        status = self._read_status()
+        if status[_ST_HAS_CLOCK] == 0:
+            return None
+        dac_time = status[_ST_DAC_TIME]
+        if dac_time == 0:
+            dac_time = status[_ST_CURRENT_TIME] + self.frames_per_buffer/self.frame_rate
+        return dac_time + (frame - status[_ST_FRAME_REF])/self.frame_rate
+
+    def get_n_active_voices(self):
+        """
+        get number of currently sounding voices.
+
+        Returns
+        -------
+        n_active : int
+        """
+        return int(self._status[_ST_N_ACTIVE])
+
+    def get_n_clipped(self):
+        """
+        get number of output samples which exceeded the range of format since the device was opened.
+
+        Returns
+        -------
+        n_clipped : int
+        """
+        return int(self._status[_ST_N_CLIPPED])
+
+    def close(self):
+        """
+        close audio device and stop the process.
+        """
+        if self.process is None:
+            return
+        self._request(('close',))
+        self.process.join()
+        self.process = None
+        self._status = self._onsets = None
+        self._status_shm.close()
+        self._status_shm.unlink()
+        self._ring.close()
+        self._conn.close()
+
+    def terminate(self):
+        """
+        release published audio data.
+        """
+        self.close()
+        for shm, address, n_bytes, owned in self.blocks:
+            if not owned:
+                continue
+            try:
+                shm.close()
+            except BufferError:
+                # views of shared memory are still referenced by DataHandler, memory is released with them.
+                pass
+            shm.unlink()
+        self.blocks = list()
+
+def _run_engine(conn, params, ring_name, status_name, ring_size, onset_size, poll_interval):
+    from multiprocessing import shared_memory
+    ahc = None
+    engine = None
+    blocks = list()
+    while True:
+        message = conn.recv()
+        try:
+            if message[0] == 'open':
+                ahc = AudioInterface(**params)
+                ahc.open()
+                engine = _Engine(ahc, CommandRing(ring_size, _REC_HEADER + ahc.num_channels, name=ring_name),
+                                 shared_memory.SharedMemory(name=status_name), onset_size, blocks, poll_interval)
+                engine.start()
+                conn.send(dict(ahc.device))
+            elif message[0] == 'attach':
+                blocks.append(shared_memory.SharedMemory(name=message[1]))
+                conn.send(True)
+            elif message[0] == 'close':
+                engine.stop()
+                ahc.close()
+                ahc.terminate()
+                conn.send(True)
+                return
+        except Exception as e:
+            conn.send(e)
+
+class _Engine(object):
+    # reads commands and writes status in the audio process
+
+    def __init__(self, ahc, ring, status_shm, onset_size, blocks, poll_interval):
+        self.ahc = ahc
+        self.ring = ring
+        self.status_shm = status_shm
+        buf = np.ndarray(_ST_SIZE + onset_size*2, dtype=np.float64, buffer=status_shm.buf)
+        self.status = buf[:_ST_SIZE]
+        self.onsets = buf[_ST_SIZE:].reshape(onset_size, 2)
+        self.blocks = blocks
+        self.poll_interval = poll_interval
+        # voices which are not started yet, as heap of (start frame, seq, voice). voices played immediately have start frame -1.
+        self.waiting = list()
+        # voices whose start frame has come, but which are not reported by the mixer yet
+        self.due = list()
+        self.stops = list()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def _run(self):
+        rec = np.zeros(self.ring.width, dtype=np.float64)
+        status = self.status
+        while self.running:
+            while self.ring.pop(rec):
+                if rec[0] == OP_STOP:
+                    self.stops.append((int(rec[1]), self.ahc.stop(fade=rec[9])))
+                elif rec[0] == OP_PLAY:
+                    self._play(rec)
+
+            # only voices whose start frame has come are checked
+            frame_end = self.ahc.get_frame() + self.ahc.frames_per_buffer
+            while self.waiting and self.waiting[0][0] < frame_end:
+                start_frame, seq, voice = heapq.heappop(self.waiting)
+                self.due.append((seq, voice))
+            if self.due:
+                due = list()
+                for seq, voice in self.due:
+                    if voice.onset_frame is not None:
+                        self.onsets[seq % self.onsets.shape[0]] = (seq, voice.onset_frame)
+                    elif not voice.finished:
+                        due.append((seq, voice))
+                self.due = due
+
+            clock = callback_params.clock
+            status[_ST_SEQ] += 1
+            if clock is not None:
+                frame_ref, time_info = clock
+                status[_ST_FRAME_REF] = frame_ref
+                status[_ST_CURRENT_TIME] = time_info['current_time']
+                status[_ST_DAC_TIME] = time_info['output_buffer_dac_time']
+                status[_ST_ADC_TIME] = time_info['input_buffer_adc_time']
+                status[_ST_HAS_CLOCK] = 1
+            status[_ST_FRAME] = self.ahc.get_frame()
+            status[_ST_N_ACTIVE] = self.ahc.get_n_active_voices()
+            status[_ST_N_CLIPPED] = self.ahc.get_n_clipped()
+            while self.stops and self.stops[0][1].frame is not None:
+                seq, request = self.stops.pop(0)
+                status[_ST_STOP_SEQ] = seq
+                status[_ST_STOP_FRAME] = request.frame
+            status[_ST_SEQ] += 1
+            status[_ST_TIME_OFFSET] = self.ahc.get_time() - time.perf_counter()
+            time.sleep(self.poll_interval)
+
+    def _play(self, rec):
+        seq, block, offset, n_frames, n_ch, stride_frame, stride_ch, dtype, volume, frame, n_route = rec[1:_REC_HEADER].tolist()
+        data = np.ndarray((int(n_frames), int(n_ch)), dtype=DTYPES[int(dtype)], buffer=self.blocks[int(block)].buf,
+                          offset=int(offset), strides=(int(stride_frame), int(stride_ch)))
+        ch = [int(c) for c in rec[_REC_HEADER:_REC_HEADER+int(n_route)]]
+        voice = self.ahc.play(data, ch, volume=volume, frame=None if frame < 0 else int(frame))
+        heapq.heappush(self.waiting, (int(frame), int(seq), voice))
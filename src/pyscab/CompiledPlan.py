@@ -0,0 +1,195 @@
+import numpy as np
+import math
+from logging import getLogger
+from .HardwareController import check_channels
+logger = getLogger('pyscab.'+__name__)
+
+PLAN_DTYPE = np.dtype([('time', 'f8'),
+                       ('end', 'f8'),
+                       ('frame', 'i8'),
+                       ('n_frames', 'i8'),
+                       ('handle', 'i8'),
+                       ('id', 'O'),
+                       ('ch', 'O'),
+                       ('marker', 'O'),
+                       ('index', 'i8')])
+
+class CompiledPlan(object):
+    """
+    Stimulating plan compiled into a record array.
+
+    Plans are validated and sorted by time once, ids are resolved to audio data, and end time and polyphony are precomputed,
+    so that StimulationController.play() doesn't look up DataHandler while playing, and bad plans fail before the device is opened.
+    It can be passed to StimulationController.play(), get_required_time() and pyscab.OfflineRenderer instead of the list of plans.
+
+    Parameters
+    ----------
+    plans : list of list
+        plans of stimulation. Each plan is [time, id, ch, marker].
+    data : pyscab.DataHandler
+        audio data referenced by id of plans.
+    n_ch : int, default=None
+        number of channels of the device, e.g. AudioInterface.num_channels. If it's None, channels are not checked against it.
+
+    Attributes
+    ----------
+    records : np.ndarray
+        structured array sorted by time (plans which have same time keep their order), with fields
+
+        - 'time' : onset time in seconds.
+        - 'end' : end time of audio data in seconds.
+        - 'frame' : onset frame at frame_rate.
+        - 'n_frames' : number of frames of audio data.
+        - 'handle' : index of audio data in buffers.
+        - 'id' : id of audio data.
+        - 'ch' : channels as tuple.
+        - 'marker' : marker value.
+        - 'index' : index of the plan in plans.
+    buffers : list
+        audio data referenced by handle, i.e. np.ndarray or pyscab.WavStream. It's updated by resolve().
+    ids : list
+        id of audio data referenced by handle.
+    plans : list
+        passed plans, which are returned by StimulationController.play() as played or skipped.
+    frame_rate : int
+        frame rate of data.
+    end_time : float
+        end of the last audio data in seconds. See get_required_time().
+    max_polyphony : int
+        maximum number of audio data sounding at the same time.
+    n_overlaps : int
+        number of plans which start while other audio data is sounding.
+
+    Raises
+    ------
+    ValueError
+        Raises ValueError if time is negative or not finite, id doesn't exist in data, or channels are out of range.
+        Message includes the index of the plan.
+
+    Notes
+    -----
+    Audio data is looked up again by resolve() when plans are played, so audio data can be replaced with the same length after compiling,
+    e.g. it can be published by pyscab.AudioProcess.publish() after plans were compiled.
+    If length of audio data is changed, plans should be compiled again.
+
+    Examples
+    --------
+    >>> plan = pyscab.CompiledPlan(audio_plan, dh, n_ch = ahc.num_channels)
+    >>> print(plan.end_time, plan.max_polyphony)
+    >>> stc.open()
+    >>> stc.play(plan, dh)
+    """
+    def __init__(self, plans, data, n_ch=None):
+        self.plans = plans
+        self.frame_rate = data.frame_rate
+        self.buffers = list()
+        self.ids = list()
+        handles = dict()
+        checked = set()
+        n_plans = len(plans)
+        times = np.zeros(n_plans, dtype=np.float64)
+        indices = np.zeros(n_plans, dtype=np.int64)
+        ids = np.empty(n_plans, dtype=object)
+        chs = np.empty(n_plans, dtype=object)
+        markers = np.empty(n_plans, dtype=object)
+        for idx, plan in enumerate(plans):
+            t, id, ch = plan[0], plan[1], tuple(plan[2])
+            if not math.isfinite(t) or t < 0:
+                raise ValueError("time " + str(t) + " of plan " + str(idx) + " is invalid.")
+            try:
+                handle = handles[id]
+            except KeyError:
+                try:
+                    self.buffers.append(data.get_data_by_id(id))
+                except ValueError as e:
+                    raise ValueError("plan " + str(idx) + " : " + str(e)) from None
+                self.ids.append(id)
+                handle = handles[id] = len(self.buffers) - 1
+            if n_ch is not None and ch not in checked:
+                try:
+                    check_channels(ch, n_ch)
+                except ValueError as e:
+                    raise ValueError("plan " + str(idx) + " : " + str(e)) from None
+                checked.add(ch)
+            times[idx] = t
+            indices[idx] = handle
+            ids[idx] = id
+            chs[idx] = ch
+            markers[idx] = plan[3]
+
+        records = np.zeros(n_plans, dtype=PLAN_DTYPE)
+        records['time'] = times
+        records['handle'] = indices
+        records['id'] = ids
+        records['ch'] = chs
+        records['marker'] = markers
+        records['index'] = np.arange(n_plans)
+        n_frames = np.array([buffer.shape[0] for buffer in self.buffers], dtype=np.int64)
+        records['n_frames'] = n_frames[records['handle']]
+        records['end'] = records['time'] + records['n_frames']/self.frame_rate
+        records['frame'] = np.rint(records['time']*self.frame_rate)
+        self.records = records[np.argsort(records['time'], kind='stable')]
+
+        if len(self.records):
+            self.end_time = float(np.max(self.records['end']))
+            # sweep over onsets and ends. ends come first when they are at the same frame as onsets.
+            events = np.concatenate((self.records['frame'], self.records['frame'] + self.records['n_frames']))
+            steps = np.concatenate((np.ones(len(self.records), dtype=np.int64), -np.ones(len(self.records), dtype=np.int64)))
+            order = np.lexsort((steps, events))
+            polyphony = np.cumsum(steps[order])
+            self.max_polyphony = int(np.max(polyphony))
+            self.n_overlaps = int(np.count_nonzero(polyphony[steps[order] == 1] > 1))
+        else:
+            self.end_time = 0.0
+            self.max_polyphony = 0
+            self.n_overlaps = 0
+        logger.debug("%d plans were compiled. end time : %s, max polyphony : %d", len(self.records), str(self.end_time), self.max_polyphony)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        # plans in the order of time
+        for idx in self.records['index']:
+            yield self.plans[idx]
+
+    def get_data(self, idx):
+        """
+        get audio data of the idx-th record.
+
+        Parameters
+        ----------
+        idx : int
+            index of records.
+
+        Returns
+        -------
+        data : np.ndarray or pyscab.WavStream
+        """
+        return self.buffers[self.records['handle'][idx]]
+
+    def resolve(self, data):
+        """
+        look up audio data of each handle again, e.g. after audio data was published.
+
+        Parameters
+        ----------
+        data : pyscab.DataHandler
+            audio data referenced by id of plans.
+
+        Returns
+        -------
+        buffers : list
+            audio data referenced by handle.
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if id doesn't exist in data, or number of frames of audio data was changed after compiling.
+        """
+        buffers = [data.get_data_by_id(id) for id in self.ids]
+        for id, buffer, compiled in zip(self.ids, buffers, self.buffers):
+            if buffer.shape[0] != compiled.shape[0]:
+                raise ValueError("number of frames of id " + str(id) + " was changed after plans were compiled. compile plans again.")
+        self.buffers = buffers
+        return buffers
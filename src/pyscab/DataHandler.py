@@ -1,10 +1,356 @@
 import numpy as np
+import math
 import time
 import os
-import wave
+import struct
+from .utils import apply_envelope, generate_tones
 from logging import getLogger
 logger = getLogger('pyscab.'+__name__)
 
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def read_wav_header(path):
+    """
+    Parse RIFF header of wav file without reading pcm payload.
+
+    Parameters
+    ----------
+    path : str
+        file path of wav file.
+
+    Returns
+    -------
+    header : dict
+        keys : 'n_ch', 'frame_rate', 'sample_width', 'n_frames', 'offset'
+        'offset' is the byte offset of the pcm payload ('data' chunk) in the file.
+
+    Raises
+    ------
+    ValueError
+        Raises ValueError if file is not a RIFF/WAVE file or not a PCM wave format.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            raise ValueError(str(path) + " is not a RIFF/WAVE file.")
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError("data chunk was not found in " + str(path))
+            name, size = struct.unpack('<4sI', chunk_header)
+            if name == b'fmt ':
+                body = f.read(size)
+                format_tag, n_ch, frame_rate, _, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                    format_tag = struct.unpack('<H', body[24:26])[0]
+                if format_tag != WAVE_FORMAT_PCM:
+                    raise ValueError("file must be PCM wave format")
+                fmt = (n_ch, frame_rate, block_align, bits)
+                if size & 1:
+                    f.seek(1, 1)
+            elif name == b'data':
+                if fmt is None:
+                    raise ValueError("fmt chunk was not found before data chunk in " + str(path))
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), 1)
+
+    n_ch, frame_rate, block_align, bits = fmt
+    # some writers leave the size of data chunk unset (e.g. 0xFFFFFFFF) while streaming
+    size = min(size, file_size - offset)
+    return {'n_ch': n_ch,
+            'frame_rate': frame_rate,
+            'sample_width': block_align // n_ch,
+            'n_frames': size // block_align,
+            'offset': offset}
+
+def _sample_width2dtype(sw):
+    if sw == 1:
+        return np.dtype("uint8")
+    elif sw == 2:
+        return np.dtype("int16")
+    else:
+        raise ValueError("file must be Int16 or UInt8 PCM wave format")
+
+def _format2dtype(format):
+    if format is None:
+        return None
+    if isinstance(format, str):
+        if format.upper() == "INT16":
+            return np.dtype("int16")
+        elif format.upper() == "UINT8":
+            return np.dtype("uint8")
+        raise ValueError("Unknown Format : " + format + ". It can only take INT16 or UINT8.")
+    dtype = np.dtype(format)
+    if dtype not in (np.dtype("int16"), np.dtype("uint8")):
+        raise ValueError("Unknown Format : " + str(format) + ". It can only take INT16 or UINT8.")
+    return dtype
+
+def convert_pcm(data, frame_rate, target_frame_rate=None, dtype=None, n_ch=None, volume=1.0):
+    """
+    Convert frame rate, format and number of channels of pcm data at once.
+
+    Frame rate is converted by FFT resampling, i.e. the spectrum of the data is truncated (or padded with zeros) at the Nyquist frequency
+    of the lower frame rate, so that components above it don't alias into the audible band when the data is downsampled.
+    The data is padded with zeros before the transform, so that its end doesn't wrap around into its beginning.
+
+    Volume is applied in float, and the result is rounded and saturated to the range of the format.
+    UInt8 data is scaled around 128.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Int16 or UInt8 audio data which have a shape of (number of frames, number of channels).
+    frame_rate : int
+        frame rate of data.
+    target_frame_rate : int, default=None
+        frame rate after conversion. If it's None, frame rate is not converted.
+    dtype : np.dtype or {'INT16', 'UINT8'}, default=None
+        format after conversion. If it's None, format is not converted.
+    n_ch : int, default=None
+        number of channels after conversion. Mono data is repeated to all channels,
+        and all channels are averaged for mono. If it's None, number of channels is not converted.
+    volume : float, default=1.0
+        volume to be applied to the data.
+
+    Returns
+    -------
+    data : np.ndarray
+        converted audio data.
+
+    Raises
+    ------
+    ValueError
+        Raises ValueError if number of channels can not be converted.
+    """
+    src_dtype = _format2dtype(data.dtype)
+    dtype = src_dtype if dtype is None else _format2dtype(dtype)
+
+    # all conversion is done in float32 with the scale of Int16
+    x = data.astype(np.float32)
+    if src_dtype == np.dtype("uint8"):
+        x -= 128
+        x *= 256
+
+    if n_ch is not None and n_ch != x.shape[1]:
+        if x.shape[1] == 1:
+            x = np.repeat(x, n_ch, axis=1)
+        elif n_ch == 1:
+            x = x.mean(axis=1, keepdims=True)
+        else:
+            raise ValueError("number of channels can not be converted from " + str(x.shape[1]) + " to " + str(n_ch) + ".")
+
+    if target_frame_rate is not None and target_frame_rate != frame_rate and x.shape[0] > 0:
+        x = _resample(x, frame_rate, target_frame_rate)
+
+    if volume != 1.0:
+        x *= volume
+    if dtype == np.dtype("uint8"):
+        x /= 256
+        x += 128
+    info = np.iinfo(dtype)
+    np.rint(x, out=x)
+    np.clip(x, info.min, info.max, out=x)
+    return x.astype(dtype)
+
+# number of silent frames appended before resampling
+RESAMPLE_GUARD = 1024
+
+def _resample(x, frame_rate, target_frame_rate):
+    n_in = x.shape[0]
+    n_out = int(round(n_in*target_frame_rate/frame_rate))
+    # length of padded data is a multiple of frame_rate/gcd, so that it's converted to an integer number of frames
+    step = frame_rate // math.gcd(frame_rate, target_frame_rate)
+    n_pad = -(-(n_in + RESAMPLE_GUARD)//step)*step
+    n_pad_out = n_pad*target_frame_rate//frame_rate
+    spectrum = np.fft.rfft(x, n=n_pad, axis=0)
+    n_bins = min(n_pad, n_pad_out)//2 + 1
+    resampled = np.zeros((n_pad_out//2 + 1, x.shape[1]), dtype=spectrum.dtype)
+    resampled[:n_bins] = spectrum[:n_bins]
+    n = min(n_pad, n_pad_out)
+    if n % 2 == 0:
+        # Nyquist bin of the shorter length holds both of positive and negative frequencies
+        if n_pad_out < n_pad:
+            resampled[n//2] *= 2
+        else:
+            resampled[n//2] *= 0.5
+    y = np.fft.irfft(resampled, n=n_pad_out, axis=0)
+    y *= n_pad_out/n_pad
+    return y[:n_out].astype(np.float32)
+
+def read_wav(path, volume=1.0, mmap=False, frame_rate=None, dtype=None, n_ch=None):
+    """
+    Read pcm payload of wav file.
+
+    Parameters
+    ----------
+    path : str
+        file path of wav file.
+    volume : float, default=1.0
+        volume to be applied to the data.
+    mmap : bool, default=False
+        If True, pcm payload will be memory-mapped instead of being read.
+        If any conversion is required, converted data is held in memory.
+    frame_rate : int, default=None
+        frame rate to be converted to. If it's None, frame rate of the file is kept.
+    dtype : np.dtype or {'INT16', 'UINT8'}, default=None
+        format to be converted to. If it's None, format of the file is kept.
+    n_ch : int, default=None
+        number of channels to be converted to. If it's None, number of channels of the file is kept.
+
+    Returns
+    -------
+    data : np.ndarray
+        audio data which have a shape of (number of frames, number of channels).
+    sample_width : int
+        sample width in byte.
+
+    See Also
+    --------
+    convert_pcm : conversion of frame rate, format and number of channels.
+    """
+    header = read_wav_header(path)
+    n_ch_file = header['n_ch']
+    sw = header['sample_width']
+    nf = header['n_frames']
+    dtype_file = _sample_width2dtype(sw)
+    dtype = _format2dtype(dtype)
+
+    if ((frame_rate is not None and frame_rate != header['frame_rate'])
+            or (dtype is not None and dtype != dtype_file)
+            or (n_ch is not None and n_ch != n_ch_file)):
+        data, sw = read_wav(path, mmap=mmap)
+        data = convert_pcm(data, header['frame_rate'], frame_rate, dtype=dtype, n_ch=n_ch, volume=volume)
+        logger.debug("%s was converted to %s Hz, %s, %d channels.", path, str(frame_rate), str(data.dtype), data.shape[1])
+        return data, data.dtype.itemsize
+
+    n_ch = n_ch_file
+    dtype = dtype_file
+
+    if mmap:
+        if nf == 0:
+            data = np.zeros((0, n_ch), dtype=dtype)
+        else:
+            data = np.memmap(path, dtype=dtype, mode='r', offset=header['offset'], shape=(nf, n_ch))
+    else:
+        # read pcm payload directly into the final (frames, channels) buffer
+        data = np.empty((nf, n_ch), dtype=dtype)
+        with open(path, 'rb') as f:
+            f.seek(header['offset'])
+            f.readinto(memoryview(data).cast('B'))
+        if volume != 1.0:
+            # volume is applied in the same way as when the data is converted
+            data = convert_pcm(data, header['frame_rate'], volume=volume)
+    return data, sw
+
+def read_wav_cached(cache, path, volume=1.0, frame_rate=None, dtype=None, n_ch=None):
+    """
+    Read pcm payload of wav file through StimulusCache.
+
+    Parameters
+    ----------
+    cache : pyscab.StimulusCache
+        cache to be used.
+    path : str
+        file path of wav file.
+    volume : float, default=1.0
+        volume to be applied to the data.
+    frame_rate : int, default=None
+        frame rate to be converted to. See read_wav().
+    dtype : np.dtype or {'INT16', 'UINT8'}, default=None
+        format to be converted to. See read_wav().
+    n_ch : int, default=None
+        number of channels to be converted to. See read_wav().
+
+    Returns
+    -------
+    data : np.ndarray
+        read-only memory-mapped audio data which have a shape of (number of frames, number of channels).
+    sample_width : int
+        sample width in byte.
+    params : dict
+        processing parameters which were used as cache key.
+    """
+    header = read_wav_header(path)
+    sw = header['sample_width']
+    dtype = _format2dtype(dtype)
+    params = {'source': cache.file_hash(path),
+              'volume': volume,
+              'dtype': (_sample_width2dtype(sw) if dtype is None else dtype).str,
+              'n_ch': header['n_ch'] if n_ch is None else n_ch,
+              'frame_rate': header['frame_rate'] if frame_rate is None else frame_rate,
+              'layout': 'frames_channels'}
+    key = cache.make_key(**params)
+    data = cache.get(key)
+    if data is None:
+        data, sw = read_wav(path, volume=volume, frame_rate=frame_rate, dtype=dtype, n_ch=n_ch)
+        data = cache.put(key, data)
+    return data, data.dtype.itemsize, params
+
+def _read_wav_timed(path, volume, mmap, cache, frame_rate=None, dtype=None, n_ch=None, remap=False):
+    # If remap is True, memory-mapped data is not returned, since it would be pickled into a writable copy.
+    # It's mapped again by _remap() in the parent process.
+    start = time.perf_counter()
+    if cache is None:
+        data, sw = read_wav(path, volume=volume, mmap=mmap, frame_rate=frame_rate, dtype=dtype, n_ch=n_ch)
+        params = None
+    else:
+        data, sw, params = read_wav_cached(cache, path, volume=volume, frame_rate=frame_rate, dtype=dtype, n_ch=n_ch)
+    if remap and isinstance(data, np.memmap):
+        data = None
+    return data, sw, params, time.perf_counter() - start
+
+def _remap(path, volume, mmap, cache, params, frame_rate=None, dtype=None, n_ch=None):
+    if cache is not None:
+        data = cache.get(cache.make_key(**params))
+        if data is None:
+            # the entry was evicted by put() of another file, so it's read and put again.
+            logger.debug("%s was evicted from cache while loading. it's read again.", path)
+            data, sw, params = read_wav_cached(cache, path, volume=volume, frame_rate=frame_rate, dtype=dtype, n_ch=n_ch)
+        return data
+    data, sw = read_wav(path, mmap=mmap)
+    return data
+
+class Stimulus(object):
+    """
+    audio data registered in DataHandler.
+
+    Attributes
+    ----------
+    data : np.ndarray
+        audio data which have a shape of (number of frames, number of channels).
+    path : str
+        path of loaded audio file. "PCM" if data was added by DataHandler.add_pcm().
+    volume : float
+        volume of audio data.
+    sample_width : int
+        sample width in byte of audio data.
+    params : dict or None
+        processing parameters used as key of StimulusCache. None if data is not cached.
+    """
+    __slots__ = ('data', 'path', 'volume', 'sample_width', 'params')
+
+    def __init__(self, data, path, volume=1.0, sample_width=None, params=None):
+        self.data = data
+        self.path = path
+        self.volume = volume
+        if sample_width is None:
+            sample_width = data.dtype.itemsize
+        self.sample_width = sample_width
+        self.params = params
+
+    @property
+    def n_frames(self):
+        return self.data.shape[0]
+
+    @property
+    def n_ch(self):
+        return self.data.shape[1]
+
 class DataHandler(object):
     """
     Handling wav files and pcm data.
@@ -15,9 +361,18 @@ class DataHandler(object):
         frame rate of data.
     verbose : bool, default=False
         verbosity while data loading.
+    cache : pyscab.StimulusCache, default=None
+        If it's set, loaded and windowed data will be stored in and memory-mapped from the cache.
+    format : {'INT16', 'UINT8'} or np.dtype, default=None
+        format which loaded audio data is converted to, e.g. format of pyscab.AudioInterface.
+        If it's None, format of each file is kept.
+    n_ch : int, default=None
+        number of channels which loaded audio data is converted to. If it's None, number of channels of each file is kept.
 
     Attributes
     ----------
+    stimuli : dict
+        loaded audio data (instance of Stimulus) indexed by id, in the order of registration.
     pcm_data : list
         loaded audio data.
     n_ch : list of int
@@ -36,21 +391,67 @@ class DataHandler(object):
         sample width in byte of loaded audio data.
     dtype : np.dtype
         data format type.
+    cache : pyscab.StimulusCache or None
+        cache of preprocessed data.
+    format : np.dtype or None
+        format which loaded audio data is converted to.
+    target_n_ch : int or None
+        number of channels which loaded audio data is converted to.
+    arena : pyscab.StimulusArena or None
+        arena which audio data was packed into by pack().
+
+    Notes
+    -----
+    pcm_data, n_ch, n_frames, paths, id, volume and sample_width are read-only lists built from stimuli.
+    Wav files whose frame rate is different from frame_rate are resampled when they are loaded.
+
+    Examples
+    --------
+    Audio data can be converted to the format of the device when it's loaded, so that no conversion is required while playing.
+
+    >>> ahc = pyscab.AudioInterface(device_name = 'default', n_ch = 2, format = "INT16", frame_rate = 48000)
+    >>> dh = pyscab.DataHandler(frame_rate = ahc.frame_rate, format = ahc.format)
     """   
 
-    def __init__(self, frame_rate = 44100, verbose=False):
-        self.pcm_data = list()
-        self.n_ch = list()
-        self.n_frames = list()
-        self.paths = list()
-        self.id = list()
-        self.volume = list()
+    def __init__(self, frame_rate = 44100, verbose=False, cache=None, format=None, n_ch=None):
+        self.stimuli = dict()
         self.frame_rate = frame_rate
-        self.sample_width = list()
         self.verbose = verbose
         self.dtype = np.dtype("int16")
+        self.cache = cache
+        self.format = _format2dtype(format)
+        self.target_n_ch = n_ch
+        self.arena = None
+
+    @property
+    def pcm_data(self):
+        return [stimulus.data for stimulus in self.stimuli.values()]
+
+    @property
+    def n_ch(self):
+        return [stimulus.n_ch for stimulus in self.stimuli.values()]
+
+    @property
+    def n_frames(self):
+        return [stimulus.n_frames for stimulus in self.stimuli.values()]
+
+    @property
+    def paths(self):
+        return [stimulus.path for stimulus in self.stimuli.values()]
+
+    @property
+    def id(self):
+        return list(self.stimuli.keys())
 
-    def load(self, id, path, volume=1.0):
+    @property
+    def volume(self):
+        return [stimulus.volume for stimulus in self.stimuli.values()]
+
+    @property
+    def sample_width(self):
+        return [stimulus.sample_width for stimulus in self.stimuli.values()]
+
+    def load(self, id, path, volume=1.0, mmap=False, replace=False):
         """
         Load wav file by path.
 
@@ -62,13 +463,28 @@ class DataHandler(object):
             file path of audio file to be loaded.
         volume : float, default=1.0
             volume for this audio data.
+        mmap : bool, default=False
+            If True, pcm payload of the wav file will be memory-mapped instead of being read.
+            Loaded data will be a read-only view of the file which has a shape of (number of frames, number of channels),
+            and pages of the file will be read when the data is accessed for the first time.
+        replace : bool, default=False
+            If True, audio data which already has the id will be replaced.
 
         Raises
         ------
         ValueError
-            Raises ValueError if existing (already been used) id is passed to id.
+            Raises ValueError if existing (already been used) id is passed to id and replace is False.
         ValueError
             Raises ValueError if format of loaded wav file is not Int16 or UInt8.
+        ValueError
+            Raises ValueError if mmap is True and volume is not 1.0.
+
+        Notes
+        -----
+        Memory-mapped data can not be scaled without being copied, so volume can not be applied with mmap=True.
+        If cache is set to DataHandler, data is always memory-mapped from the cache and volume can be applied regardless of mmap.
+        If frame rate, format or number of channels of the file is different from frame_rate, format or n_ch of DataHandler,
+        audio data is converted when it's loaded. Converted data is held in memory even if mmap is True, unless cache is set.
 
         Examples
         --------
@@ -77,95 +493,228 @@ class DataHandler(object):
         >>> import pyscab
         >>> dh = pyscab.DataHandler()
         >>> dh.load(1, path = "/home/USER/Music/something.wav", volume = 0.5)
-        """
-        if self._is_exist_id(id) is False:
-            self.id.append(id)
-        else:
-            raise ValueError("Passed id " + str(id) + " is dumplicated.")
 
-        f_name = os.path.basename(path)
+        Large files can be memory-mapped.
 
-        wf = wave.open(path, 'rb')
-        n_ch = wf.getnchannels()
+        >>> dh.load(2, path = "/home/USER/Music/long.wav", mmap = True)
+        """
+        if mmap and volume != 1.0 and self.cache is None:
+            raise ValueError("volume can not be applied to memory-mapped data.")
 
-        # it should be set in __init__()
-        sw = wf.getsampwidth()
-        if sw == 1:
-            self.dtype = dtype = np.dtype("uint8")
-        elif sw == 2:
-            self.dtype = dtype = np.dtype("int16")
-        else:
-            raise ValueError("file must be Int16 or UInt8 PCM wave format")
+        if replace is False and self._is_exist_id(id):
+            raise ValueError("Passed id " + str(id) + " is dumplicated.")
 
-        nf = wf.getnframes()
+        f_name = os.path.basename(path)
 
         if self.verbose:
             start = time.time()
             print("start loading : " + f_name)
 
         logger.debug("start loading : %s", path)
-        data = np.zeros((nf, n_ch)).astype(dtype)
 
-        data_wav = wf.readframes(nf)
-        data_wav = np.frombuffer(data_wav, dtype=dtype)
-        data_wav = data_wav * volume
-        data_wav = data_wav.astype(dtype)
-        for ch in range(n_ch):
-            data[:, ch] = data_wav[ch::n_ch]
+        if self.cache is None:
+            data, sw = read_wav(path, volume=volume, mmap=mmap, frame_rate=self.frame_rate, dtype=self.format, n_ch=self.target_n_ch)
+            params = None
+        else:
+            data, sw, params = read_wav_cached(self.cache, path, volume=volume, frame_rate=self.frame_rate, dtype=self.format, n_ch=self.target_n_ch)
+
+        # it should be set in __init__()
+        self.dtype = data.dtype
 
         if self.verbose:
             print("finish loading : " + str(f_name))
             end = time.time()
             print("elapsed time : " + str(end-start))
 
-        self.paths.append(path)
-        self.pcm_data.append(data)
-        self.n_ch.append(n_ch)
-        self.sample_width.append(sw)
-        self.n_frames.append(nf)
-        self.volume.append(volume)
+        self.stimuli[id] = Stimulus(data, path, volume, sw, params)
 
-    def apply_window(self, id, t_raise_fall):
+    def load_many(self, manifest, n_jobs=None, executor="thread", mmap=False, replace=False):
         """
-        Applying window function to data specified by id.
+        Load multiple wav files in parallel.
+
+        Parameters
+        ----------
+        manifest : list of tuple
+            list of (id, path) or (id, path, volume).
+        n_jobs : int, default=None
+            number of workers. If it's None, default of concurrent.futures will be used.
+        executor : {'thread', 'process'}, default='thread'
+            type of worker pool used for decoding and scaling.
+            With process, memory-mapped and cached data is mapped again in this process, so that it stays read-only and memory-mapped.
+        mmap : bool, default=False
+            If True, files will be memory-mapped. See load().
+        replace : bool, default=False
+            If True, audio data which already has the id will be replaced.
+
+        Returns
+        -------
+        report : list of dict
+            loading report of each file in the order of manifest.
+            keys : 'id', 'path', 'n_frames', 'elapsed'
+            'elapsed' is the time (in seconds) taken for reading the file in the worker.
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if duplicated id, or existing (already been used) id with replace=False is passed in manifest.
+            In that case, none of the files will be loaded.
+
+        Examples
+        --------
+        >>> dh = pyscab.DataHandler()
+        >>> report = dh.load_many([(1, "a.wav", 0.5), (2, "b.wav", 0.5)], n_jobs=4)
+        """
+        import concurrent.futures
+
+        entries = list()
+        ids = set()
+        for entry in manifest:
+            id, path = entry[0], entry[1]
+            volume = entry[2] if len(entry) > 2 else 1.0
+            if id in ids or (replace is False and self._is_exist_id(id)):
+                raise ValueError("Passed id " + str(id) + " is dumplicated.")
+            if mmap and volume != 1.0 and self.cache is None:
+                raise ValueError("volume can not be applied to memory-mapped data.")
+            ids.add(id)
+            entries.append((id, path, volume))
+
+        if executor == "thread":
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs)
+        elif executor == "process":
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs)
+        else:
+            raise ValueError("Unknown executor : " + str(executor) + ". It can only take thread or process.")
+
+        logger.debug("start loading %d files with %s pool", len(entries), executor)
+        with pool:
+            futures = [pool.submit(_read_wav_timed, path, volume, mmap, self.cache, self.frame_rate, self.format, self.target_n_ch,
+                                   executor == "process")
+                       for (id, path, volume) in entries]
+            results = [future.result() for future in futures]
+
+        report = list()
+        for (id, path, volume), (data, sw, params, elapsed) in zip(entries, results):
+            if data is None:
+                data = _remap(path, volume, mmap, self.cache, params, self.frame_rate, self.format, self.target_n_ch)
+            self.dtype = data.dtype
+            self.stimuli[id] = Stimulus(data, path, volume, sw, params)
+            report.append({'id': id, 'path': path, 'n_frames': data.shape[0], 'elapsed': elapsed})
+            if self.verbose:
+                print("loaded : " + os.path.basename(path) + ", elapsed time : " + str(elapsed))
+        return report
+
+    def load_directory(self, path, start_id=1, volume=1.0, n_jobs=None, executor="thread", mmap=False):
+        """
+        Load all wav files in a directory in parallel.
+
+        Files are sorted by name, and ids are given in that order starting from start_id.
+
+        Parameters
+        ----------
+        path : str
+            directory which contains wav files.
+        start_id : int, default=1
+            id for the first file.
+        volume : float, default=1.0
+            volume for all audio data.
+        n_jobs : int, default=None
+            number of workers.
+        executor : {'thread', 'process'}, default='thread'
+            type of worker pool.
+        mmap : bool, default=False
+            If True, files will be memory-mapped.
+
+        Returns
+        -------
+        report : list of dict
+            See load_many().
+        """
+        files = sorted(f for f in os.listdir(path) if f.lower().endswith(".wav"))
+        manifest = [(start_id + m, os.path.join(path, f), volume) for m, f in enumerate(files)]
+        return self.load_many(manifest, n_jobs=n_jobs, executor=executor, mmap=mmap)
+
+    def load_stream(self, id, path, volume=1.0, ring_frames=65536, replace=False):
+        """
+        Register wav file which is streamed from disk while it's played.
+
+        Only the header of the file is read here. Audio data is read by a background thread into a ring buffer
+        of ring_frames each time it's played, so that long files can be played without being loaded into memory.
 
         Parameters
         ----------
         id : int
-            data id to be applied filter function.
-        t_raise_fall : float
-            time duration for raise and fall.
+            id for this audio data.
+        path : str
+            file path of wav file.
+        volume : float, default=1.0
+            volume for this audio data. It's applied while mixing.
+        ring_frames : int, default=65536
+            size of ring buffer in frames.
+        replace : bool, default=False
+            If True, audio data which already has the id will be replaced.
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if existing (already been used) id is passed to id and replace is False.
 
         Notes
         -----
-        If r_raise_fall is set to 0.05. Both raising and falling time will be set to 0.05.
-        Currently, only linear function can be applied. Other function will be implemented in the future.
-        """
+        get_data_by_id() returns pyscab.WavStream for this id, which can be passed to play() of pyscab.AudioInterface.
+        Window can not be applied to streamed audio data.
 
-        n_frames = self.get_nframes_by_id(id)
-        fs = self.frame_rate
-
-        raise_ = np.arange(0, int(t_raise_fall*fs))
-        fall_ = np.arange(int(t_raise_fall*fs), 0, -1)
+        Examples
+        --------
+        >>> dh.load_stream(3, path = "/home/USER/Music/noise_60min.wav", volume = 0.3)
+        """
+        from .WavStream import WavStream
 
-        raise_ = raise_ / max(raise_)
-        fall_ = fall_ / max(fall_)
+        if replace is False and self._is_exist_id(id):
+            raise ValueError("Passed id " + str(id) + " is dumplicated.")
 
-        flat = np.ones((n_frames - np.size(raise_) - np.size(raise_)))
+        stream = WavStream(path, volume=volume, ring_frames=ring_frames)
+        if stream.header['frame_rate'] != self.frame_rate:
+            raise ValueError("frame rate of streamed file must be " + str(self.frame_rate) + ".")
+        if self.format is not None and stream.dtype != self.format:
+            raise ValueError("format of streamed file must be " + str(self.format) + ".")
+        logger.debug("%s was registered as stream.", path)
+        self.stimuli[id] = Stimulus(stream, path, volume, stream.header['sample_width'])
 
-        win_filter = np.concatenate([raise_, flat, fall_])
+    def apply_window(self, id, t_raise_fall, window="linear"):
+        """
+        Applying window function to data specified by id.
 
-        idx = self._id2idx(id)
-        n_ch = self.n_ch[idx]
+        Parameters
+        ----------
+        id : int
+            data id to be applied filter function.
+        t_raise_fall : float
+            time duration for raise and fall.
+        window : {'linear', 'cosine', 'hann', 'gaussian'}, default='linear'
+            shape of raise and fall.
 
-        win = np.zeros((np.size(win_filter), n_ch))
-        for m in range(n_ch):
-            win[:, m] = win_filter
+        Notes
+        -----
+        If r_raise_fall is set to 0.05. Both raising and falling time will be set to 0.05.
+        Window is applied in place to the first and the last t_raise_fall of the data. See pyscab.apply_envelope().
+        Read-only data (e.g. memory-mapped) is copied before it's windowed.
+        If the data was loaded through cache, windowed data will also be cached.
+        """
+        stimulus = self._get(id)
+        if not isinstance(stimulus.data, np.ndarray):
+            raise ValueError("window can not be applied to streamed audio data.")
+        if self.cache is not None and stimulus.params is not None:
+            params = dict(stimulus.params, window=window.lower(), t_raise_fall=t_raise_fall, frame_rate=self.frame_rate)
+            key = self.cache.make_key(**params)
+            data = self.cache.get(key)
+            if data is None:
+                data = self.cache.put(key, apply_envelope(stimulus.data, t_raise_fall, self.frame_rate, window))
+            stimulus.data = data
+            stimulus.params = params
+        else:
+            stimulus.data = apply_envelope(stimulus.data, t_raise_fall, self.frame_rate, window)
 
-        self.pcm_data[idx] = self.pcm_data[idx]*win
-        self.pcm_data[idx] = self.pcm_data[idx].astype(self.dtype)
-    
-    def add_pcm(self, id, data):
+    def add_pcm(self, id, data, replace=False):
         """
         Add the pcm audio data (matrix) to DataHandler.
 
@@ -175,29 +724,194 @@ class DataHandler(object):
             id for this audio data.
         data : np.ndarray
             audio data. shoule have shape of (number of samples, number of channels)
+        replace : bool, default=False
+            If True, audio data which already has the id will be replaced.
 
         Notes
         -----
         File path will be automatically set to "PCM"
+        If format or n_ch is set to DataHandler, data is converted to them. Frame rate of data is assumed to be frame_rate.
+        data is copied, so that apply_window() doesn't change the passed array, or other ids added from the same array.
 
         Raises
         ------
         ValueError
-            Raises ValueError if existing (already been used) id is passed to id.
+            Raises ValueError if existing (already been used) id is passed to id and replace is False.
         """
-        if self._is_exist_id(id) is False:
-            self.id.append(id)
-        else:
+        if replace is False and self._is_exist_id(id):
             raise ValueError("Passed id " + str(id) + " is dumplicated.")
 
         if data.ndim == 1:
             data = np.atleast_2d(data)
             data = data.transpose()
 
-        self.paths.append("PCM")
-        self.pcm_data.append(data)
-        self.n_frames.append(data.shape[0])
-        self.n_ch.append(data.shape[1])
+        if (self.format is not None and data.dtype != self.format) or (self.target_n_ch is not None and data.shape[1] != self.target_n_ch):
+            data = convert_pcm(data, self.frame_rate, dtype=self.format, n_ch=self.target_n_ch)
+        else:
+            # windows are applied in place, so DataHandler owns its own copy
+            data = np.array(data)
+
+        self.stimuli[id] = Stimulus(data, "PCM")
+
+    def add_tones(self, specs, format=None, window="linear", t_raise_fall=0.01, replace=False):
+        """
+        Generate pure tones and add them to DataHandler.
+
+        Tones are generated at once by pyscab.generate_tones() with frame_rate, and stored as mono audio data,
+        which is routed to channels while playing instead of being repeated.
+
+        Parameters
+        ----------
+        specs : list of dict
+            specification of each tone. keys : 'id', 'frequency', 'duration', and optionally 'volume', 'window' and 't_raise_fall'.
+            See pyscab.generate_tones().
+        format : {'INT16', 'UINT8'}, default=None
+            format of tones. If it's None, format of DataHandler is used, or 'INT16' if it's not set.
+        window : {'linear', 'cosine', 'hann', 'gaussian'} or None, default='linear'
+            window applied to tones which don't specify 'window'.
+        t_raise_fall : float, default=0.01
+            time duration for raise and fall of tones which don't specify 't_raise_fall'.
+        replace : bool, default=False
+            If True, audio data which already has the id will be replaced.
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if duplicated id, or existing (already been used) id with replace=False is passed in specs.
+            In that case, none of the tones will be added.
+
+        Examples
+        --------
+        >>> specs = [{'id': m+1, 'frequency': f, 'duration': 0.1} for m, f in enumerate([440, 494, 523, 587])]
+        >>> dh.add_tones(specs)
+        """
+        ids = set()
+        for spec in specs:
+            id = spec['id']
+            if id in ids or (replace is False and self._is_exist_id(id)):
+                raise ValueError("Passed id " + str(id) + " is dumplicated.")
+            ids.add(id)
+
+        if format is None:
+            format = "INT16" if self.format is None else self.format.name
+        tones = generate_tones(specs, fs=self.frame_rate, format=format, window=window, t_raise_fall=t_raise_fall)
+        for spec, tone in zip(specs, tones):
+            self.stimuli[spec['id']] = Stimulus(tone, "PCM", spec.get('volume', 1.0))
+
+    def pack(self, shared=False):
+        """
+        Pack all audio data into one contiguous buffer.
+
+        Audio data is copied into a new pyscab.StimulusArena, and replaced with read-only views of it,
+        so that thousands of short stimuli don't fragment memory.
+
+        Parameters
+        ----------
+        shared : bool, default=False
+            If True, the arena is allocated in shared memory. See pyscab.StimulusArena.pack().
+
+        Returns
+        -------
+        arena : pyscab.StimulusArena
+
+        Notes
+        -----
+        Streamed audio data is not packed. Audio data added after pack() is held separately until pack() is called again.
+        If shared is True, arena.close() should be called to release shared memory when it's no longer used.
+        """
+        from .StimulusArena import StimulusArena
+
+        stimuli = [(id, stimulus) for id, stimulus in self.stimuli.items() if isinstance(stimulus.data, np.ndarray)]
+        arena = StimulusArena.pack(stimuli, self.frame_rate, shared=shared)
+        for id, data, entry in arena.items():
+            self.stimuli[id].data = data
+        self.arena = arena
+        return arena
+
+    def save_arena(self, path):
+        """
+        Save all audio data into a single file in the layout of pyscab.StimulusArena.
+
+        Parameters
+        ----------
+        path : str
+            file path of the arena.
+
+        Notes
+        -----
+        Streamed audio data is not saved. ids should be int or str.
+        """
+        from .StimulusArena import StimulusArena
+
+        stimuli = [(id, stimulus) for id, stimulus in self.stimuli.items() if isinstance(stimulus.data, np.ndarray)]
+        StimulusArena.write(path, stimuli, self.frame_rate)
+
+    def load_arena(self, source, mmap=True, replace=False):
+        """
+        Load all audio data in an arena.
+
+        Parameters
+        ----------
+        source : str or pyscab.StimulusArena
+            file path of the arena saved by save_arena(), or arena (e.g. attached from shared memory).
+        mmap : bool, default=True
+            If True, the file is memory-mapped. See pyscab.StimulusArena.load().
+        replace : bool, default=False
+            If True, audio data which already has the id will be replaced.
+
+        Returns
+        -------
+        arena : pyscab.StimulusArena
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if existing (already been used) id is in the arena and replace is False.
+            In that case, none of the audio data will be loaded.
+        ValueError
+            Raises ValueError if frame rate or format of the arena is different from frame_rate or format of DataHandler.
+
+        Examples
+        --------
+        >>> dh = pyscab.DataHandler()
+        >>> dh.load_arena("/home/USER/stimuli.arena")
+        """
+        from .StimulusArena import StimulusArena
+
+        arena = source if isinstance(source, StimulusArena) else StimulusArena.load(source, mmap=mmap)
+        if arena.frame_rate != self.frame_rate:
+            raise ValueError("frame rate of arena must be " + str(self.frame_rate) + ".")
+        for id, data, entry in arena.items():
+            if replace is False and self._is_exist_id(id):
+                raise ValueError("Passed id " + str(id) + " is dumplicated.")
+            if self.format is not None and data.dtype != self.format:
+                raise ValueError("format of arena must be " + str(self.format) + ".")
+            if self.target_n_ch is not None and data.shape[1] != self.target_n_ch:
+                raise ValueError("number of channels of arena must be " + str(self.target_n_ch) + ".")
+
+        for id, data, entry in arena.items():
+            self.dtype = data.dtype
+            self.stimuli[id] = Stimulus(data, entry['path'], entry['volume'], entry['sample_width'])
+        self.arena = arena
+        logger.debug("%d audio data were loaded from arena.", len(arena))
+        return arena
+
+    def remove(self, id):
+        """
+        Remove the audio data specified by id.
+
+        Parameters
+        ----------
+        id : int
+            id of audio data.
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if id does not exist.
+        """
+        self._get(id)
+        del self.stimuli[id]
 
     def get_nframes_by_id(self, id):
         """
@@ -213,7 +927,7 @@ class DataHandler(object):
         number_of_frames : int
             number of frames of the audio data specified by id.
         """
-        return np.shape(self.get_data_by_id(id))[0]
+        return self._get(id).n_frames
 
     def get_length_by_id(self, id):
         """
@@ -246,8 +960,7 @@ class DataHandler(object):
         data : np.ndarray
             audio data array specified by id.
         """
-        idx = self._id2idx(id)
-        return self.pcm_data[idx]
+        return self._get(id).data
 
     def get_n_ch_by_id(self, id):
         """
@@ -263,8 +976,7 @@ class DataHandler(object):
         number_of_channels : int
             number of channels of audio data specified by id.
         """
-        idx = self._id2idx(id)
-        return self.n_ch[idx]
+        return self._get(id).n_ch
 
     def get_path_by_id(self,id):
         """
@@ -280,19 +992,13 @@ class DataHandler(object):
         path : str
             file path of audio data specified by id.
         """
-        idx = self._id2idx(id)
-        return self.paths[idx]
+        return self._get(id).path
 
-    def _id2idx(self, id):
-        idx = np.where(np.array(self.id) == id)
-        if len(idx[0]) == 0:
-            return None
-            #raise ValueError("id does not exist.")
-        else:
-            return int(idx[0])
+    def _get(self, id):
+        try:
+            return self.stimuli[id]
+        except KeyError:
+            raise ValueError("id " + str(id) + " does not exist.") from None
 
     def _is_exist_id(self, id):
-        if self._id2idx(id) == None:
-            return False
-        else:
-            return True
\ No newline at end of file
+        return id in self.stimuli
\ No newline at end of file
@@ -1,18 +1,507 @@
-import pyaudio
+try:
+    import pyaudio
+except ImportError:
+    # pyaudio is not required for NullBackend.
+    pyaudio = None
 import numpy as np
+import time
+import collections
+import heapq
+import itertools
+import threading
+from .NullBackend import NullBackend, PA_INT16, PA_UINT8
+from .Telemetry import Telemetry
+from .WavStream import WavStream
 from logging import getLogger
 logger = getLogger('pyscab.'+__name__)
 
+class StopRequest(object):
+    """
+    request to stop all voices, which is handed over to pyscab.Mixer.
+
+    Parameters
+    ----------
+    fade_frames : int, default=0
+        length of fade-out in frames. If it's 0, voices are stopped immediately.
+
+    Attributes
+    ----------
+    fade : np.ndarray or None
+        gain applied to sounding voices from the beginning of the buffer at which the request is processed.
+    frame : int or None
+        frame of the stream at which voices were stopped. It's set by the mixer.
+        Voices whose onset_frame is smaller than this frame were played, and the others were skipped.
+        None until the request is processed.
+    """
+    def __init__(self, fade_frames=0):
+        self.frame = None
+        self.fade = None
+        if fade_frames > 0:
+            self.fade = np.linspace(1, 0, fade_frames+1, dtype=np.float32)[1:]
+
+class Mixer(object):
+    """
+    mixing active voices into output buffer of audio device.
+
+    Each active voice occupies a slot of preallocated stack which has a shape of
+    (max_voices * number of channels, frames per buffer). Each row of the stack holds a chunk of one channel of the voice.
+    Chunks of all voices are copied into their rows, and then mixed and routed to channels of the device
+    by a single matrix product with the routing matrix which has a shape of (number of channels, max_voices * number of channels).
+    Thus, gathering chunks takes one copy per voice regardless of number of channels, and it's done in a loop over voices,
+    while mixing and routing of all voices are done by a single matrix product regardless of number of voices.
+    For a few voices, the matrix product costs more than adding chunks to the output directly.
+
+    Voices are mixed in float32. By default, the mixed data is converted to format as integer addition does,
+    so overlapping voices may wrap around. If limiter is set, the mixed data is saturated ('clip')
+    or soft-limited ('soft') to the range of format instead, and the number of clipped samples is counted.
+
+    Voices are handed over to the mixer through the queue of pending voices (see submit()),
+    and finished voices are moved to the queue of retired voices, which should be emptied outside of the callback (see reap()).
+    Both queues are collections.deque, whose append() and popleft() are atomic, so no lock is required.
+
+    If start_frame of the voice is set, the voice is started at that frame of the stream
+    (counted by attribute frame) instead of the beginning of the next buffer, so onsets are sample-accurate.
+
+    Readers of voices streamed from disk are opened stream_lookahead frames before their start_frame by open_streams(),
+    or when they are submitted if start_frame is not set, so that scheduled streams don't hold files and ring buffers until they are needed.
+    Opening a reader allocates its ring buffer and starts its thread, so it's never done in mix().
+    Scheduled streams are kept aside until they are opened, and only voices whose readers are opened are handed over to the mixer.
+    The ring buffer is filled by the thread of the reader while the mixer keeps mixing.
+
+    Parameters
+    ----------
+    n_ch : int
+        number of channels of device.
+    frames_per_buffer : int
+        frames per buffer of device.
+    format : np.dtype, default=np.dtype('int16')
+        audio data format of device.
+    max_voices : int, default=64
+        initial number of slots. It will be extended automatically if it's not enough.
+    limiter : {None, 'clip', 'soft'}, default=None
+        conversion of mixed data to format.
+        None : overflow wraps around.
+        'clip' : saturating conversion.
+        'soft' : samples above the threshold are compressed smoothly by tanh, and saturated at the range of format.
+    threshold : float, default=0.8
+        threshold of 'soft' limiter relative to full scale.
+    stream_lookahead : int, default=65536
+        number of frames before start_frame at which readers of streamed voices are opened by open_streams().
+
+    Attributes
+    ----------
+    voices : list of pyscab.ReadAudioChunk
+        active voices. Index of the list corresponds to the slot.
+    pending : collections.deque of pyscab.ReadAudioChunk
+        voices which were submitted but not started yet.
+    retired : collections.deque of pyscab.ReadAudioChunk
+        finished voices which were not reaped yet.
+    prefetch : list
+        heap of scheduled streams whose readers are not opened yet.
+    frame : int
+        number of frames mixed so far, i.e. frame of the stream at the beginning of the next buffer.
+    out : np.ndarray
+        output buffer which have a shape of (frames per buffer, number of channels)
+    n_clipped : int
+        number of output samples which exceeded the range of format. It's counted only if limiter is set.
+    """
+    def __init__(self, n_ch, frames_per_buffer, format=np.dtype("int16"), max_voices=64, limiter=None, threshold=0.8, stream_lookahead=65536):
+        self.n_ch = n_ch
+        self.frames_per_buffer = frames_per_buffer
+        self.format = np.dtype(format)
+        # uint8 pcm is offset binary, mix it around 128.
+        if self.format == np.dtype("uint8"):
+            self.bias = np.float32(128)
+        else:
+            self.bias = np.float32(0)
+        if limiter not in (None, 'clip', 'soft'):
+            raise ValueError("Unknown limiter : " + str(limiter) + ". It can only take None, 'clip' or 'soft'.")
+        self.limiter = limiter
+        info = np.iinfo(self.format)
+        self.lower = np.float32(info.min - self.bias)
+        self.upper = np.float32(info.max - self.bias)
+        self.threshold = np.float32(threshold*self.upper)
+        self.n_clipped = 0
+        self.voices = list()
+        self.pending = collections.deque()
+        self.retired = collections.deque()
+        # heap of (start frame, sequence, index, batch) for voices which have start_frame
+        self.timeline = list()
+        # heap of (start frame, sequence, index, batch) for streamed voices whose readers are not opened yet.
+        # it's never touched by mix(), and guarded by the lock.
+        self.prefetch = list()
+        self._prefetch_lock = threading.Lock()
+        self.stream_lookahead = stream_lookahead
+        self._seq = itertools.count()
+        self.frame = 0
+        self.max_voices = 0
+        self.stack = np.zeros((0, frames_per_buffer), dtype=np.float32)
+        self.routing = np.zeros((n_ch, 0), dtype=np.float32)
+        self.pos = np.zeros(0, dtype=np.int64)
+        self.length = np.zeros(0, dtype=np.int64)
+        self._allocate(max_voices)
+        self.acc = np.zeros((n_ch, frames_per_buffer), dtype=np.float32)
+        self._acc_int = np.zeros((frames_per_buffer, n_ch), dtype=np.int32)
+        self._tmp = np.zeros((n_ch, frames_per_buffer), dtype=np.float32)
+        self._tmp2 = np.zeros((n_ch, frames_per_buffer), dtype=np.float32)
+        self._mask = np.zeros((n_ch, frames_per_buffer), dtype=bool)
+        self.out = np.zeros((frames_per_buffer, n_ch), dtype=self.format)
+
+    def _allocate(self, max_voices):
+        w = self.n_ch
+        n = self.max_voices
+        stack = np.zeros((max_voices*w, self.frames_per_buffer), dtype=np.float32)
+        stack[:n*w] = self.stack
+        routing = np.zeros((w, max_voices*w), dtype=np.float32)
+        routing[:, :n*w] = self.routing
+        pos = np.zeros(max_voices, dtype=np.int64)
+        pos[:n] = self.pos
+        length = np.zeros(max_voices, dtype=np.int64)
+        length[:n] = self.length
+        self.stack, self.routing, self.pos, self.length = stack, routing, pos, length
+        self.max_voices = max_voices
+
+    def submit(self, voice):
+        """
+        hand over voice to the mixer. It can be called from any thread.
+
+        The voice will be started at the beginning of the next call of mix(), or at its start_frame.
+        If the voice is streamed and has start_frame, it's handed over when its reader is opened by open_streams().
+
+        Parameters
+        ----------
+        voice : pyscab.ReadAudioChunk
+            voice to be played.
+        """
+        if voice.data is None and voice.start_frame is not None:
+            with self._prefetch_lock:
+                heapq.heappush(self.prefetch, (voice.start_frame, next(self._seq), 0, [voice]))
+            return
+        if voice.data is None:
+            # streamed voice is started right away, so its reader is opened in the calling thread
+            voice.open()
+        self.pending.append(voice)
+
+    def schedule(self, voices):
+        """
+        hand over voices which have start_frame to the mixer at once. It can be called from any thread.
+
+        Parameters
+        ----------
+        voices : list of pyscab.ReadAudioChunk
+            voices to be played. start_frame of all voices should be set.
+            Streamed voices are handed over when their readers are opened by open_streams().
+        """
+        voices = sorted(voices, key=lambda voice: voice.start_frame)
+        streams = [voice for voice in voices if voice.data is None]
+        if streams:
+            with self._prefetch_lock:
+                heapq.heappush(self.prefetch, (streams[0].start_frame, next(self._seq), 0, streams))
+            voices = [voice for voice in voices if voice.data is not None]
+        if voices:
+            self.pending.append(voices)
+
+    def open_streams(self):
+        """
+        open readers of scheduled streams which are started within stream_lookahead frames, and hand them over to the mixer.
+        It should be called outside of the callback, periodically while streams are scheduled.
+
+        Returns
+        -------
+        n_opened : int
+            number of opened readers.
+        """
+        n_opened = 0
+        # lock is held until opened voices are handed over, so that stop() doesn't miss them
+        with self._prefetch_lock:
+            prefetch = self.prefetch
+            horizon = self.frame + self.frames_per_buffer + self.stream_lookahead
+            while prefetch and prefetch[0][0] < horizon:
+                start_frame, seq, idx, batch = heapq.heappop(prefetch)
+                # the reader fills its ring buffer in its own thread until the voice is started
+                batch[idx].open()
+                self.pending.append(batch[idx])
+                n_opened += 1
+                if idx+1 < len(batch):
+                    heapq.heappush(prefetch, (batch[idx+1].start_frame, seq, idx+1, batch))
+        return n_opened
+
+    def _drop_prefetch(self):
+        # streams which are not opened yet are skipped, and retired so that they are counted by reap()
+        for start_frame, seq, idx, batch in self.prefetch:
+            for voice in batch[idx:]:
+                voice.finished = True
+                self.retired.append(voice)
+        self.prefetch = list()
+
+    def stop(self, fade_frames=0):
+        """
+        stop all active and scheduled voices at the beginning of the next buffer. It can be called from any thread.
+
+        Voices which are handed over after this call are not affected.
+
+        Parameters
+        ----------
+        fade_frames : int, default=0
+            length of fade-out in frames applied to voices which are already sounding.
+
+        Returns
+        -------
+        request : pyscab.StopRequest
+        """
+        request = StopRequest(fade_frames)
+        with self._prefetch_lock:
+            self._drop_prefetch()
+            self.pending.append(request)
+        return request
+
+    def _stop_all(self, request):
+        # scheduled voices are skipped, and retired so that their streams are closed by reap()
+        for start_frame, seq, idx, batch in self.timeline:
+            for voice in batch[idx:]:
+                voice.finished = True
+                self.retired.append(voice)
+        self.timeline = list()
+        for slot in range(len(self.voices)-1, -1, -1):
+            voice = self.voices[slot]
+            if request.fade is None or voice.onset_frame >= self.frame:
+                voice.finished = True
+                self._remove(slot)
+            elif voice.fade is None:
+                voice.fade = request.fade
+                voice.fade_pos = 0
+                # voice is finished at the end of fade-out
+                self.length[slot] = min(self.length[slot], self.pos[slot] + request.fade.shape[0])
+        request.frame = self.frame
+
+    def _receive(self):
+        while self.pending:
+            item = self.pending.popleft()
+            if isinstance(item, StopRequest):
+                self._stop_all(item)
+            elif isinstance(item, list):
+                heapq.heappush(self.timeline, (item[0].start_frame, next(self._seq), 0, item))
+            elif item.start_frame is None:
+                self.add(item)
+            else:
+                heapq.heappush(self.timeline, (item.start_frame, next(self._seq), 0, [item]))
+
+    def clear(self):
+        """
+        stop all active, pending and scheduled voices immediately and release them.
+
+        It should be called from the thread which calls mix(), or after the audio stream was stopped.
+
+        Returns
+        -------
+        n_reaped : int
+            number of released voices.
+        """
+        with self._prefetch_lock:
+            self._drop_prefetch()
+        self._receive()
+        self._stop_all(StopRequest())
+        return self.reap()
+
+    def _fade(self, voice, rows):
+        frame_count = rows.shape[1]
+        ramp = voice.fade[voice.fade_pos:voice.fade_pos+frame_count]
+        n = ramp.shape[0]
+        if self.bias:
+            rows -= self.bias
+        rows[:, :n] *= ramp
+        rows[:, n:] = 0
+        if self.bias:
+            rows += self.bias
+        voice.fade_pos += frame_count
+
+    def reap(self):
+        """
+        release finished voices. It should be called outside of the callback.
+
+        Returns
+        -------
+        n_reaped : int
+            number of released voices.
+        """
+        n_reaped = 0
+        while True:
+            try:
+                voice = self.retired.popleft()
+            except IndexError:
+                return n_reaped
+            if voice.data is None:
+                voice.close()
+            n_reaped += 1
+
+    def get_n_active(self):
+        """
+        get number of currently sounding voices.
+
+        Returns
+        -------
+        n_active : int
+        """
+        return len(self.voices)
+
+    def add(self, voice, offset=0):
+        """
+        start mixing voice. It should be called from the thread which calls mix().
+
+        Parameters
+        ----------
+        voice : pyscab.ReadAudioChunk
+            voice to be played.
+        offset : int, default=0
+            offset (in frames) of the onset from the beginning of the next buffer.
+        """
+        slot = len(self.voices)
+        if slot == self.max_voices:
+            logger.debug("number of voices exceeded %d, slots were extended.", self.max_voices)
+            self._allocate(self.max_voices*2)
+        w = self.n_ch
+        cols = self.routing[:, slot*w:(slot+1)*w]
+        cols.fill(0)
+        for ch, idx_src in zip(voice.get_ch(), voice.routing):
+            cols[ch-1, idx_src] += voice.volume
+        voice.n_cols = max(voice.routing) + 1
+        # negative position means that the voice starts in the middle of the buffer
+        self.pos[slot] = -offset
+        voice.onset_frame = self.frame + offset
+        self.length[slot] = voice.n_frames
+        self.voices.append(voice)
+
+    def _remove(self, slot):
+        w = self.n_ch
+        last = len(self.voices) - 1
+        voice = self.voices[slot]
+        if slot != last:
+            self.voices[slot] = self.voices[last]
+            self.routing[:, slot*w:(slot+1)*w] = self.routing[:, last*w:(last+1)*w]
+            self.pos[slot] = self.pos[last]
+            self.length[slot] = self.length[last]
+        self.voices.pop()
+        self.retired.append(voice)
+
+    def _limit(self, acc):
+        frame_count = acc.shape[1]
+        mask = self._mask[:, :frame_count]
+        np.greater(acc, self.upper, out=mask)
+        n_clipped = np.count_nonzero(mask)
+        np.less(acc, self.lower, out=mask)
+        n_clipped += np.count_nonzero(mask)
+        self.n_clipped += n_clipped
+
+        if self.limiter == 'soft':
+            knee = self.upper - self.threshold
+            excess = self._tmp[:, :frame_count]
+            delta = self._tmp2[:, :frame_count]
+            # excess = max(|acc| - threshold, 0)
+            np.abs(acc, out=excess)
+            np.subtract(excess, self.threshold, out=excess)
+            np.maximum(excess, 0, out=excess)
+            # acc = sign(acc) * (threshold + knee*tanh(excess/knee)) for samples above threshold
+            np.divide(excess, knee, out=delta)
+            np.tanh(delta, out=delta)
+            np.multiply(delta, knee, out=delta)
+            np.subtract(excess, delta, out=delta)
+            np.copysign(delta, acc, out=delta)
+            np.subtract(acc, delta, out=acc)
+        np.rint(acc, out=acc)
+        np.clip(acc, self.lower, self.upper, out=acc)
+
+    def mix(self, frame_count):
+        """
+        mix next chunk of all active voices.
+
+        Parameters
+        ----------
+        frame_count : int
+            number of frames to be mixed. It should not exceed frames per buffer.
+
+        Returns
+        -------
+        out : np.ndarray
+            mixed audio data which have a shape of (frame_count, number of channels)
+        """
+        self._receive()
+
+        frame_end = self.frame + frame_count
+        timeline = self.timeline
+        while timeline and timeline[0][0] < frame_end:
+            start_frame, seq, idx, batch = heapq.heappop(timeline)
+            # voices which were scheduled too late are started at the beginning of the buffer
+            self.add(batch[idx], offset=max(start_frame - self.frame, 0))
+            if idx+1 < len(batch):
+                heapq.heappush(timeline, (batch[idx+1].start_frame, seq, idx+1, batch))
+
+        w = self.n_ch
+        n_voices = len(self.voices)
+        stack = self.stack[:n_voices*w, :frame_count]
+        positions = self.pos[:n_voices].tolist()
+        lengths = self.length[:n_voices].tolist()
+        for slot, voice in enumerate(self.voices):
+            start = positions[slot]
+            end = start + frame_count
+            k = voice.n_cols
+            row = slot*w
+            if voice.data is not None and start >= 0 and end <= lengths[slot]:
+                stack[row:row+k] = voice.data[start:end, :k].T
+            else:
+                # beginning or end of the voice is in this buffer
+                offset = max(-start, 0)
+                start = max(start, 0)
+                n = max(min(frame_count - offset, lengths[slot] - start), 0)
+                stack[row:row+k, :offset] = self.bias
+                if voice.data is not None:
+                    stack[row:row+k, offset:offset+n] = voice.data[start:start+n, :k].T
+                else:
+                    n_read = voice.stream.read(stack[row:row+k, offset:offset+n], block=voice.blocking)
+                    if n_read < n:
+                        voice.stream.n_underrun += n - n_read
+                        stack[row:row+k, offset+n_read:offset+n] = self.bias
+                stack[row:row+k, offset+n:] = self.bias
+            if voice.fade is not None:
+                self._fade(voice, stack[row:row+k])
+
+        routing = self.routing[:, :n_voices*w]
+        acc = self.acc[:, :frame_count]
+        np.matmul(routing, stack, out=acc)
+        if self.bias:
+            # remove offset of uint8 data, which is added once per routed channel
+            acc -= (self.bias * routing.sum(axis=1))[:, np.newaxis]
+        if self.limiter is not None:
+            self._limit(acc)
+        if self.bias:
+            acc += self.bias
+        # values are converted via int32 so that overflow wraps around in the same way as integer addition
+        np.copyto(self._acc_int[:frame_count], acc.T, casting='unsafe')
+        out = self.out[:frame_count]
+        np.copyto(out, self._acc_int[:frame_count], casting='unsafe')
+
+        pos = self.pos[:n_voices]
+        pos += frame_count
+        finished = np.flatnonzero(pos >= self.length[:n_voices])
+        for slot in finished[::-1].tolist():
+            self.voices[slot].finished = True
+            self._remove(slot)
+        self.frame = frame_end
+        return out
+
 class CallbackParams(object):
     """
     class for referencing parameters of callback function of portaudio.
 
     Attributes
     ----------
-    data : list of pyscab.ReadAudioChunk
-        containing audio data to play.
-    data_finished : list of bool
-        True if all audio data in attribute data which has corresponding index were played.
+    mixer : pyscab.Mixer
+        mixer for audio data to play.
+    time : dict
+        time information of the last callback.
+    clock : tuple
+        (frame of the stream at the beginning of the last buffer, time information of the last callback).
+    telemetry : pyscab.Telemetry or None
+        If it's set, each callback is recorded.
     """
     def __init__(self):
         self.init()
@@ -21,38 +510,83 @@ class CallbackParams(object):
         """
         initialize all parameters hold by CallbackParams instance.
         """
-        self.data = list()
-        self.data_finished = list()
         self.format = None
         self.time = None
+        self.clock = None
         self.n_ch = None
+        self.mixer = None
         self.data_callback = None
+        self.telemetry = None
 
 callback_params = CallbackParams()
 
+# same value as pyaudio.paContinue
+PA_CONTINUE = 0
+
 def callback(in_data, frame_count, time_info, status, p=callback_params):
-    #data = np.zeros((frame_count, p.n_ch), dtype=p.format)
-    p.data_callback.fill(0)
-    for idx, is_finished in enumerate(p.data_finished):
-    #for idx_audio, audio in enumerate(p.data):
-    #for audio in p.data:
-        if is_finished is False:
-            chunk = p.data[idx].read_chunk()
-            for idx_ch, ch in enumerate(p.data[idx].get_ch()):
-                p.data_callback[:, ch-1] += chunk[:, idx_ch]
-        #else:
-        #    p.data_finished[idx] = True
-            # if all audio chunks were loaded, delete the instance
-            #
-            # deleted this in ver. 0.0.6, since doing this will take time and makes problem with presenting short audio with fast SOA.
-            #del p.data[idx_audio]
+    start = time.perf_counter()
+    frame = p.mixer.frame
+    data = p.mixer.mix(frame_count)
     p.time = time_info
-    return (np.ravel(p.data_callback, order='C'), pyaudio.paContinue)
+    p.clock = (frame, time_info)
+    if p.telemetry is not None:
+        p.telemetry.record_callback(time_info['current_time'], time.perf_counter() - start, p.mixer.get_n_active(), status)
+    return (np.ravel(data, order='C'), PA_CONTINUE)
+
+def check_channels(ch, n_ch):
+    """
+    check channel numbers to play audio data.
+
+    Parameters
+    ----------
+    ch : list of int
+        channel numbers (start from 1).
+    n_ch : int
+        number of channels of device.
+
+    Raises
+    ------
+    ValueError
+        Raises ValueError if channel number is out of range of opened channels.
+    """
+    if len(ch) == 0 or len(ch) > n_ch or min(ch) < 1 or max(ch) > n_ch:
+        raise ValueError("ch " + str(ch) + " is out of range. Number of channels is " + str(n_ch) + ".")
+
+def make_voice(data, chunk_size, ch, volume=1.0, format=np.dtype("int16"), idx_obj=None, blocking=False):
+    """
+    make voice for audio data.
+
+    Parameters
+    ----------
+    data : np.ndarray or pyscab.WavStream
+        audio data.
+    chunk_size : int
+        chunk size.
+    ch : list of int
+        channel number of device which audio data will be played.
+    volume : float, default=1.0
+        gain applied while mixing.
+    format : np.dtype, default=np.dtype('int16')
+        audio data format
+    idx_obj : int, default=None
+        id of instance.
+    blocking : bool, default=False
+        If True, the mixer waits for audio data streamed from disk instead of filling silence, e.g. for offline rendering.
+
+    Returns
+    -------
+    voice : pyscab.ReadAudioChunk or pyscab.StreamingAudioChunk
+    """
+    if isinstance(data, WavStream):
+        return StreamingAudioChunk(data, chunk_size, ch, volume=volume, format=format, idx_obj=idx_obj, blocking=blocking)
+    return ReadAudioChunk(data, chunk_size, ch, volume=volume, format=format, idx_obj=idx_obj)
 
 def show_devices():
     """
     print available devices connected to the computer.
     """
+    if pyaudio is None:
+        raise ImportError("pyaudio is required for show_devices().")
     pya = pyaudio.PyAudio()
     hi = HardwareInformation(pya)
     devices = hi.devices
@@ -113,8 +647,8 @@ class AudioInterface(object):
         frame rate of device.
     frames_per_butter : int
         frames per buffer
-    pya : instance of pyaudio.PyAudio()
-        instance of PyAudio device.
+    pya : instance of pyaudio.PyAudio() or pyscab.NullBackend()
+        instance of audio backend.
     device_idx : int
         device index of opened device.
     num_cannels : int
@@ -131,7 +665,10 @@ class AudioInterface(object):
                  n_ch = 2,
                  format="INT16",
                  frame_rate=44100,
-                 frames_per_buffer=512,):
+                 frames_per_buffer=512,
+                 limiter=None,
+                 backend='pyaudio',
+                 telemetry=None):
         """
         set audio device to be used and its settings
 
@@ -139,7 +676,7 @@ class AudioInterface(object):
         ----------
         device_name : str, default=None
             device name to be opened.
-            If it's None, 'default' will be used for Linux and 'ASIO4ALL' for Windows.
+            If it's None, 'default' will be used for Linux and 'ASIO4ALL' for Windows, and 'null' for null backend.
         n_ch : int, default=2
             number of channels to be opened
         format : {'INT16', 'UINT8'}, default='INT16'
@@ -148,8 +685,29 @@ class AudioInterface(object):
             frame rate of audio device.
         frames_per_butter : int, default=512
             frames per butter of audio device. Which means chunk size of audio data read in callback function will be set to this value.
+        limiter : {None, 'clip', 'soft'}, default=None
+            conversion of mixed audio data to format. See pyscab.Mixer.
+            If it's set, overlapping audio data will be saturated instead of wrapping around, and volume can be set for each play().
+        backend : {'pyaudio', 'null'} or object, default='pyaudio'
+            audio backend. If it's 'null', pyscab.NullBackend() is used, which runs without audio device.
+            Instance of pyscab.NullBackend or any object which has same interface as pyaudio.PyAudio can also be passed.
+        telemetry : pyscab.Telemetry or bool, default=None
+            If it's set, execution time, status flags and number of active voices of each callback are recorded,
+            and StimulationController.play() records lateness of each onset. If it's True, pyscab.Telemetry() is used.
         """
-        if device_name is None:
+        if isinstance(backend, str):
+            if backend.lower() == 'pyaudio':
+                if pyaudio is None:
+                    raise ImportError("pyaudio is required for backend 'pyaudio'.")
+                backend = pyaudio.PyAudio()
+            elif backend.lower() == 'null':
+                backend = NullBackend()
+            else:
+                raise ValueError("Unknown backend : " + backend + ". It can only take 'pyaudio' or 'null'.")
+
+        if device_name is None and isinstance(backend, NullBackend):
+            self.device_name = NullBackend.DEVICE_NAME
+        elif device_name is None:
             import platform
             if platform.system() == "Linux":
                 self.device_name = "default"
@@ -162,17 +720,23 @@ class AudioInterface(object):
 
         self.format = format
         if format.upper() == "INT16":
-            self.format_pyaudio = pyaudio.paInt16
+            self.format_pyaudio = PA_INT16
             self.format_np = np.dtype("int16")
         elif format.upper() == "UINT8":
-            self.format_pyaudio = pyaudio.paUInt8
+            self.format_pyaudio = PA_UINT8
             self.format_np = np.dtype("uint8")
         else:
             raise ValueError("Unknown Format : " + self.format + ". It can only take INT16 or UINT8.")
         self.frame_rate = frame_rate
         self.frames_per_buffer = frames_per_buffer
+        self.limiter = limiter
+        if telemetry is True:
+            telemetry = Telemetry()
+        elif telemetry is False:
+            telemetry = None
+        self.telemetry = telemetry
 
-        self.pya = pya = pyaudio.PyAudio()
+        self.pya = pya = backend
         hardware_information = HardwareInformation(pya)
 
         available_devices = hardware_information.devices
@@ -192,7 +756,19 @@ class AudioInterface(object):
         self.n_ReadAudioChunk_obj = 0
         callback_params.n_ch = self.num_channels
         callback_params.format = self.format_np
-        callback_params.data_callback = np.zeros((self.frames_per_buffer, self.num_channels), dtype=self.format_np)
+        callback_params.mixer = Mixer(self.num_channels, self.frames_per_buffer, format=self.format_np, limiter=self.limiter)
+        callback_params.data_callback = callback_params.mixer.out
+        if self.telemetry is not None:
+            self.telemetry.set_budget(self.frames_per_buffer/self.frame_rate)
+        callback_params.telemetry = self.telemetry
+        # readers of scheduled streams are opened by a thread instead of the callback.
+        # it polls a few times within stream_lookahead, so that readers are opened well before they are started.
+        mixer = callback_params.mixer
+        self._prefetch_stopped = threading.Event()
+        self._prefetch_thread = threading.Thread(target=self._prefetch_streams,
+                                                 args=(mixer, self._prefetch_stopped, mixer.stream_lookahead/self.frame_rate/4),
+                                                 daemon=True)
+        self._prefetch_thread.start()
         self.stream = self.pya.open(format=self.format_pyaudio,
                                     channels=self.num_channels,
                                     frames_per_buffer=self.frames_per_buffer,
@@ -201,7 +777,7 @@ class AudioInterface(object):
                                     output=True,
                                     stream_callback=callback)
 
-    def play(self, data, ch):
+    def play(self, data, ch, volume=1.0, frame=None):
         """
         play audio data from specified channel.
 
@@ -211,16 +787,178 @@ class AudioInterface(object):
             audio data which have a shape of (number of samples, number of channels)
         ch : list of int
             channel number of audio device to be played (start from 1)
+        volume : float, default=1.0
+            gain applied to audio data while mixing.
+        frame : int, default=None
+            frame of the stream (see get_frame()) at which audio data will be started.
+            If it's None, audio data will be started at the beginning of the next buffer.
+
+        Returns
+        -------
+        voice : pyscab.ReadAudioChunk
+            voice for the audio data. Its attribute onset_frame is set when the mixer started it.
 
         Examples
         --------
         In this case, audio_data will be played from 1st channel of audio device.
 
         >>> play(audio_data, [1])
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if channel number is out of range of opened channels.
+        """
+        # finished voices are released here instead of in the callback
+        callback_params.mixer.reap()
+        voice = self._make_voice(data, ch, volume, frame)
+        callback_params.mixer.submit(voice)
+        # streams which are started soon are opened right away, the others by the thread
+        callback_params.mixer.open_streams()
+        return voice
+
+    def schedule(self, events, relative=False):
+        """
+        schedule multiple audio data at once for sample-accurate playing.
+
+        Parameters
+        ----------
+        events : list of tuple
+            list of (frame, data, ch) or (frame, data, ch, volume).
+            See play() for each value.
+        relative : bool, default=False
+            If True, frame of events are relative to the base frame, which is set to two buffers after
+            the next buffer at the time all events were prepared.
+
+        Returns
+        -------
+        base_frame : int
+            frame of the stream which frame of events are relative to. 0 if relative is False.
+
+        Examples
+        --------
+        In this case, audio_data will be played 1 second after 0.1 second from now.
+
+        >>> frame = ahc.get_frame() + int(0.1*ahc.frame_rate)
+        >>> ahc.schedule([(frame, audio_data, [1]), (frame + ahc.frame_rate, audio_data, [2])])
+        """
+        voices = list()
+        for event in events:
+            volume = event[3] if len(event) > 3 else 1.0
+            voices.append(self._make_voice(event[1], event[2], volume, event[0]))
+        base_frame = 0
+        if relative:
+            base_frame = self.get_frame() + 2*self.frames_per_buffer
+            for voice in voices:
+                voice.start_frame += base_frame
+        callback_params.mixer.reap()
+        callback_params.mixer.schedule(voices)
+        callback_params.mixer.open_streams()
+        return base_frame
+
+    def stop(self, fade=0.0):
+        """
+        stop all playing and scheduled audio data at the beginning of the next buffer.
+
+        Parameters
+        ----------
+        fade : float, default=0.0
+            length of fade-out in seconds applied to audio data which is already sounding.
+
+        Returns
+        -------
+        request : pyscab.StopRequest
+            Its attribute frame is set when the mixer stopped audio data.
         """
-        callback_params.data.append(ReadAudioChunk(data, self.frames_per_buffer, ch, format = self.format_np, idx_obj = self.n_ReadAudioChunk_obj))
-        callback_params.data_finished.append(False)
+        return callback_params.mixer.stop(int(round(fade*self.frame_rate)))
+
+    @staticmethod
+    def _prefetch_streams(mixer, stopped, interval):
+        while not stopped.wait(interval):
+            mixer.open_streams()
+            mixer.reap()
+
+    def _make_voice(self, data, ch, volume, frame):
+        check_channels(ch, self.num_channels)
+        voice = make_voice(data, self.frames_per_buffer, ch, volume = volume, format = self.format_np, idx_obj = self.n_ReadAudioChunk_obj)
+        voice.start_frame = frame
         self.n_ReadAudioChunk_obj += 1 # should be add 1 after executing appending ReadAudioChunk obj.
+        return voice
+
+    def get_frame(self):
+        """
+        get frame of the stream at the beginning of the next buffer to be mixed.
+
+        Returns
+        -------
+        frame : int
+        """
+        return callback_params.mixer.frame
+
+    def frame2time(self, frame):
+        """
+        convert frame of the stream to the stream time ('current_time' of the callback) at which the frame is mixed.
+
+        Parameters
+        ----------
+        frame : int
+            frame of the stream.
+
+        Returns
+        -------
+        time : float
+            stream time in seconds. None if the callback has not been called yet.
+        """
+        if callback_params.clock is None:
+            return None
+        frame_ref, time_info = callback_params.clock
+        return time_info['current_time'] + (frame - frame_ref)/self.frame_rate
+
+    def frame2dac_time(self, frame):
+        """
+        convert frame of the stream to the stream time at which the frame is output by DAC.
+
+        It's computed from 'output_buffer_dac_time' of the last callback.
+        If the host API doesn't provide it (i.e. it's 0), latency of one buffer is assumed.
+
+        Parameters
+        ----------
+        frame : int
+            frame of the stream.
+
+        Returns
+        -------
+        time : float
+            stream time in seconds. None if the callback has not been called yet.
+        """
+        if callback_params.clock is None:
+            return None
+        frame_ref, time_info = callback_params.clock
+        dac_time = time_info['output_buffer_dac_time']
+        if dac_time == 0:
+            dac_time = time_info['current_time'] + self.frames_per_buffer/self.frame_rate
+        return dac_time + (frame - frame_ref)/self.frame_rate
+
+    def get_n_active_voices(self):
+        """
+        get number of currently sounding voices.
+
+        Returns
+        -------
+        n_active : int
+        """
+        return callback_params.mixer.get_n_active()
+
+    def get_n_clipped(self):
+        """
+        get number of output samples which exceeded the range of format since the device was opened.
+        It's counted only if limiter is set.
+
+        Returns
+        -------
+        n_clipped : int
+        """
+        return callback_params.mixer.n_clipped
 
     def get_time_info(self):
         """
@@ -232,12 +970,30 @@ class AudioInterface(object):
         """
         return callback_params.time
 
+    def get_time(self):
+        """
+        get current time of the stream (Pa_GetStreamTime).
+
+        It's on the same clock as 'current_time' of time information passed to the callback,
+        but it's updated continuously instead of once per buffer.
+
+        Returns
+        -------
+        time : float
+            time in seconds.
+        """
+        return self.stream.get_time()
+
     def close(self):
         """
         stop audio stream and close device.
         """
         self.stream.stop_stream()
         self.stream.close()
+        self._prefetch_stopped.set()
+        self._prefetch_thread.join()
+        # readers of streamed audio data which were not finished are closed
+        callback_params.mixer.clear()
 
     def terminate(self):
         """
@@ -252,7 +1008,7 @@ class ReadAudioChunk(object):
     Attributes
     ----------
     data : np.ndarray
-        audio data.
+        read-only view of audio data.
     n_ch_data : int
         number of channels of audio data
     n_frames : int
@@ -261,12 +1017,30 @@ class ReadAudioChunk(object):
         chunk size.
     ch : list of int
         channel number of device which audio data will be played.
+    routing : list of int
+        channel index of audio data which will be played from each channel in attribute ch.
+        If audio data has less channels than ch, its channels are repeated.
+    volume : float
+        gain applied while mixing.
+    start_frame : int or None
+        frame of the stream at which the data will be started. If it's None, it will be started at the beginning of the next buffer.
+    onset_frame : int or None
+        frame of the stream at which the data was actually started by pyscab.Mixer. None until it's started.
+    fade : np.ndarray or None
+        gain of fade-out applied by pyscab.Mixer after the data was stopped.
+    stream : pyscab.StreamReader or None
+        reader of audio data streamed from disk. None if audio data is in memory.
     format : np.dtype
         audio data format
     finished : Bool
         If True, all audio data have already been read. If False, there's remained data.
     idx_obj : int
         id of instance.
+
+    Notes
+    -----
+    Audio data is neither copied nor converted to format, so creating an instance costs the same regardless of length of the data.
+    Conversion to format and routing to channels are done by pyscab.Mixer.
     """
     def __init__(self, data, chunk_size, ch, volume=1.0, format = np.dtype("int16"), idx_obj = None):
         """
@@ -280,28 +1054,37 @@ class ReadAudioChunk(object):
             chunk size.
         ch : list of int
             channel number of device which audio data will be played.
+        volume : float, default=1.0
+            gain applied by pyscab.Mixer while mixing.
         format : np.dtype, default=np.dtype('int16')
             audio data format
         idx_obj : int, default=None
             id of instance.
         """
-        self.data = data.astype(format)
+        self.data = data.view()
+        self.data.flags.writeable = False
         self.n_ch_data = data.shape[1] # n_ch of data
         self.n_frames = data.shape[0]
         self.current_idx = 0
         self.chunk_size = chunk_size
         self.ch = ch # ch num to be stimuli presented
+        self.volume = volume
         self.format = format
         #self.remained_frames = self.n_frames
         self.finished = False
+        self.start_frame = None
+        self.onset_frame = None
+        self.fade = None
+        self.fade_pos = 0
+        self.stream = None
+        self.blocking = False
         self.idx_obj = idx_obj # will be change to id
-        self.chunk_data = np.zeros((self.chunk_size, self.n_ch_data), dtype=self.format)
-        # if mono audio will be played from multiple channel,
-        # concatenate it to multiple channel matrix
-        # in order to make computational load in portaudio callback function less
-        while self.n_ch_data < len(self.ch):
-            self.data = np.hstack((self.data,self.data))
-            self.n_ch_data = self.data.shape[1]
+        # if mono audio will be played from multiple channel, its channel is repeated.
+        self.routing = [idx_ch % self.n_ch_data for idx_ch in range(len(self.ch))]
+        # If channels of audio data are played as they are, chunks are read without fancy indexing.
+        self.identity = self.routing == list(range(self.n_ch_data))
+        self.chunk_data = None
+        self._last_chunk = None
 
     def read_chunk(self):
         """
@@ -310,32 +1093,32 @@ class ReadAudioChunk(object):
         Returns
         -------
         chunk_data : np.ndarray
-            chunk data which have a shape of (chunk size, number of channels)
+            chunk data which have a shape of (chunk size, number of channels to be played)
+
+        Notes
+        -----
+        This is not used by pyscab.Mixer, which reads audio data directly.
+        If routing is identity and audio data is already in format, returned chunk is a read-only view of audio data,
+        except for the last chunk, which is padded with zeros.
         """
 
         start = self.current_idx*self.chunk_size
         end = (self.current_idx*self.chunk_size)+self.chunk_size
 
-        if end >= (self.n_frames-1):
+        if end >= self.n_frames:
+            if self._last_chunk is None:
+                self._last_chunk = np.zeros((self.chunk_size, len(self.routing)), dtype=self.format)
+            self.chunk_data = self._last_chunk
             self.chunk_data.fill(0)
-            self.chunk_data[0:(self.n_frames-start-1),:] = self.data[start:-1,:]
-            
-            #=====================
-            #This is old method.
-            #
-            #deleted in ver 0.0.6 since it is slow.
-            #=====================
-            # padding zero to last block 
-            #data = self.data[start:-1,:]
-            #n_padding = self.chunk_size - data.shape[0]
-            #data = np.vstack((data, np.zeros((n_padding, self.n_ch_data), dtype=self.format)))
-            #data = np.vstack((data, np.zeros((n_padding, self.n_ch_data))))
-            #self.finished = True
-            #=====================
-            callback_params.data_finished[self.idx_obj] = True
+            if self.identity:
+                self.chunk_data[0:(self.n_frames-start),:] = self.data[start:]
+            else:
+                self.chunk_data[0:(self.n_frames-start),:] = self.data[start:, self.routing]
+            self.finished = True
+        elif self.identity:
+            self.chunk_data = self.data[start:end].astype(self.format, copy=False)
         else:
-            self.chunk_data = self.data[start:end,:]
-            #self.remained_frames -= self.chunk_size
+            self.chunk_data = self.data[start:end, self.routing].astype(self.format, copy=False)
         self.current_idx += 1
         return self.chunk_data
 
@@ -360,3 +1143,95 @@ class ReadAudioChunk(object):
             channel number which audio data will be played.
         """
         return self.ch
+
+class StreamingAudioChunk(ReadAudioChunk):
+    """
+    audio data streamed from disk.
+
+    The file is not read when the instance is created. It's opened by open(), which is called by pyscab.Mixer.open_streams()
+    shortly before the voice is started, and closed by close() when the voice is reaped.
+    Volume of the stream is multiplied to volume.
+
+    Attributes
+    ----------
+    source : pyscab.WavStream
+        file to be streamed.
+    stream : pyscab.StreamReader or None
+        reader of the file. None until it's opened, and after it's closed.
+    blocking : bool
+        If True, the mixer waits for audio data instead of filling silence.
+
+    See Also
+    --------
+    Class ReadAudioChunk
+    """
+    def __init__(self, stream, chunk_size, ch, volume=1.0, format = np.dtype("int16"), idx_obj = None, blocking=False):
+        self.data = None
+        self.source = stream
+        self.n_ch_data = stream.shape[1]
+        self.n_frames = stream.shape[0]
+        self.current_idx = 0
+        self.chunk_size = chunk_size
+        self.ch = ch
+        self.volume = volume*stream.volume
+        self.format = format
+        self.finished = False
+        self.start_frame = None
+        self.onset_frame = None
+        self.fade = None
+        self.fade_pos = 0
+        self.idx_obj = idx_obj
+        self.routing = [idx_ch % self.n_ch_data for idx_ch in range(len(self.ch))]
+        self.identity = self.routing == list(range(self.n_ch_data))
+        self.chunk_data = None
+        self._rows = None
+        self.stream = None
+        self.blocking = blocking
+
+    def open(self):
+        """
+        start reading the file if it's not started yet.
+
+        Returns
+        -------
+        reader : pyscab.StreamReader
+        """
+        if self.stream is None:
+            self.stream = self.source.open()
+        return self.stream
+
+    def close(self):
+        """
+        stop reading the file and release the ring buffer.
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def read_chunk(self):
+        """
+        read audio data by chunk from the ring buffer of the reader.
+
+        The reader is opened by the first call, and it waits until the chunk is read from the file.
+
+        Returns
+        -------
+        chunk_data : np.ndarray
+            chunk data which have a shape of (chunk size, number of channels to be played).
+            Returned array is reused for the next chunk. The last chunk is padded with zeros.
+        """
+        stream = self.open()
+        if self.chunk_data is None:
+            self._rows = np.zeros((self.n_ch_data, self.chunk_size), dtype=stream.ring.dtype)
+            self.chunk_data = np.zeros((self.chunk_size, len(self.routing)), dtype=self.format)
+        n = min(self.chunk_size, stream.n_frames - self.current_idx*self.chunk_size)
+        n_read = stream.read(self._rows[:, :max(n, 0)], block=True)
+        self._rows[:, n_read:] = 0
+        if self.identity:
+            self.chunk_data[:] = self._rows.T
+        else:
+            self.chunk_data[:] = self._rows[self.routing].T
+        self.current_idx += 1
+        if self.current_idx*self.chunk_size >= stream.n_frames:
+            self.finished = True
+        return self.chunk_data
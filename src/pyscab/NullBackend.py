@@ -0,0 +1,221 @@
+import numpy as np
+import time
+import threading
+from logging import getLogger
+logger = getLogger('pyscab.'+__name__)
+
+# sample formats of portaudio, which are same values as pyaudio.paInt16 and pyaudio.paUInt8
+PA_INT16 = 8
+PA_UINT8 = 32
+
+PA_FORMATS = {PA_INT16: np.dtype("int16"),
+              PA_UINT8: np.dtype("uint8")}
+
+class NullBackend(object):
+    """
+    Audio backend without audio device.
+
+    It provides the subset of pyaudio.PyAudio used by pyscab.AudioInterface,
+    and drives callback of the stream from a simulated clock instead of a sound card.
+    Output of the callback can be captured, e.g. for testing or benchmarking without hardware.
+
+    Parameters
+    ----------
+    max_channels : int, default=64
+        maximum number of output channels of the null device.
+    latency : float, default=0.0
+        output latency (in seconds) of the null device. It's reported as defaultLowOutputLatency,
+        and added to output_buffer_dac_time passed to the callback.
+    paced : bool, default=True
+        If True, callback is called in real time, i.e. once per frames_per_buffer/frame_rate seconds.
+        If False, callback is called as fast as possible, and time of the stream advances by frames processed.
+    threaded : bool, default=True
+        If False, callback is not called by a thread. It's called only by NullStream.process(),
+        so that output is deterministic.
+    capture : bool, default=True
+        If True, output of the callback is kept and can be read by NullStream.get_output().
+
+    Examples
+    --------
+    >>> ahc = pyscab.AudioInterface(backend='null')
+    >>> ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(paced=False))
+    """
+    DEVICE_NAME = "null"
+
+    def __init__(self, max_channels=64, latency=0.0, paced=True, threaded=True, capture=True):
+        self.max_channels = max_channels
+        self.latency = latency
+        self.paced = paced
+        self.threaded = threaded
+        self.capture = capture
+        self.streams = list()
+
+    def get_device_count(self):
+        return 1
+
+    def get_device_info_by_index(self, index):
+        if index != 0:
+            raise ValueError("Invalid device index : " + str(index))
+        return {'index': 0,
+                'name': self.DEVICE_NAME,
+                'hostApi': 0,
+                'maxInputChannels': 0,
+                'maxOutputChannels': self.max_channels,
+                'defaultLowInputLatency': 0.0,
+                'defaultLowOutputLatency': self.latency,
+                'defaultHighInputLatency': 0.0,
+                'defaultHighOutputLatency': self.latency,
+                'defaultSampleRate': 44100.0}
+
+    def open(self, rate, channels, format, output=True, output_device_index=None, frames_per_buffer=1024, stream_callback=None, start=True, **kwargs):
+        """
+        open null stream. Arguments are same as pyaudio.PyAudio.open().
+
+        Returns
+        -------
+        stream : pyscab.NullStream
+        """
+        if channels > self.max_channels:
+            raise ValueError("Invalid number of channels : " + str(channels))
+        if format not in PA_FORMATS:
+            raise ValueError("Unknown Format : " + str(format))
+        stream = NullStream(rate, channels, PA_FORMATS[format], frames_per_buffer, stream_callback,
+                            latency=self.latency, paced=self.paced, capture=self.capture)
+        self.streams.append(stream)
+        if start and self.threaded:
+            stream.start_stream()
+        return stream
+
+    def terminate(self):
+        for stream in self.streams:
+            stream.close()
+        self.streams = list()
+
+class NullStream(object):
+    """
+    Stream of pyscab.NullBackend.
+
+    Attributes
+    ----------
+    frame : int
+        number of frames processed by the callback.
+    n_callbacks : int
+        number of calls of the callback.
+    """
+    def __init__(self, rate, channels, dtype, frames_per_buffer, stream_callback, latency=0.0, paced=True, capture=True):
+        self.rate = rate
+        self.channels = channels
+        self.dtype = dtype
+        self.frames_per_buffer = frames_per_buffer
+        self.stream_callback = stream_callback
+        self.latency = latency
+        self.paced = paced
+        self.capture = capture
+        self.frame = 0
+        self.n_callbacks = 0
+        self._output = list()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._t0 = None
+
+    def get_time(self):
+        """
+        get current time of the stream.
+
+        Returns
+        -------
+        time : float
+            time in seconds since the stream was started. If the stream is not paced, it's the time of processed frames.
+        """
+        if self.paced and self._t0 is not None:
+            return time.perf_counter() - self._t0
+        return self.frame/self.rate
+
+    def process(self, n_buffers=1):
+        """
+        call the callback n_buffers times.
+
+        Parameters
+        ----------
+        n_buffers : int, default=1
+
+        Returns
+        -------
+        n_frames : int
+            number of frames processed.
+        """
+        n_frames = 0
+        for m in range(n_buffers):
+            with self._lock:
+                current_time = self.frame/self.rate
+                time_info = {'input_buffer_adc_time': 0.0,
+                             'current_time': current_time,
+                             'output_buffer_dac_time': current_time + self.frames_per_buffer/self.rate + self.latency}
+                data, flag = self.stream_callback(None, self.frames_per_buffer, time_info, 0)
+                if self.capture:
+                    self._output.append(np.array(data, dtype=self.dtype).reshape(-1, self.channels))
+                self.frame += self.frames_per_buffer
+                self.n_callbacks += 1
+            n_frames += self.frames_per_buffer
+            if flag != 0:
+                self._running = False
+                break
+        return n_frames
+
+    def get_output(self, clear=False):
+        """
+        get captured output of the callback.
+
+        Parameters
+        ----------
+        clear : bool, default=False
+            If True, captured output is discarded after reading.
+
+        Returns
+        -------
+        output : np.ndarray
+            output of the callback which has a shape of (number of frames, number of channels).
+        """
+        with self._lock:
+            if self._output:
+                output = np.concatenate(self._output)
+            else:
+                output = np.zeros((0, self.channels), dtype=self.dtype)
+            if clear:
+                self._output = list()
+        return output
+
+    def start_stream(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._t0 = time.perf_counter() - self.frame/self.rate
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop_stream(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def is_active(self):
+        return self._running
+
+    def is_stopped(self):
+        return not self._running
+
+    def close(self):
+        self.stop_stream()
+
+    def _run(self):
+        while self._running:
+            self.process(1)
+            if self.paced:
+                wait = self._t0 + self.frame/self.rate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            else:
+                # let other threads run, e.g. StimulationController.play().
+                time.sleep(0)
@@ -0,0 +1,196 @@
+import numpy as np
+import math
+import wave
+from logging import getLogger
+from .HardwareController import Mixer, make_voice, check_channels
+from .StimulationController import get_required_time
+from .CompiledPlan import CompiledPlan
+logger = getLogger('pyscab.'+__name__)
+
+MARKER_DTYPE = np.dtype([('frame', 'i8'), ('time', 'f8'), ('id', 'O'), ('marker', 'O')])
+
+class OfflineRenderer(object):
+    """
+    Rendering stimulating plan into audio data without audio device.
+
+    Plans are mixed by pyscab.Mixer in the same way as StimulationController.play() with sample_accurate=True,
+    chunk by chunk, so that long sessions can be rendered into a wav file without holding whole session in memory.
+
+    Parameters
+    ----------
+    n_ch : int, default=2
+        number of channels of rendered audio data.
+    format : {'INT16', 'UINT8'}, default='INT16'
+        format of rendered audio data.
+    frame_rate : int, default=44100
+        frame rate of rendered audio data.
+    frames_per_buffer : int, default=4096
+        number of frames mixed at once.
+    limiter : {None, 'clip', 'soft'}, default=None
+        conversion of mixed audio data to format. See pyscab.Mixer.
+
+    Examples
+    --------
+    >>> renderer = pyscab.OfflineRenderer(n_ch=2, frame_rate=44100)
+    >>> audio, markers = renderer.render(audio_plan, dh)
+    >>> _, markers = renderer.render(audio_plan, dh, path="session.wav")
+    """
+    def __init__(self, n_ch=2, format="INT16", frame_rate=44100, frames_per_buffer=4096, limiter=None):
+        self.n_ch = n_ch
+        self.format = format
+        if format.upper() == "INT16":
+            self.format_np = np.dtype("int16")
+        elif format.upper() == "UINT8":
+            self.format_np = np.dtype("uint8")
+        else:
+            raise ValueError("Unknown Format : " + format + ". It can only take INT16 or UINT8.")
+        self.frame_rate = frame_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.limiter = limiter
+        self.n_clipped = 0
+
+    def get_markers(self, plans):
+        """
+        get marker table of plans.
+
+        Parameters
+        ----------
+        plans : list of list
+            plans of stimulation. Each plan is [time, id, ch, marker].
+
+        Returns
+        -------
+        markers : np.ndarray
+            structured array sorted by frame, with fields 'frame', 'time', 'id' and 'marker'.
+            'frame' is the exact frame at which audio data starts in the rendered audio data.
+        """
+        markers = np.zeros(len(plans), dtype=MARKER_DTYPE)
+        for idx, plan in enumerate(plans):
+            frame = int(round(plan[0]*self.frame_rate))
+            markers[idx] = (frame, frame/self.frame_rate, plan[1], plan[3])
+        return markers[np.argsort(markers['frame'], kind='stable')]
+
+    def get_n_frames(self, plans, data, time_termination='auto'):
+        """
+        get number of frames to be rendered.
+
+        Parameters
+        ----------
+        plans : list of list
+            plans of stimulation.
+        data : pyscab.DataHandler
+            audio data referenced by id of plans.
+        time_termination : float or 'auto', default='auto'
+            time (in seconds) to finish rendering. If it's 'auto', it's set to the end of the last audio data.
+
+        Returns
+        -------
+        n_frames : int
+        """
+        if isinstance(time_termination, str) and time_termination.lower() == 'auto':
+            time_termination = get_required_time(plans, data)
+        return int(math.ceil(time_termination*self.frame_rate))
+
+    def _check_frame_rate(self, plans, data):
+        if data.frame_rate != self.frame_rate:
+            raise ValueError("frame rate of audio data is " + str(data.frame_rate) + ", but frame rate of renderer is " + str(self.frame_rate) + ".")
+        if isinstance(plans, CompiledPlan) and plans.frame_rate != self.frame_rate:
+            raise ValueError("plans were compiled for frame rate " + str(plans.frame_rate) + ", but frame rate of renderer is " + str(self.frame_rate) + ".")
+
+    def render_iter(self, plans, data, time_termination='auto'):
+        """
+        render plans chunk by chunk.
+
+        Parameters
+        ----------
+        plans : list of list
+            plans of stimulation.
+        data : pyscab.DataHandler
+            audio data referenced by id of plans.
+        time_termination : float or 'auto', default='auto'
+            time (in seconds) to finish rendering.
+
+        Yields
+        ------
+        chunk : np.ndarray
+            rendered audio data which have a shape of (frames_per_buffer, number of channels).
+            The last chunk can be shorter. Returned array is reused for the next chunk.
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if frame rate of data or compiled plans is different from frame_rate of the renderer.
+        """
+        self._check_frame_rate(plans, data)
+        n_frames = self.get_n_frames(plans, data, time_termination)
+        mixer = Mixer(self.n_ch, self.frames_per_buffer, format=self.format_np, limiter=self.limiter)
+        voices = list()
+        for plan in plans:
+            check_channels(plan[2], self.n_ch)
+            voice = make_voice(data.get_data_by_id(plan[1]), self.frames_per_buffer, plan[2], format=self.format_np, blocking=True)
+            voice.start_frame = int(round(plan[0]*self.frame_rate))
+            voices.append(voice)
+        # readers of streamed audio data are opened shortly before they are started
+        mixer.schedule(voices)
+        del voices
+        logger.debug("start rendering %d frames.", n_frames)
+
+        try:
+            frame = 0
+            while frame < n_frames:
+                frame_count = min(self.frames_per_buffer, n_frames - frame)
+                mixer.open_streams()
+                chunk = mixer.mix(frame_count)
+                mixer.reap()
+                frame += frame_count
+                self.n_clipped = mixer.n_clipped
+                yield chunk
+        finally:
+            # files of streamed audio data are closed even if rendering is not finished
+            mixer.clear()
+
+    def render(self, plans, data, path=None, time_termination='auto'):
+        """
+        render plans into audio data or wav file.
+
+        Parameters
+        ----------
+        plans : list of list
+            plans of stimulation.
+        data : pyscab.DataHandler
+            audio data referenced by id of plans.
+        path : str, default=None
+            If it's set, rendered audio data is written into wav file chunk by chunk, and None is returned as audio data.
+        time_termination : float or 'auto', default='auto'
+            time (in seconds) to finish rendering.
+
+        Returns
+        -------
+        audio : np.ndarray or None
+            rendered audio data which have a shape of (number of frames, number of channels).
+        markers : np.ndarray
+            marker table. See get_markers().
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if frame rate of data or compiled plans is different from frame_rate of the renderer.
+        """
+        # checked before the wav file is created
+        self._check_frame_rate(plans, data)
+        markers = self.get_markers(plans)
+        if path is None:
+            audio = np.zeros((self.get_n_frames(plans, data, time_termination), self.n_ch), dtype=self.format_np)
+            frame = 0
+            for chunk in self.render_iter(plans, data, time_termination):
+                audio[frame:frame+chunk.shape[0]] = chunk
+                frame += chunk.shape[0]
+            return audio, markers
+
+        with wave.open(path, 'wb') as wf:
+            wf.setnchannels(self.n_ch)
+            wf.setsampwidth(self.format_np.itemsize)
+            wf.setframerate(self.frame_rate)
+            for chunk in self.render_iter(plans, data, time_termination):
+                wf.writeframes(chunk.tobytes())
+        return None, markers
@@ -1,9 +1,19 @@
 import time
+import heapq
+import itertools
 import threading
+import collections
 from logging import getLogger
+from .CompiledPlan import CompiledPlan
+from .HardwareController import check_channels
 logger = getLogger('pyscab.'+__name__)
 
+# upper bound of a single sleep in play(), so that share[0] is checked at least this often.
+MAX_SLEEP = 0.01
+
 def get_required_time(plans, data):
+    if isinstance(plans, CompiledPlan):
+        return plans.end_time
     end_times = list()
     for plan in plans:
         end_time = data.get_length_by_id(plan[1])
@@ -11,6 +21,270 @@ def get_required_time(plans, data):
         end_times.append(end_time)
     return max(end_times)
 
+class MarkerDispatcher(object):
+    """
+    sending markers at their deadlines from a single long-lived thread.
+
+    The thread sleeps until spin_margin before the earliest deadline, and then spins until the deadline.
+    All markers which are due at that time are sent in one pass.
+
+    Parameters
+    ----------
+    marker_send : reference to a function
+        A reference to function for send a marker. It's called as marker_send(val=val).
+    spin_margin : float, default=0.002
+        time (in seconds) before the deadline to stop sleeping and start spinning.
+    marker_send_batch : reference to a function, default=None
+        If it's set, markers which are due together are sent by marker_send_batch(vals=list of values) instead.
+    clock : reference to a function, default=time.perf_counter
+        clock used for deadlines.
+
+    Attributes
+    ----------
+    log : list of tuple
+        (marker value, scheduled time, actual time of sending) of each sent marker.
+
+    Examples
+    --------
+    >>> dispatcher = MarkerDispatcher(marker_send)
+    >>> dispatcher.start()
+    >>> dispatcher.send_after(0.01, 1)
+    >>> dispatcher.stop()
+    """
+    def __init__(self, marker_send, spin_margin=0.002, marker_send_batch=None, clock=time.perf_counter):
+        self.marker_send = marker_send
+        self.marker_send_batch = marker_send_batch
+        self.spin_margin = spin_margin
+        self.clock = clock
+        self.log = list()
+        self._queue = list()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """
+        start the dispatcher thread. It's started automatically by the first send_at() if it's not started.
+        """
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        send remaining markers and stop the dispatcher thread.
+        """
+        with self._cond:
+            if self._thread is None:
+                return
+            self._running = False
+            self._cond.notify()
+            thread = self._thread
+        thread.join()
+        self._thread = None
+
+    def send_at(self, deadline, val):
+        """
+        send marker at deadline.
+
+        Parameters
+        ----------
+        deadline : float
+            time to send the marker, on the clock of the dispatcher.
+        val : int
+            marker value.
+        """
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            heapq.heappush(self._queue, (deadline, next(self._seq), val))
+            # wake up the thread in case the new marker is earlier than the one it's waiting for.
+            self._cond.notify()
+
+    def send_after(self, delay, val):
+        """
+        send marker after delay.
+
+        Parameters
+        ----------
+        delay : float
+            delay in seconds.
+        val : int
+            marker value.
+        """
+        self.send_at(self.clock() + delay, val)
+
+    def clear_log(self):
+        """
+        clear log of sent markers.
+
+        Returns
+        -------
+        log : list of tuple
+            log before clearing.
+        """
+        log, self.log = self.log, list()
+        return log
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            with self._cond:
+                while self._running and not queue:
+                    self._cond.wait()
+                if not queue:
+                    return
+                deadline = queue[0][0]
+                wait = deadline - self.clock() - self.spin_margin
+                if wait > 0 and self._running:
+                    self._cond.wait(wait)
+                    continue
+
+            while self.clock() < deadline:
+                pass
+
+            due = list()
+            with self._cond:
+                now = self.clock()
+                while queue and queue[0][0] <= now:
+                    due.append(heapq.heappop(queue))
+            if self.marker_send_batch is not None:
+                self.marker_send_batch(vals=[val for (deadline, seq, val) in due])
+                now = self.clock()
+                self.log.extend((val, deadline, now) for (deadline, seq, val) in due)
+            else:
+                for deadline, seq, val in due:
+                    self.marker_send(val=val)
+                    self.log.append((val, deadline, self.clock()))
+
+class PlanFeeder(object):
+    """
+    pulling plans from an iterator or an async generator by a background thread, as they approach their onset.
+
+    Each plan is pulled, resolved and validated, and then held until look-ahead before its time,
+    so that only plans within the look-ahead window are handed over to StimulationController.play().
+
+    Parameters
+    ----------
+    plans : iterator or async generator
+        plans of stimulation. Each plan is [time, id, ch, marker], and time is relative to the beginning of play().
+        Plans should be yielded in the order of time.
+    data : pyscab.DataHandler
+        audio data referenced by id of plans.
+    n_ch : int
+        number of channels of the audio interface.
+    lookahead : float, default=1.0
+        time (in seconds) before the time of a plan at which it's handed over.
+
+    Attributes
+    ----------
+    incoming : collections.deque
+        plans handed over, as tuple of (time, frame, data, ch, marker, id, plan).
+    end_time : float
+        end of the last audio data of pulled plans.
+    done : bool
+        True after plans were exhausted, stopped or failed.
+    error : Exception or None
+        exception raised while pulling plans, e.g. ValueError for a bad plan.
+
+    Notes
+    -----
+    Async generator is driven by an event loop of the thread, so it should not await objects bound to another event loop.
+    """
+    def __init__(self, plans, data, n_ch, lookahead=1.0):
+        self.plans = plans
+        self.data = data
+        self.n_ch = n_ch
+        self.lookahead = lookahead
+        self.incoming = collections.deque()
+        self.end_time = 0.0
+        self.done = False
+        self.error = None
+        self._clock = None
+        self._last_time = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, clock):
+        """
+        start pulling plans.
+
+        Parameters
+        ----------
+        clock : reference to a function
+            function which returns current time relative to the beginning of play().
+        """
+        self._clock = clock
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop pulling plans. Plans which are held are dropped.
+
+        The thread is not joined, since iterator can block until the next plan is decided.
+        """
+        self._stopped.set()
+
+    def _resolve(self, plan):
+        t, id, ch = plan[0], plan[1], tuple(plan[2])
+        if t < self._last_time:
+            logger.warning("time %s of plan is earlier than the previous plan. it's played late.", str(t))
+        self._last_time = max(self._last_time, t)
+        data = self.data.get_data_by_id(id)
+        check_channels(ch, self.n_ch)
+        frame_rate = self.data.frame_rate
+        self.end_time = max(self.end_time, t + data.shape[0]/frame_rate)
+        return (t, int(round(t*frame_rate)), data, ch, plan[3], id, plan)
+
+    def _delay(self, event):
+        return event[0] - self.lookahead - self._clock()
+
+    def _run(self):
+        try:
+            if hasattr(self.plans, '__aiter__'):
+                import asyncio
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(self._run_async())
+                finally:
+                    loop.close()
+            else:
+                for plan in self.plans:
+                    event = self._resolve(plan)
+                    delay = self._delay(event)
+                    while delay > 0 and not self._stopped.is_set():
+                        self._stopped.wait(delay)
+                        delay = self._delay(event)
+                    if self._stopped.is_set():
+                        break
+                    self.incoming.append(event)
+        except Exception as e:
+            logger.error("pulling plans was failed : %s", str(e))
+            self.error = e
+        finally:
+            self.done = True
+
+    async def _run_async(self):
+        import asyncio
+        try:
+            async for plan in self.plans:
+                event = self._resolve(plan)
+                delay = self._delay(event)
+                while delay > 0 and not self._stopped.is_set():
+                    # stop() is checked at least every MAX_SLEEP
+                    await asyncio.sleep(min(delay, MAX_SLEEP))
+                    delay = self._delay(event)
+                if self._stopped.is_set():
+                    break
+                self.incoming.append(event)
+        finally:
+            await self.plans.aclose()
+
 class StimulationController(object):
 
     def __init__(self,
@@ -19,7 +293,11 @@ class StimulationController(object):
                  correct_latency = True,
                  correct_hardware_buffer = False,
                  time_tick = 0.0001,
-                 share=None):
+                 share=None,
+                 spin_margin = 0.002,
+                 stop_event = None,
+                 fade_out = 0.005,
+                 marker_send_batch = None):
         """
         class for playing stimulating plan.
 
@@ -28,11 +306,19 @@ class StimulationController(object):
         AudioHardwareController : An instance of pyscab.AudioHardwareController class
         marker_send : reference to a function
             A reference to function for send a marker
+        correct_latency : bool or 'dac', default=True
+            If True, markers are sent after the fixed offset of frames_per_buffer/frame_rate
+            (plus latency given by correct_hardware_buffer).
+            If 'dac', markers are sent at the time audio data is output by DAC,
+            which is computed from the frame at which the mixer started the audio data and the time information of the callback.
+            If False, markers are sent immediately.
         mode : str {'serial', 'pararell'} default = 'serial'
             If it's set to 'pararell', it can be controll from parent process.
         time_tick : float, default=0.0001
-            pause between each loop in play() function. In terms of real time, it should be reduced.
-            However, it also caused intence compulational load.
+            pause between each loop in play() function while waiting for an onset closer than spin_margin.
+            In terms of real time, it should be reduced. However, it also caused intence compulational load.
+        spin_margin : float, default=0.002
+            play() sleeps until spin_margin before the next onset, and then polls with time_tick.
         share : list or instance of multiprocessing class
             0 : before playing
             1 : playing
@@ -45,18 +331,37 @@ class StimulationController(object):
 
             share[1] is used for sharing current marker value.
 
+            Changing share[0] is detected within MAX_SLEEP. Use stop() or stop_event for stopping immediately.
+        stop_event : threading.Event or multiprocessing.Event, default=None
+            If it's set, play() is stopped as soon as it's set. multiprocessing.Event can be used for stopping from another process.
+            If it's None, threading.Event() is used. See stop().
+        fade_out : float, default=0.005
+            length of fade-out in seconds applied to sounding audio data when play() is stopped before the end.
+            Audio data which is not started yet is cancelled.
+        marker_send_batch : reference to a function, default=None
+            If it's set, markers which fall due together are sent by marker_send_batch(vals=list of values)
+            instead of marker_send. It's used only if correct_latency is True or 'dac'. See pyscab.MarkerDispatcher.
+
+        marker_dispatcher : pyscab.MarkerDispatcher
+            If correct_latency is True, markers are sent with the offset by this dispatcher.
+            Its attribute log contains scheduled and actual time of sending of each marker.
+
         """
         self.ahc = AudioHardwareController
         self.time_tick = time_tick
+        self.spin_margin = spin_margin
         self.correct_latency = correct_latency
-        if self.correct_latency:
-            self.offset = self.ahc.frames_per_buffer/self.ahc.frame_rate
-            if correct_hardware_buffer is not False:
-                if correct_hardware_buffer is True:
-                    self.offset += self.ahc.device['defaultLowOutputLatency']
-                else:
-                    self.offset += correct_hardware_buffer/self.ahc.frame_rate
+        if self.correct_latency == 'dac':
+            # deadlines are on the stream clock, which is also the clock of dac time.
             self.marker_send_hw = marker_send
+            self.marker_dispatcher = MarkerDispatcher(marker_send, spin_margin=spin_margin,
+                                                     marker_send_batch=marker_send_batch, clock=self.ahc.get_time)
+            self.marker_send = marker_send
+        elif self.correct_latency:
+            self.correct_hardware_buffer = correct_hardware_buffer
+            self.offset = self._get_offset()
+            self.marker_send_hw = marker_send
+            self.marker_dispatcher = MarkerDispatcher(marker_send, spin_margin=spin_margin, marker_send_batch=marker_send_batch)
             self.marker_send = self.marker_send_offset
         else:
             self.marker_send = marker_send
@@ -64,61 +369,322 @@ class StimulationController(object):
             self.share = [0 for m in range(8)]
         else:
             self.share = share
+        if stop_event is None:
+            stop_event = threading.Event()
+        self.stop_event = stop_event
+        self.fade_out = fade_out
         logger.debug("time_tick for Stimulation Controller was set to %s", str(self.time_tick))
 
+    def _get_offset(self):
+        offset = self.ahc.frames_per_buffer/self.ahc.frame_rate
+        if self.correct_hardware_buffer is True:
+            # device of pyscab.AudioProcess is resolved when it's opened, and the offset is updated in open().
+            if self.ahc.device is not None:
+                offset += self.ahc.device['defaultLowOutputLatency']
+        elif self.correct_hardware_buffer is not False:
+            offset += self.correct_hardware_buffer/self.ahc.frame_rate
+        return offset
+
     def open(self):
         self.ahc.open()
+        if self.correct_latency:
+            if self.correct_latency != 'dac':
+                self.offset = self._get_offset()
+            self.marker_dispatcher.start()
         logger.debug("Audio Hardware Controller Opened.")
         
     def close(self):
+        # pending markers are sent before the audio interface is closed, since their deadlines can be on its clock.
+        if self.correct_latency:
+            self.marker_dispatcher.stop()
         self.ahc.close()
         logger.debug("Audio Hardware Controller Closed.")
 
+    def stop(self):
+        """
+        stop play(). It can be called from any thread.
+
+        play() wakes up immediately, asks the audio interface to stop sounding audio data with fade_out,
+        and returns after the fade-out is finished.
+        """
+        self.stop_event.set()
+
+    def compile(self, plans, data):
+        """
+        compile plans for the audio interface, so that bad plans fail before the device is opened.
+
+        Parameters
+        ----------
+        plans : list of list
+            plans of stimulation. Each plan is [time, id, ch, marker].
+        data : pyscab.DataHandler
+            audio data referenced by id of plans.
+
+        Returns
+        -------
+        plan : pyscab.CompiledPlan
+            compiled plans whose channels were checked against number of channels of the audio interface.
+        """
+        return CompiledPlan(plans, data, n_ch=self.ahc.num_channels)
+
     def marker_send_offset(self, val):
-        t = threading.Thread(target=self.marker_send_offset_thread, args=(val,))
-        t.start()
+        self.marker_dispatcher.send_after(self.offset, val)
+
+    def _send_marker_dac(self, awaiting):
+        remained = list()
+        for voice, val in awaiting:
+            if voice.onset_frame is None:
+                remained.append((voice, val))
+            else:
+                self.marker_dispatcher.send_at(self.ahc.frame2dac_time(voice.onset_frame), val)
+        return remained
 
-    def marker_send_offset_thread(self, val):
-        time.sleep(self.offset)
-        self.marker_send_hw(val=val)
+    def play(self, plans, data, time_termination = 'auto', pause=0.5, sample_accurate=False, lookahead=1.0, on_result=None):
+        """
+        play stimulating plan.
+
+        Parameters
+        ----------
+        plans : list of list, pyscab.CompiledPlan, iterator or async generator
+            plans of stimulation. Each plan is [time, id, ch, marker].
+            list of plans is compiled by compile() at the beginning, and the passed list is not modified.
+            Plans compiled in advance start without any preprocessing.
+            Iterator (e.g. generator) and async generator are pulled by pyscab.PlanFeeder while playing,
+            only as plans approach their time, so that plans can be decided during the session, e.g. by the online classifier.
+            Those plans should be yielded in the order of time.
+        data : pyscab.DataHandler
+            audio data referenced by id of plans.
+        time_termination : float, 'auto' or None, default='auto'
+            time (in seconds) to finish playing. If it's 'auto', it's set to the end of the last audio data.
+            For iterator, it's the end of the last audio data after the iterator was exhausted.
+            If it's None, plans will be played until it's stopped.
+        pause : float, default=0.5
+            pause after finishing playing. If play() is stopped, it returns after the fade-out instead.
+        sample_accurate : bool, default=False
+            If True, all plans are handed to the audio interface in advance, and each audio data is started
+            at the exact frame of its time by the mixer. Only markers are sent from the loop in this function.
+            Plans pulled from iterator are handed to the audio interface as soon as they are pulled.
+            If False, audio data is started at the beginning of the next buffer after its time.
+        lookahead : float, default=1.0
+            time (in seconds) before the time of a plan at which it's pulled from iterator.
+            With sample_accurate=True, it should be longer than a few buffers. It's ignored for list of plans.
+        on_result : callable, default=None
+            function called as on_result(plan, played) while playing, as soon as it's known whether audio data of the plan
+            was started (played=True) or not because play() was stopped (played=False).
+            Plans are reported in the order of their onsets, except plans which were not dispatched before play() was stopped.
 
-    def play(self, plans, data, time_termination = 'auto', pause=0.5):
+        Returns
+        -------
+        result : dict
+            'played' : list of plans whose audio data was started. None for iterator, use on_result instead.
+            'skipped' : list of plans which were not started because play() was stopped. None for iterator, use on_result instead.
+            'n_played' : number of plans whose audio data was started.
+            'n_skipped' : number of plans which were not started because play() was stopped.
+            'stopped' : True if play() was stopped by stop(), stop_event or share[0].
+
+        Notes
+        -----
+        For iterator, plans are not kept after they were reported, so that memory doesn't grow with length of the session.
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if plans are invalid. If a plan pulled from iterator is invalid, play() is stopped and it's raised.
+        """
 
         # initialize
         self.share[0] = 0
+        self.stop_event.clear()
 
-        del_idxs = list()
-        if time_termination is None:
-            # TODO : prep two functions for main_loop with and w/o termination with time
-            #        to avoid verbosed conditional branch in loop
+        feeder = None
+        if isinstance(plans, CompiledPlan):
+            if plans.frame_rate != self.ahc.frame_rate:
+                raise ValueError("plans were compiled for frame rate " + str(plans.frame_rate) + ", but frame rate of audio interface is " + str(self.ahc.frame_rate) + ".")
+        elif isinstance(plans, (list, tuple)):
+            plans = self.compile(plans, data)
+        else:
+            feeder = PlanFeeder(plans, data, self.ahc.num_channels, lookahead)
+
+        auto = isinstance(time_termination, str) and time_termination.lower() == 'auto'
+        if time_termination is None or (auto and feeder is not None):
+            # it's set when plans are exhausted
             time_termination = float('inf')
-        elif time_termination.lower() == 'auto':
-            time_termination = get_required_time(plans, data)
+        elif auto:
+            time_termination = plans.end_time
         
         logger.debug("session time was set to %s." ,str(time_termination))
 
+        # events are (time, frame, data, ch, marker, id, plan). order of plans is kept by seq for plans which have same time.
+        queue = list()
+        if feeder is None:
+            records = plans.records
+            # audio data can be replaced (e.g. published) after plans were compiled
+            buffers = plans.resolve(data)
+            queue = list(zip(records['time'].tolist(),
+                             range(len(records)),
+                             records['frame'].tolist(),
+                             [buffers[handle] for handle in records['handle'].tolist()],
+                             records['ch'].tolist(),
+                             records['marker'].tolist(),
+                             records['id'].tolist(),
+                             [plans.plans[idx] for idx in records['index'].tolist()]))
+        # records are sorted by time, so queue is a heap as it is.
+        seq = len(queue)
+
         # requires time to be opened. with out this line, time_info won't be get
         # TO DO : get the state of instance from pyaudio and wait until it's opened instead of waiting with sleep
         #time.sleep(1)
         while self.ahc.get_time_info() is None:
             time.sleep(0.01)
 
+        fs = self.ahc.frame_rate
+        telemetry = getattr(self.ahc, 'telemetry', None)
+        awaiting = list()
+        # (plan, voice or onset frame) of dispatched or scheduled plans which could still be skipped by stop, in the order of onsets.
+        # plans whose onset is before the frame of the mixer were started, so they are reported and dropped.
+        undecided = collections.deque()
+        n_played = 0
+        n_skipped = 0
+        # plans are kept for result only if they are not pulled from iterator
+        played = None if feeder is not None else list()
+        skipped = None if feeder is not None else list()
+
+        def report(plan, is_played):
+            nonlocal n_played, n_skipped
+            if is_played:
+                n_played += 1
+                if played is not None:
+                    played.append(plan)
+            else:
+                n_skipped += 1
+                if skipped is not None:
+                    skipped.append(plan)
+            if on_result is not None:
+                on_result(plan, is_played)
+
+        def get_onset(onset):
+            return onset if isinstance(onset, int) else onset.onset_frame
+
+        if sample_accurate:
+            base_frame = self.ahc.schedule([(event[2], event[3], event[4]) for event in queue], relative=True)
+            undecided.extend((event[7], base_frame + event[2]) for event in queue)
+            logger.debug("%d plans were scheduled from frame %d.", len(queue), base_frame)
+
         self.share[0] = 1
 
-        start = self.ahc.get_time_info()['current_time']
-        while self.share[0] == 1:
-            now = self.ahc.get_time_info()['current_time'] - start
-            for idx, plan in enumerate(plans):
-                if now > plan[0]:
-                    self.ahc.play(data.get_data_by_id(plan[1]),plan[2])
-                    self.marker_send(val=plan[3])
-                    self.share[1] = plan[3]
-                    del_idxs.append(int(idx))
-                    logger.debug("Playing, id:%s, ch:%s, marker:%s, path:%s",str(plan[1]),str(plan[2]),str(plan[3]),data.get_path_by_id(plan[1]))
-                for del_idx in del_idxs:
-                    del plans[del_idx]
-                del_idxs=list()
+        if sample_accurate:
+            start = self.ahc.frame2time(base_frame)
+        else:
+            start = self.ahc.get_time()
+        if feeder is not None:
+            feeder.start(lambda: self.ahc.get_time() - start)
+        stopped = False
+        try:
+            while True:
+                if self.share[0] != 1 or self.stop_event.is_set():
+                    stopped = True
+                    break
+                if feeder is not None:
+                    if feeder.error is not None:
+                        stopped = True
+                        break
+                    # plans handed over before done was set are in incoming
+                    done = feeder.done
+                    if feeder.incoming:
+                        events = list()
+                        while feeder.incoming:
+                            event = feeder.incoming.popleft()
+                            events.append(event)
+                            heapq.heappush(queue, (event[0], seq) + event[1:])
+                            seq += 1
+                        if sample_accurate:
+                            self.ahc.schedule([(base_frame + event[1], event[2], event[3]) for event in events])
+                            undecided.extend((event[6], base_frame + event[1]) for event in events)
+                    if auto and done:
+                        time_termination = feeder.end_time
+                if awaiting:
+                    awaiting = self._send_marker_dac(awaiting)
+                if undecided:
+                    current_frame = self.ahc.get_frame()
+                    while undecided:
+                        onset = get_onset(undecided[0][1])
+                        if onset is None or onset >= current_frame:
+                            break
+                        report(undecided.popleft()[0], True)
+                now = self.ahc.get_time() - start
+                # dispatch all due plans in one pass
+                deadline = None
+                while queue and now > queue[0][0]:
+                    t, _, frame, buffer, ch, marker, id, plan = heapq.heappop(queue)
+                    if telemetry is not None:
+                        telemetry.record_onset(t, now - t)
+                    if sample_accurate is False:
+                        voice = self.ahc.play(buffer, ch)
+                        undecided.append((plan, voice))
+                    if self.correct_latency == 'dac':
+                        if sample_accurate:
+                            self.marker_dispatcher.send_at(self.ahc.frame2dac_time(base_frame + frame), marker)
+                        else:
+                            # onset frame is known after the mixer started the voice.
+                            awaiting.append((voice, marker))
+                    elif self.correct_latency:
+                        # markers dispatched in one pass share a deadline, so that they can be sent together.
+                        if deadline is None:
+                            deadline = self.marker_dispatcher.clock() + self.offset
+                        self.marker_dispatcher.send_at(deadline, marker)
+                    else:
+                        self.marker_send(val=marker)
+                    self.share[1] = marker
+                    logger.debug("Playing, id:%s, ch:%s, marker:%s", str(id), str(ch), str(marker))
+                if now > time_termination:
+                    self.share[0] = 2
+                    break
+                if queue:
+                    wait = min(queue[0][0], time_termination) - now - self.spin_margin
+                else:
+                    wait = time_termination - now - self.spin_margin
+                if awaiting or (feeder is not None and not feeder.done):
+                    # plans pulled from iterator are checked at least every spin_margin
+                    wait = min(wait, self.spin_margin)
+                # waiting on stop_event, so that stop() wakes up this loop immediately
+                if wait > self.time_tick:
+                    self.stop_event.wait(min(wait, MAX_SLEEP))
+                else:
+                    self.stop_event.wait(self.time_tick)
+        finally:
+            if feeder is not None:
+                feeder.stop()
+
+        stop_frame = None
+        if stopped:
+            request = self.ahc.stop(fade=self.fade_out)
+            self.share[0] = 2
+            # the request is processed at the beginning of the next buffer
+            deadline = time.perf_counter() + 4*self.ahc.frames_per_buffer/fs + 0.1
+            while request.frame is None and time.perf_counter() < deadline:
+                time.sleep(self.time_tick)
+            stop_frame = request.frame
+            logger.debug("play was stopped at frame %s.", str(stop_frame))
+
+        while awaiting:
             time.sleep(self.time_tick)
-            if now > time_termination:
-                self.share[0] = 2
-        time.sleep(pause)
+            if stop_frame is not None:
+                # markers are not sent for voices which were skipped
+                awaiting = [(voice, val) for (voice, val) in awaiting if voice.onset_frame is None or voice.onset_frame < stop_frame]
+            awaiting = self._send_marker_dac(awaiting)
+
+        for plan, onset in undecided:
+            onset = get_onset(onset)
+            report(plan, stop_frame is None or (onset is not None and onset < stop_frame))
+        if sample_accurate is False:
+            for event in sorted(queue, key=lambda event: event[:2]):
+                report(event[7], False)
+
+        if feeder is not None and feeder.error is not None:
+            raise feeder.error
+
+        if stopped:
+            time.sleep(self.fade_out)
+        else:
+            time.sleep(pause)
+        return {'played': played, 'skipped': skipped, 'n_played': n_played, 'n_skipped': n_skipped, 'stopped': stopped}
@@ -0,0 +1,307 @@
+import numpy as np
+import json
+import struct
+from logging import getLogger
+logger = getLogger('pyscab.'+__name__)
+
+ARENA_MAGIC = b'PYSCABAR'
+ARENA_VERSION = 1
+# audio data and header are aligned to 64 bytes (cache line)
+ARENA_ALIGN = 64
+
+TABLE_DTYPE = np.dtype([('offset', 'i8'), ('n_frames', 'i8'), ('n_ch', 'i8'), ('sample_width', 'i8'), ('volume', 'f8')])
+
+def _align(n_bytes):
+    return -(-n_bytes//ARENA_ALIGN)*ARENA_ALIGN
+
+def _layout(stimuli, frame_rate):
+    # build header and offsets of audio data. offsets are relative to the beginning of the arena.
+    entries = list()
+    offsets = list()
+    n_payload = 0
+    for id, stimulus in stimuli:
+        data = stimulus.data
+        entries.append({'id': id,
+                        'path': stimulus.path,
+                        'volume': stimulus.volume,
+                        'sample_width': stimulus.sample_width,
+                        'dtype': data.dtype.str,
+                        'n_frames': data.shape[0],
+                        'n_ch': data.shape[1],
+                        'offset': 0})
+        offsets.append(n_payload)
+        n_payload += _align(data.nbytes)
+    # offsets are written in the header, so the header is built until it fits in the space reserved for it
+    n_header = ARENA_ALIGN
+    while True:
+        for entry, offset in zip(entries, offsets):
+            entry['offset'] = n_header + offset
+        header = json.dumps({'version': ARENA_VERSION, 'frame_rate': frame_rate, 'entries': entries}).encode('utf-8')
+        prefix = ARENA_MAGIC + struct.pack('<Q', n_header) + header
+        if len(prefix) <= n_header:
+            break
+        n_header = _align(len(prefix))
+    return prefix.ljust(n_header, b' '), entries, n_header + n_payload
+
+def _parse(buf, source):
+    buf = np.frombuffer(buf, dtype=np.uint8) if not isinstance(buf, np.ndarray) else buf
+    if buf.shape[0] < len(ARENA_MAGIC) + 8 or bytes(buf[:len(ARENA_MAGIC)]) != ARENA_MAGIC:
+        raise ValueError(str(source) + " is not a stimulus arena.")
+    n_header = struct.unpack('<Q', bytes(buf[len(ARENA_MAGIC):len(ARENA_MAGIC)+8]))[0]
+    header = json.loads(bytes(buf[len(ARENA_MAGIC)+8:n_header]).decode('utf-8'))
+    if header['version'] != ARENA_VERSION:
+        raise ValueError("version " + str(header['version']) + " of stimulus arena is not supported.")
+    return header
+
+class StimulusArena(object):
+    """
+    Audio data packed into one contiguous buffer.
+
+    The buffer starts with a header which holds a table of id, offset, number of frames and number of channels of each audio data,
+    followed by audio data aligned to 64 bytes. The same layout is used in memory, in shared memory and in a file,
+    so that a whole library can be saved by a single write, and memory-mapped or attached by a single call.
+
+    Audio data is accessed as read-only views of the buffer.
+
+    Parameters
+    ----------
+    buffer : np.ndarray
+        uint8 array of the arena.
+    frame_rate : int
+        frame rate of audio data.
+    entries : list of dict
+        table of audio data parsed from the header.
+    shm : multiprocessing.shared_memory.SharedMemory, default=None
+        shared memory which holds buffer.
+    owner : bool, default=True
+        If True, shared memory is unlinked by close().
+
+    Attributes
+    ----------
+    name : str or None
+        name of shared memory.
+    ids : list
+        ids of audio data in the order of the buffer.
+    table : np.ndarray
+        structured array with fields 'offset', 'n_frames', 'n_ch', 'sample_width' and 'volume', in the order of ids.
+    n_bytes : int
+        size of the arena in bytes.
+
+    Notes
+    -----
+    ids are stored as JSON, so they should be int or str to be saved or shared.
+    Instances should be created by pack(), load() or attach().
+
+    Examples
+    --------
+    >>> arena = dh.pack()
+    >>> dh.save_arena("/home/USER/stimuli.arena")
+    >>> dh2 = pyscab.DataHandler()
+    >>> dh2.load_arena("/home/USER/stimuli.arena")
+    """
+    def __init__(self, buffer, frame_rate, entries, shm=None, owner=True):
+        self.buffer = buffer
+        self.frame_rate = frame_rate
+        self.entries = entries
+        self._shm = shm
+        self._owner = owner
+        self.name = None if shm is None else shm.name
+        self.n_bytes = buffer.shape[0]
+        self.ids = [entry['id'] for entry in entries]
+        self._index = {id: idx for idx, id in enumerate(self.ids)}
+        self.table = np.zeros(len(entries), dtype=TABLE_DTYPE)
+        for idx, entry in enumerate(entries):
+            self.table[idx] = (entry['offset'], entry['n_frames'], entry['n_ch'], entry['sample_width'], entry['volume'])
+
+    @classmethod
+    def pack(cls, stimuli, frame_rate, shared=False):
+        """
+        pack audio data into a new arena.
+
+        Parameters
+        ----------
+        stimuli : list of tuple
+            pairs of id and pyscab.Stimulus. Audio data should be np.ndarray.
+        frame_rate : int
+            frame rate of audio data.
+        shared : bool, default=False
+            If True, the arena is allocated in multiprocessing.shared_memory,
+            and can be attached from another process with StimulusArena.attach(name).
+
+        Returns
+        -------
+        arena : pyscab.StimulusArena
+        """
+        stimuli = list(stimuli)
+        header, entries, n_bytes = _layout(stimuli, frame_rate)
+        shm = None
+        if shared:
+            from multiprocessing import shared_memory
+            shm = shared_memory.SharedMemory(create=True, size=n_bytes)
+            buffer = np.ndarray(n_bytes, dtype=np.uint8, buffer=shm.buf)
+        else:
+            buffer = np.zeros(n_bytes, dtype=np.uint8)
+        buffer[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+        arena = cls(buffer, frame_rate, entries, shm=shm)
+        for idx, (id, stimulus) in enumerate(stimuli):
+            view = arena._view(idx, writeable=True)
+            view[:] = stimulus.data
+            view.flags.writeable = False
+        logger.debug("%d audio data were packed into %d bytes.", len(entries), n_bytes)
+        return arena
+
+    @staticmethod
+    def write(path, stimuli, frame_rate):
+        """
+        write audio data into a file in the layout of arena, without packing them in memory.
+
+        Parameters
+        ----------
+        path : str
+            file path of the arena.
+        stimuli : list of tuple
+            pairs of id and pyscab.Stimulus. Audio data should be np.ndarray.
+        frame_rate : int
+            frame rate of audio data.
+        """
+        stimuli = list(stimuli)
+        header, entries, n_bytes = _layout(stimuli, frame_rate)
+        with open(path, 'wb') as f:
+            f.write(header)
+            for (id, stimulus), entry in zip(stimuli, entries):
+                f.seek(entry['offset'])
+                f.write(np.ascontiguousarray(stimulus.data).tobytes())
+            f.truncate(n_bytes)
+        logger.debug("%d audio data were written into %s.", len(entries), path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        load arena from a file.
+
+        Parameters
+        ----------
+        path : str
+            file path of the arena.
+        mmap : bool, default=True
+            If True, the file is memory-mapped read-only. Otherwise, it's read into memory.
+
+        Returns
+        -------
+        arena : pyscab.StimulusArena
+
+        Raises
+        ------
+        ValueError
+            Raises ValueError if the file is not an arena.
+        """
+        if mmap:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(path, dtype=np.uint8)
+        header = _parse(buffer, path)
+        return cls(buffer, header['frame_rate'], header['entries'])
+
+    @classmethod
+    def attach(cls, name):
+        """
+        attach to arena in shared memory created by another process.
+
+        Parameters
+        ----------
+        name : str
+            name of shared memory, i.e. attribute name of the arena packed with shared=True.
+
+        Returns
+        -------
+        arena : pyscab.StimulusArena
+        """
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name)
+        buffer = np.ndarray(shm.size, dtype=np.uint8, buffer=shm.buf)
+        header = _parse(buffer, name)
+        return cls(buffer, header['frame_rate'], header['entries'], shm=shm, owner=False)
+
+    def __getstate__(self):
+        if self.name is None:
+            raise ValueError("StimulusArena can be passed to another process only if it's packed with shared=True.")
+        return {'name': self.name}
+
+    def __setstate__(self, state):
+        arena = StimulusArena.attach(state['name'])
+        self.__dict__.update(arena.__dict__)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self._index
+
+    def _view(self, idx, writeable=False):
+        entry = self.entries[idx]
+        dtype = np.dtype(entry['dtype'])
+        view = np.ndarray((entry['n_frames'], entry['n_ch']), dtype=dtype, buffer=self.buffer, offset=entry['offset'])
+        if not writeable:
+            view.flags.writeable = False
+        return view
+
+    def get(self, id):
+        """
+        get audio data specified by id.
+
+        Parameters
+        ----------
+        id : int
+            id of audio data.
+
+        Returns
+        -------
+        data : np.ndarray
+            read-only view of the arena which has a shape of (number of frames, number of channels).
+        """
+        try:
+            return self._view(self._index[id])
+        except KeyError:
+            raise ValueError("id " + str(id) + " does not exist.") from None
+
+    def items(self):
+        """
+        iterate over audio data in the order of the buffer.
+
+        Yields
+        ------
+        id : int
+        data : np.ndarray
+        entry : dict
+            keys : 'id', 'path', 'volume', 'sample_width', 'dtype', 'n_frames', 'n_ch', 'offset'
+        """
+        for idx, entry in enumerate(self.entries):
+            yield entry['id'], self._view(idx), entry
+
+    def save(self, path):
+        """
+        save the arena into a file by a single write.
+
+        Parameters
+        ----------
+        path : str
+            file path of the arena.
+        """
+        with open(path, 'wb') as f:
+            f.write(memoryview(self.buffer))
+
+    def close(self):
+        """
+        release shared memory. It's unlinked if this instance created it.
+        """
+        if self._shm is None:
+            return
+        self.buffer = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # views of shared memory are still referenced, memory is released with them.
+            pass
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
@@ -0,0 +1,211 @@
+import numpy as np
+import os
+import json
+import hashlib
+import threading
+from logging import getLogger
+logger = getLogger('pyscab.'+__name__)
+
+class StimulusCache(object):
+    """
+    On-disk cache of preprocessed audio data.
+
+    Each entry is stored as a raw .npy file named by the hash of its source and processing parameters,
+    so that it can be memory-mapped without decoding or any arithmetic on the next session.
+    Least recently used entries are evicted when total size of the cache exceeds max_bytes.
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory for cached files. It will be created if it does not exist.
+    max_bytes : int, default=None
+        maximum total size (in byte) of cached files. If it's None, cache size is not limited.
+
+    Attributes
+    ----------
+    cache_dir : str
+        directory for cached files.
+    max_bytes : int or None
+        maximum total size (in byte) of cached files.
+
+    Examples
+    --------
+    >>> cache = pyscab.StimulusCache("/home/USER/.cache/pyscab", max_bytes=4*1024**3)
+    >>> dh = pyscab.DataHandler(cache=cache)
+    >>> dh.load(1, path = "/home/USER/Music/something.wav", volume = 0.5)
+    """
+    HASHES_FILE = "hashes.json"
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hashes = dict()
+        try:
+            with open(os.path.join(cache_dir, self.HASHES_FILE), 'r') as f:
+                self._hashes = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def file_hash(self, path):
+        """
+        get content hash of the file.
+
+        The hash is memoized with size and modification time of the file,
+        so that unchanged files will not be read again.
+
+        Parameters
+        ----------
+        path : str
+            file path.
+
+        Returns
+        -------
+        hash : str
+            sha1 hex digest of the file content.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        memo = self._hashes.get(path)
+        if memo is not None and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+            return memo[2]
+
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+
+        with self._lock:
+            self._hashes[path] = [st.st_size, st.st_mtime_ns, digest]
+            self._write_json(self.HASHES_FILE, self._hashes)
+        return digest
+
+    def make_key(self, **params):
+        """
+        make cache key from source and processing parameters.
+
+        Parameters
+        ----------
+        **params
+            json serializable parameters, e.g. source file hash, volume, window, dtype, channel layout.
+
+        Returns
+        -------
+        key : str
+        """
+        text = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        get cached data.
+
+        Parameters
+        ----------
+        key : str
+            cache key.
+
+        Returns
+        -------
+        data : np.ndarray or None
+            read-only memory-mapped data. None if key is not cached.
+        """
+        path = self._path(key)
+        try:
+            data = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        try:
+            # modification time is used as the last access time for LRU eviction
+            os.utime(path)
+        except OSError:
+            pass
+        logger.debug("cache hit : %s", key)
+        return data
+
+    def put(self, key, data):
+        """
+        store data in the cache, and evict least recently used entries if required.
+
+        Parameters
+        ----------
+        key : str
+            cache key.
+        data : np.ndarray
+            data to be cached.
+
+        Returns
+        -------
+        data : np.ndarray
+            read-only memory-mapped data of the stored entry.
+        """
+        path = self._path(key)
+        tmp = path + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(data))
+        os.replace(tmp, path)
+        logger.debug("cache stored : %s", key)
+        self.evict(keep=key)
+        return np.load(path, mmap_mode='r')
+
+    def evict(self, keep=None):
+        """
+        remove least recently used entries until total size of the cache fits max_bytes.
+
+        Parameters
+        ----------
+        keep : str, default=None
+            key which should not be evicted.
+        """
+        if self.max_bytes is None:
+            return
+        entries = list()
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        keep_path = None if keep is None else self._path(keep)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # e.g. file is still mapped on Windows
+                continue
+            total -= size
+            logger.debug("cache evicted : %s", path)
+
+    def clear(self):
+        """
+        remove all cached entries.
+        """
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                os.remove(entry.path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def _write_json(self, name, obj):
+        path = os.path.join(self.cache_dir, name)
+        tmp = path + ".%d.tmp" % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp, path)
@@ -0,0 +1,264 @@
+import numpy as np
+from logging import getLogger
+logger = getLogger('pyscab.'+__name__)
+
+# status flags of PaStreamCallback, which are same values as pyaudio.paInputUnderflow etc.
+STATUS_FLAGS = ['input_underflow', 'input_overflow', 'output_underflow', 'output_overflow', 'priming_output']
+
+# layout of header
+_N_CALLBACKS = 0
+_N_ONSETS = 1
+_STATUS = 2
+_BUDGET = _STATUS + len(STATUS_FLAGS)
+_SIZE = _BUDGET + 1
+_SIZE_ONSETS = _SIZE + 1
+_HEADER_SIZE = 16
+
+class Telemetry(object):
+    """
+    Instrumentation of callback and stimulation.
+
+    All records are written into preallocated ring buffers, so that nothing is allocated in the callback.
+    A record is written before the counter is incremented, so readers in another thread or process
+    only see complete records.
+
+    For each callback, current time of the stream, execution time of the callback and number of active voices are recorded,
+    and status flags passed by portaudio are counted.
+    For each onset dispatched by StimulationController.play(), planned time and lateness are recorded.
+
+    Parameters
+    ----------
+    size : int, default=4096
+        number of callbacks kept in the ring buffer.
+    size_onsets : int, default=4096
+        number of onsets kept in the ring buffer.
+    shared : bool, default=False
+        If True, buffers are allocated in multiprocessing.shared_memory,
+        and can be read from another process with Telemetry.attach(name).
+        Instance created with shared=True can also be passed to another process as it is.
+
+    Attributes
+    ----------
+    name : str or None
+        name of shared memory.
+
+    Examples
+    --------
+    >>> telemetry = pyscab.Telemetry()
+    >>> ahc = pyscab.AudioInterface(device_name = 'default', n_ch = 2, telemetry = telemetry)
+    >>> ...
+    >>> telemetry.summary()
+    """
+    def __init__(self, size=4096, size_onsets=4096, shared=False, _name=None):
+        self._shm = None
+        self.name = None
+        if _name is not None:
+            from multiprocessing import shared_memory
+            self._shm = shared_memory.SharedMemory(name=_name)
+            header = np.ndarray(_HEADER_SIZE, dtype=np.float64, buffer=self._shm.buf)
+            size, size_onsets = int(header[_SIZE]), int(header[_SIZE_ONSETS])
+            self.name = _name
+            self._owner = False
+        n_bytes = (_HEADER_SIZE + size*3 + size_onsets*2)*8
+        if _name is None and shared:
+            from multiprocessing import shared_memory
+            self._shm = shared_memory.SharedMemory(create=True, size=n_bytes)
+            self.name = self._shm.name
+            self._owner = True
+        if self._shm is not None:
+            buf = np.ndarray(n_bytes//8, dtype=np.float64, buffer=self._shm.buf)
+        else:
+            buf = np.zeros(n_bytes//8, dtype=np.float64)
+            self._owner = True
+        self._header = buf[:_HEADER_SIZE]
+        self._callbacks = buf[_HEADER_SIZE:_HEADER_SIZE+size*3].reshape(size, 3)
+        self._onsets = buf[_HEADER_SIZE+size*3:].reshape(size_onsets, 2)
+        self.size = size
+        self.size_onsets = size_onsets
+        if self._owner:
+            buf.fill(0)
+            self._header[_SIZE] = size
+            self._header[_SIZE_ONSETS] = size_onsets
+
+    @classmethod
+    def attach(cls, name):
+        """
+        attach to telemetry in shared memory created by another process.
+
+        Parameters
+        ----------
+        name : str
+            name of shared memory, i.e. attribute name of the instance created with shared=True.
+
+        Returns
+        -------
+        telemetry : pyscab.Telemetry
+        """
+        return cls(_name=name)
+
+    def __getstate__(self):
+        if self.name is None:
+            raise ValueError("Telemetry can be passed to another process only if it's created with shared=True.")
+        return {'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(_name=state['name'])
+
+    def close(self):
+        """
+        release shared memory. It's unlinked if this instance created it.
+        """
+        if self._shm is None:
+            return
+        self._header = self._callbacks = self._onsets = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def set_budget(self, budget):
+        """
+        set time budget of the callback, i.e. frames_per_buffer/frame_rate.
+
+        Parameters
+        ----------
+        budget : float
+            time in seconds.
+        """
+        self._header[_BUDGET] = budget
+
+    def reset(self):
+        """
+        clear all records. It should not be called while the stream is running.
+        """
+        self._header[:_BUDGET] = 0
+        self._callbacks.fill(0)
+        self._onsets.fill(0)
+
+    def record_callback(self, current_time, duration, n_active, status):
+        """
+        record a callback. It's called from the callback.
+
+        Parameters
+        ----------
+        current_time : float
+            current time of the stream passed to the callback.
+        duration : float
+            execution time of the callback in seconds.
+        n_active : int
+            number of active voices.
+        status : int
+            status flags passed to the callback.
+        """
+        header = self._header
+        n = int(header[_N_CALLBACKS])
+        row = self._callbacks[n % self.size]
+        row[0] = current_time
+        row[1] = duration
+        row[2] = n_active
+        if status:
+            for bit in range(len(STATUS_FLAGS)):
+                if status & (1 << bit):
+                    header[_STATUS+bit] += 1
+        header[_N_CALLBACKS] = n + 1
+
+    def record_onset(self, time, lateness):
+        """
+        record an onset dispatched by StimulationController.play().
+
+        Parameters
+        ----------
+        time : float
+            planned time of the onset.
+        lateness : float
+            time in seconds from the planned time to the dispatch.
+        """
+        header = self._header
+        n = int(header[_N_ONSETS])
+        row = self._onsets[n % self.size_onsets]
+        row[0] = time
+        row[1] = lateness
+        header[_N_ONSETS] = n + 1
+
+    def get_n_callbacks(self):
+        """
+        get number of recorded callbacks.
+
+        Returns
+        -------
+        n_callbacks : int
+        """
+        return int(self._header[_N_CALLBACKS])
+
+    def get_status_counts(self):
+        """
+        get counts of status flags.
+
+        Returns
+        -------
+        counts : dict
+            keys are 'input_underflow', 'input_overflow', 'output_underflow', 'output_overflow' and 'priming_output'.
+        """
+        return {flag: int(self._header[_STATUS+idx]) for idx, flag in enumerate(STATUS_FLAGS)}
+
+    def get_callbacks(self):
+        """
+        get records of the latest callbacks in chronological order.
+
+        Returns
+        -------
+        callbacks : np.ndarray
+            array which has a shape of (number of records, 3).
+            columns are current time of the stream, execution time of the callback and number of active voices.
+        """
+        return self._read(self._callbacks, _N_CALLBACKS)
+
+    def get_onsets(self):
+        """
+        get records of the latest onsets in chronological order.
+
+        Returns
+        -------
+        onsets : np.ndarray
+            array which has a shape of (number of records, 2). columns are planned time and lateness.
+        """
+        return self._read(self._onsets, _N_ONSETS)
+
+    def summary(self):
+        """
+        get summary of records in the ring buffers.
+
+        Returns
+        -------
+        summary : dict
+        """
+        callbacks = self.get_callbacks()
+        onsets = self.get_onsets()
+        summary = {'n_callbacks': self.get_n_callbacks(),
+                   'n_onsets': int(self._header[_N_ONSETS]),
+                   'budget': float(self._header[_BUDGET])}
+        summary.update(self.get_status_counts())
+        if len(callbacks):
+            durations = callbacks[:, 1]
+            summary['duration_median'] = float(np.median(durations))
+            summary['duration_p99'] = float(np.percentile(durations, 99))
+            summary['duration_max'] = float(np.max(durations))
+            if summary['budget'] > 0:
+                summary['load_max'] = summary['duration_max']/summary['budget']
+            summary['n_active_max'] = int(np.max(callbacks[:, 2]))
+        if len(onsets):
+            summary['lateness_median'] = float(np.median(onsets[:, 1]))
+            summary['lateness_p99'] = float(np.percentile(onsets[:, 1], 99))
+            summary['lateness_max'] = float(np.max(onsets[:, 1]))
+        return summary
+
+    def _read(self, ring, idx_counter):
+        n = int(self._header[idx_counter])
+        size = ring.shape[0]
+        if n <= size:
+            return ring[:n].copy()
+        start = n % size
+        data = np.concatenate((ring[start:], ring[:start]))
+        # records overwritten while copying are dropped
+        n_overwritten = int(self._header[idx_counter]) - n
+        return data[min(n_overwritten, size):]
@@ -0,0 +1,177 @@
+import numpy as np
+import threading
+from logging import getLogger
+from .DataHandler import read_wav_header, _sample_width2dtype
+logger = getLogger('pyscab.'+__name__)
+
+class WavStream(object):
+    """
+    wav file which is played by streaming from disk.
+
+    It's a descriptor of the file, and doesn't hold audio data.
+    Each time it's played, a new pyscab.StreamReader reads the file from the beginning into a bounded ring buffer,
+    so that memory usage doesn't depend on length of the file.
+
+    Parameters
+    ----------
+    path : str
+        file path of wav file.
+    volume : float, default=1.0
+        gain applied while mixing.
+    ring_frames : int, default=65536
+        size of ring buffer in frames.
+    block_frames : int, default=8192
+        number of frames read from the file at once.
+
+    Attributes
+    ----------
+    shape : tuple
+        (number of frames, number of channels) of the file.
+    dtype : np.dtype
+        format of audio data in the file.
+    header : dict
+        See pyscab.read_wav_header().
+
+    Examples
+    --------
+    >>> dh = pyscab.DataHandler()
+    >>> dh.load_stream(1, path = "/home/USER/Music/audiobook.wav")
+    """
+    ndim = 2
+
+    def __init__(self, path, volume=1.0, ring_frames=65536, block_frames=8192):
+        self.path = path
+        self.volume = volume
+        self.header = read_wav_header(path)
+        self.dtype = _sample_width2dtype(self.header['sample_width'])
+        self.shape = (self.header['n_frames'], self.header['n_ch'])
+        self.ring_frames = ring_frames
+        self.block_frames = min(block_frames, ring_frames)
+
+    def open(self):
+        """
+        start reading the file.
+
+        Returns
+        -------
+        reader : pyscab.StreamReader
+        """
+        return StreamReader(self)
+
+class StreamReader(object):
+    """
+    reading wav file into a ring buffer by a background thread.
+
+    The file is opened and the ring buffer is filled by the thread, so that creating an instance doesn't wait for the disk.
+    Frames which are read before the thread filled them are not available yet (see read()).
+
+    Parameters
+    ----------
+    stream : pyscab.WavStream
+        file to be read.
+
+    Attributes
+    ----------
+    n_frames : int
+        number of frames to be read.
+    written : int
+        number of frames written into the ring buffer.
+    consumed : int
+        number of frames read from the ring buffer.
+    n_underrun : int
+        number of frames which were not available in time and were replaced with silence.
+    """
+    def __init__(self, stream):
+        self.n_frames, self.n_ch = stream.shape
+        self.size = stream.ring_frames
+        self.block_frames = stream.block_frames
+        self.ring = np.zeros((self.size, self.n_ch), dtype=stream.dtype)
+        self.written = 0
+        self.consumed = 0
+        self.n_underrun = 0
+        self._space = threading.Event()
+        self._data = threading.Event()
+        self._closed = False
+        self._path = stream.path
+        self._offset = stream.header['offset']
+        self._file = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        # read frames until the ring buffer is full
+        n_total = 0
+        frame_bytes = self.ring.strides[0]
+        while not self._closed:
+            n = min(self.size - (self.written - self.consumed), self.block_frames, self.n_frames - self.written)
+            if n <= 0:
+                break
+            idx = self.written % self.size
+            n = min(n, self.size - idx)
+            n_read = self._file.readinto(memoryview(self.ring[idx:idx+n]).cast('B')) // frame_bytes
+            if n_read == 0:
+                logger.debug("%d frames were missing in the file.", self.n_frames - self.written)
+                self.n_frames = self.written
+                break
+            self.written += n_read
+            n_total += n_read
+            self._data.set()
+        return n_total
+
+    def _run(self):
+        try:
+            self._file = open(self._path, 'rb')
+            self._file.seek(self._offset)
+            while not self._closed and self.written < self.n_frames:
+                self._space.clear()
+                if self._fill() == 0:
+                    self._space.wait(0.1)
+        except OSError as e:
+            logger.error("%s could not be read : %s", self._path, str(e))
+            self.n_frames = self.written
+        finally:
+            if self._file is not None:
+                self._file.close()
+            self._data.set()
+
+    def read(self, rows, block=False):
+        """
+        read next frames from the ring buffer.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            array which has a shape of (number of channels, number of frames).
+            Audio data is copied into it, transposed.
+        block : bool, default=False
+            If True, it waits until the frames are read from the file.
+
+        Returns
+        -------
+        n : int
+            number of frames copied. It's smaller than requested if the reader thread is behind.
+        """
+        n = rows.shape[1]
+        if block:
+            while self.written - self.consumed < n and self.written < self.n_frames and not self._closed:
+                self._data.clear()
+                if self.written - self.consumed < n:
+                    self._data.wait(0.1)
+        n = min(n, self.written - self.consumed)
+        k = rows.shape[0]
+        idx = self.consumed % self.size
+        n_first = min(n, self.size - idx)
+        rows[:, :n_first] = self.ring[idx:idx+n_first, :k].T
+        if n > n_first:
+            rows[:, n_first:n] = self.ring[:n-n_first, :k].T
+        self.consumed += n
+        self._space.set()
+        return n
+
+    def close(self):
+        """
+        stop the reader thread and close the file.
+        """
+        self._closed = True
+        self._space.set()
+        self._thread.join()
@@ -1,4 +1,12 @@
 from .HardwareController import *
+from .NullBackend import *
+from .Telemetry import *
 from .DataHandler import *
+from .StimulusCache import *
+from .StimulusArena import *
+from .WavStream import *
 from .StimulationController import *
+from .AudioProcess import *
+from .CompiledPlan import *
+from .OfflineRenderer import *
 from .utils import *
@@ -1,24 +1,130 @@
+import numpy as np
+import functools
 
-def generate_pcm(number_of_channels=1, frequency=440, duration = 1.0, volume = 1.0, fs=44100, format="INT16", window = "linear", t_raise_fall = 0.01):
-    import numpy as np
-    t = np.arange(0, duration, 1/fs)
-    sin = volume * np.sin(2*np.pi*frequency*t)
+WINDOW_SHAPES = ('LINEAR', 'COSINE', 'HANN', 'GAUSSIAN')
+
+@functools.lru_cache(maxsize=256)
+def _ramp(n_frames, shape):
+    i = np.arange(n_frames, dtype=np.float64)
+    x = i/max(n_frames-1, 1)
+    if shape == 'LINEAR':
+        ramp = x
+    elif shape == 'COSINE':
+        ramp = np.sin(0.5*np.pi*x)
+    elif shape == 'HANN':
+        ramp = 0.5 - 0.5*np.cos(np.pi*x)
+    elif shape == 'GAUSSIAN':
+        # standard deviation is 1/3 of the ramp, so that it starts from exp(-4.5)
+        ramp = np.exp(-0.5*((x - 1)*3)**2)
+    else:
+        raise ValueError("Unknown window : " + str(shape) + ". It can only take " + ", ".join(WINDOW_SHAPES) + ".")
+    ramp = ramp.astype(np.float32)[:, np.newaxis]
+    ramp.flags.writeable = False
+    return ramp
+
+def get_ramp(t_raise_fall, fs=44100, window="linear"):
+    """
+    get raising ramp of window.
+
+    Ramps are cached for each length and shape, so that they are computed only once for a library of stimuli.
+
+    Parameters
+    ----------
+    t_raise_fall : float
+        time duration of the ramp.
+    fs : int, default=44100
+        frame rate.
+    window : {'linear', 'cosine', 'hann', 'gaussian'}, default='linear'
+        shape of the ramp.
+
+    Returns
+    -------
+    ramp : np.ndarray
+        read-only float32 ramp which has a shape of (number of frames, 1). It rises from 0 to 1.
+        Falling ramp is ramp[::-1].
+    """
+    return _ramp(int(t_raise_fall*fs), window.upper())
 
-    if window is None:
-        pass
-    elif window.upper() == "LINEAR":
-        #import sys
-        #import matplotlib.pyplot as plt
-        raise_ = np.arange(0, int(t_raise_fall*fs))
-        fall_ = np.arange(int(t_raise_fall*fs), 0, -1)
+def apply_envelope(data, t_raise_fall, fs=44100, window="linear"):
+    """
+    apply raising and falling ramp of window to audio data in place.
 
-        raise_ = raise_ / max(raise_)
-        fall_ = fall_ / max(fall_)
-        flat = np.ones((int((duration-2*t_raise_fall)*fs)))
+    Only the first and the last t_raise_fall of the data are processed, and the ramp is broadcast over channels.
+    UInt8 data is faded around its center (128).
 
-        win_filter = np.concatenate([raise_, flat, fall_])
+    Parameters
+    ----------
+    data : np.ndarray
+        audio data which have a shape of (number of frames, number of channels) or (number of frames,).
+        If it's read-only (e.g. memory-mapped), it's copied first.
+    t_raise_fall : float
+        time duration for raise and fall.
+    fs : int, default=44100
+        frame rate of data.
+    window : {'linear', 'cosine', 'hann', 'gaussian'}, default='linear'
+        shape of the ramp.
+
+    Returns
+    -------
+    data : np.ndarray
+        windowed audio data. It's the passed array unless it was read-only.
+
+    Raises
+    ------
+    ValueError
+        Raises ValueError if raise and fall are longer than the data.
+    """
+    ramp = get_ramp(t_raise_fall, fs, window)
+    n = ramp.shape[0]
+    if n == 0:
+        return data
+    if 2*n > data.shape[0]:
+        raise ValueError("t_raise_fall " + str(t_raise_fall) + " is too long for " + str(data.shape[0]) + " frames.")
+    if not data.flags.writeable:
+        data = np.array(data)
+    if data.ndim == 1:
+        ramp = ramp[:, 0]
+
+    if np.issubdtype(data.dtype, np.floating):
+        data[:n] *= ramp
+        data[-n:] *= ramp[::-1]
+        return data
+
+    center = 128 if data.dtype == np.dtype("uint8") else 0
+    info = np.iinfo(data.dtype)
+    for segment, gain in ((data[:n], ramp), (data[-n:], ramp[::-1])):
+        x = segment.astype(np.float32)
+        if center:
+            x -= center
+        x *= gain
+        if center:
+            x += center
+        np.rint(x, out=x)
+        np.clip(x, info.min, info.max, out=x)
+        segment[...] = x
+    return data
+
+def generate_pcm(number_of_channels=1, frequency=440, duration = 1.0, volume = 1.0, fs=44100, format="INT16", window = "linear", t_raise_fall = 0.01, cache=None):
+    if cache is not None:
+        key = cache.make_key(generator='generate_pcm',
+                             number_of_channels=number_of_channels,
+                             frequency=frequency,
+                             duration=duration,
+                             volume=volume,
+                             fs=fs,
+                             format=format.upper(),
+                             window=window if window is None else window.upper(),
+                             t_raise_fall=t_raise_fall)
+        sin = cache.get(key)
+        if sin is None:
+            sin = cache.put(key, generate_pcm(number_of_channels, frequency, duration, volume, fs, format, window, t_raise_fall))
+        return sin
+
+    t = np.arange(0, duration, 1/fs)
+    sin = volume * np.sin(2*np.pi*frequency*t)
 
-        sin = sin * win_filter
+    if window is not None:
+        sin = apply_envelope(sin, t_raise_fall, fs, window)
 
     if format.upper() == "INT16":
         dt = np.dtype("int16")
@@ -47,3 +153,79 @@ def generate_pcm(number_of_channels=1, frequency=440, duration = 1.0, volume = 1
 
     
 
+
+def generate_tones(specs, fs=44100, format="INT16", window="linear", t_raise_fall=0.01):
+    """
+    generate multiple pure tones at once.
+
+    Tones which have the same number of frames and window are generated together as a matrix,
+    with a shared time base and vectorized across frequencies.
+
+    Parameters
+    ----------
+    specs : list of dict
+        specification of each tone.
+        keys : 'frequency', 'duration' and optionally 'volume' (default=1.0), 'window' and 't_raise_fall'.
+        Other keys (e.g. 'id') are ignored.
+    fs : int, default=44100
+        frame rate.
+    format : {'INT16', 'UINT8'}, default='INT16'
+        format of generated tones.
+    window : {'linear', 'cosine', 'hann', 'gaussian'} or None, default='linear'
+        window applied to tones which don't specify 'window'. See apply_envelope().
+    t_raise_fall : float, default=0.01
+        time duration for raise and fall of tones which don't specify 't_raise_fall'.
+
+    Returns
+    -------
+    tones : list of np.ndarray
+        mono tones which have a shape of (number of frames, 1), in the order of specs.
+
+    Raises
+    ------
+    ValueError
+        Raises ValueError if volume is out of range of [-1, 1].
+
+    Examples
+    --------
+    >>> specs = [{'frequency': f, 'duration': 0.1, 'volume': 0.5} for f in [440, 494, 523, 587]]
+    >>> tones = pyscab.generate_tones(specs)
+    """
+    if format.upper() == "INT16":
+        dt = np.dtype("int16")
+    elif format.upper() == "UINT8":
+        dt = np.dtype("uint8")
+    else:
+        raise ValueError("Unknown Format : " + format + ". It can only take INT16 or UINT8.")
+
+    groups = dict()
+    for idx, spec in enumerate(specs):
+        volume = spec.get('volume', 1.0)
+        if abs(volume) > 1.0:
+            raise ValueError("volume of tone " + str(idx) + " is out of range : " + str(volume))
+        key = (int(round(spec['duration']*fs)), spec.get('window', window), spec.get('t_raise_fall', t_raise_fall))
+        groups.setdefault(key, list()).append(idx)
+
+    tones = [None for spec in specs]
+    bases = dict()
+    for (n_frames, win, t_rf), indices in groups.items():
+        if n_frames not in bases:
+            bases[n_frames] = 2*np.pi/fs*np.arange(n_frames)
+        frequencies = np.array([specs[idx]['frequency'] for idx in indices], dtype=np.float64)[:, np.newaxis]
+        volumes = np.array([specs[idx].get('volume', 1.0) for idx in indices], dtype=np.float64)[:, np.newaxis]
+        # each row is a tone
+        x = frequencies*bases[n_frames]
+        np.sin(x, out=x)
+        x *= volumes
+        if win is not None:
+            apply_envelope(x.T, t_rf, fs, win)
+        if dt == np.dtype("int16"):
+            x *= 32767
+        else:
+            x *= 0.5
+            x += 0.5
+            x *= 255
+        x = x.astype(dt)
+        for row, idx in enumerate(indices):
+            tones[idx] = x[row][:, np.newaxis]
+    return tones
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pyscab
+
+#------------------------------------------------
+# benchmark of hot paths of pyscab.
+# It runs without audio device by using pyscab.NullBackend, and writes results as json.
+#
+# usage :
+# python tests/benchmark.py --output results.json
+#
+
+WAV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "440Hz_stereo.wav")
+FRAME_RATE = 44100
+FRAMES_PER_BUFFER = 512
+
+def bench_load(n_files, repeat):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = list()
+        for m in range(n_files):
+            paths.append(os.path.join(tmp_dir, "%d.wav" % m))
+            shutil.copyfile(WAV_PATH, paths[-1])
+        n_bytes = os.path.getsize(WAV_PATH)*n_files
+
+        results = dict()
+        for name, n_jobs, mmap in [("sequential", 1, False), ("threads", None, False), ("mmap", 1, True)]:
+            elapsed = list()
+            for r in range(repeat):
+                dh = pyscab.DataHandler()
+                start = time.perf_counter()
+                dh.load_many([(m, path) for m, path in enumerate(paths)], n_jobs=n_jobs, mmap=mmap)
+                elapsed.append(time.perf_counter() - start)
+            results[name] = {"n_files": n_files,
+                             "seconds": min(elapsed),
+                             "files_per_second": n_files/min(elapsed),
+                             "mbytes_per_second": n_bytes/min(elapsed)/1e6}
+        return results
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def bench_lookup(n_stimuli_list, n_lookups):
+    results = list()
+    data = np.zeros((100, 1), dtype=np.int16)
+    for n_stimuli in n_stimuli_list:
+        dh = pyscab.DataHandler()
+        for m in range(n_stimuli):
+            dh.add_pcm(m, data)
+        ids = np.random.randint(0, n_stimuli, n_lookups).tolist()
+        start = time.perf_counter()
+        for id in ids:
+            dh.get_data_by_id(id)
+        elapsed = time.perf_counter() - start
+        results.append({"n_stimuli": n_stimuli, "us_per_lookup": elapsed/n_lookups*1e6})
+    return results
+
+def make_voices(n_voices, n_ch, n_frames):
+    data = (np.random.randn(n_frames, 2)*1000).astype(np.int16)
+    return [(data, [m % n_ch + 1, (m+1) % n_ch + 1]) for m in range(n_voices)]
+
+def bench_read_chunk(n_voices_list, n_buffers):
+    results = list()
+    for n_voices in n_voices_list:
+        voices = [pyscab.ReadAudioChunk(data, FRAMES_PER_BUFFER, ch) for data, ch in make_voices(n_voices, 8, FRAMES_PER_BUFFER*(n_buffers+1))]
+        start = time.perf_counter()
+        for m in range(n_buffers):
+            for voice in voices:
+                voice.read_chunk()
+        elapsed = time.perf_counter() - start
+        results.append({"n_voices": n_voices, "ms_per_buffer": elapsed/n_buffers*1000})
+    return results
+
+def bench_callback(n_voices_list, n_buffers, limiter):
+    results = list()
+    for n_voices in n_voices_list:
+        ahc = pyscab.AudioInterface(n_ch=8, frames_per_buffer=FRAMES_PER_BUFFER, limiter=limiter,
+                                    backend=pyscab.NullBackend(threaded=False, capture=False))
+        ahc.open()
+        for data, ch in make_voices(n_voices, 8, FRAMES_PER_BUFFER*(n_buffers+2)):
+            ahc.play(data, ch)
+        # first buffer starts voices
+        ahc.stream.process(1)
+        elapsed = list()
+        for m in range(n_buffers):
+            start = time.perf_counter()
+            ahc.stream.process(1)
+            elapsed.append(time.perf_counter() - start)
+        ahc.close()
+        elapsed = np.array(elapsed)*1000
+        results.append({"n_voices": n_voices,
+                        "limiter": limiter,
+                        "ms_per_buffer_median": float(np.median(elapsed)),
+                        "ms_per_buffer_p99": float(np.percentile(elapsed, 99)),
+                        "budget_ms": FRAMES_PER_BUFFER/FRAME_RATE*1000})
+    return results
+
+def bench_play(n_plans_list, duration, sample_accurate):
+    results = list()
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.zeros((100, 2), dtype=np.int16))
+    for n_plans in n_plans_list:
+        ahc = pyscab.AudioInterface(n_ch=2, frames_per_buffer=FRAMES_PER_BUFFER, backend=pyscab.NullBackend(capture=False))
+        sent = list()
+        sc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append(ahc.get_time()), correct_latency=False)
+        sc.open()
+        plans = [[duration*m/n_plans, 1, [1, 2], m] for m in range(n_plans)]
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        sc.play(plans, dh, time_termination=duration, pause=0, sample_accurate=sample_accurate)
+        cpu = (time.process_time() - start_cpu)/(time.perf_counter() - start_wall)
+        sc.close()
+
+        # the first plan is dispatched at the start of play()
+        latency = (np.array(sent) - sent[0] - np.array([plan[0] for plan in plans]))*1000
+        results.append({"n_plans": n_plans,
+                        "sample_accurate": sample_accurate,
+                        "latency_ms_median": float(np.median(latency)),
+                        "latency_ms_p99": float(np.percentile(latency, 99)),
+                        "latency_ms_max": float(np.max(latency)),
+                        "cpu_load": cpu})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of pyscab")
+    parser.add_argument("--output", default=None, help="path of json file. results are printed if it's not set.")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes for a quick check.")
+    args = parser.parse_args()
+
+    if args.quick:
+        n_files, repeat, n_buffers, duration = 8, 1, 50, 0.5
+        n_stimuli_list, n_voices_list, n_plans_list = [10, 1000], [1, 16], [10, 100]
+    else:
+        n_files, repeat, n_buffers, duration = 64, 3, 500, 2.0
+        n_stimuli_list, n_voices_list, n_plans_list = [10, 100, 1000, 10000], [1, 4, 16, 32, 64], [10, 100, 1000]
+
+    results = {"python": platform.python_version(),
+               "numpy": np.__version__,
+               "platform": platform.platform(),
+               "machine": platform.machine(),
+               "frames_per_buffer": FRAMES_PER_BUFFER,
+               "frame_rate": FRAME_RATE}
+    results["load"] = bench_load(n_files, repeat)
+    results["lookup"] = bench_lookup(n_stimuli_list, 10000)
+    results["read_chunk"] = bench_read_chunk(n_voices_list, n_buffers)
+    results["callback"] = bench_callback(n_voices_list, n_buffers, None) + bench_callback(n_voices_list, n_buffers, 'soft')
+    results["play"] = bench_play(n_plans_list, duration, False) + bench_play(n_plans_list, duration, True)
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import time
+import numpy as np
+from pyscab.HardwareController import Mixer, ReadAudioChunk
+
+#------------------------------------------------
+# benchmark of mixer against callback of ver 1.0.1
+#
+
+N_CH = 8
+FRAMES_PER_BUFFER = 512
+N_BUFFERS = 200
+N_VOICES = [1, 4, 16, 32, 64]
+N_CH_VOICE = [2, 8]
+
+def legacy_callback(voices, data_callback):
+    # callback of ver 1.0.1, which loops over all voices and channels.
+    data_callback.fill(0)
+    for voice in voices:
+        if voice.finished is False:
+            chunk = voice.read_chunk()
+            for idx_ch, ch in enumerate(voice.get_ch()):
+                data_callback[:, ch-1] += chunk[:, idx_ch]
+    return data_callback
+
+def make_voices(n_voices, n_ch_voice, n_frames):
+    data = (np.random.randn(n_frames, n_ch_voice)*1000).astype(np.int16)
+    return [ReadAudioChunk(data, FRAMES_PER_BUFFER, [(m+idx_ch) % N_CH + 1 for idx_ch in range(n_ch_voice)]) for m in range(n_voices)]
+
+def bench_legacy(n_voices, n_ch_voice):
+    voices = make_voices(n_voices, n_ch_voice, FRAMES_PER_BUFFER*(N_BUFFERS+1))
+    data_callback = np.zeros((FRAMES_PER_BUFFER, N_CH), dtype=np.int16)
+    start = time.perf_counter()
+    for m in range(N_BUFFERS):
+        legacy_callback(voices, data_callback)
+    return (time.perf_counter() - start)/N_BUFFERS
+
+def bench_mixer(n_voices, n_ch_voice, limiter=None):
+    voices = make_voices(n_voices, n_ch_voice, FRAMES_PER_BUFFER*(N_BUFFERS+1))
+    mixer = Mixer(N_CH, FRAMES_PER_BUFFER, limiter=limiter)
+    for voice in voices:
+        mixer.add(voice)
+    start = time.perf_counter()
+    for m in range(N_BUFFERS):
+        mixer.mix(FRAMES_PER_BUFFER)
+    return (time.perf_counter() - start)/N_BUFFERS
+
+budget = FRAMES_PER_BUFFER/44100
+print("time per buffer (budget : %.3f ms)" % (budget*1000))
+print("voices, channels per voice, legacy [ms], mixer [ms], mixer with soft limiter [ms]")
+for n_ch_voice in N_CH_VOICE:
+    for n_voices in N_VOICES:
+        print("%d, %d, %.3f, %.3f, %.3f" % (n_voices,
+                                            n_ch_voice,
+                                            bench_legacy(n_voices, n_ch_voice)*1000,
+                                            bench_mixer(n_voices, n_ch_voice)*1000,
+                                            bench_mixer(n_voices, n_ch_voice, limiter='soft')*1000))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import pyscab
+
+def make_data():
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.arange(20, dtype=np.int16).reshape(10, 2))
+    dh.add_pcm('noise', np.full((7, 1), -3, dtype=np.int16))
+    dh.add_tones([{'id': 3, 'frequency': 440, 'duration': 0.05}])
+    return dh
+
+def test_pack_replaces_data_with_views():
+    dh = make_data()
+    expected = {id: dh.get_data_by_id(id).copy() for id in dh.id}
+    arena = dh.pack()
+    assert len(arena) == 3 and 'noise' in arena
+    for id in dh.id:
+        data = dh.get_data_by_id(id)
+        assert np.array_equal(data, expected[id])
+        assert np.shares_memory(data, arena.buffer)
+        assert not data.flags.writeable
+        assert (data.__array_interface__['data'][0] - arena.buffer.__array_interface__['data'][0]) % 64 == 0
+    with pytest.raises(ValueError):
+        arena.get(4)
+
+def test_save_and_load_round_trip(tmp_path):
+    dh = make_data()
+    path = str(tmp_path / "stimuli.arena")
+    dh.save_arena(path)
+    # saving the packed arena gives the same file
+    path_packed = str(tmp_path / "packed.arena")
+    dh.pack().save(path_packed)
+    assert open(path, 'rb').read() == open(path_packed, 'rb').read()
+    for mmap in (True, False):
+        loaded = pyscab.DataHandler()
+        arena = loaded.load_arena(path, mmap=mmap)
+        assert isinstance(arena.buffer, np.memmap) == mmap
+        assert loaded.id == dh.id
+        for id in dh.id:
+            assert np.array_equal(loaded.get_data_by_id(id), dh.get_data_by_id(id))
+            assert loaded.get_n_ch_by_id(id) == dh.get_n_ch_by_id(id)
+        with pytest.raises(ValueError):
+            loaded.load_arena(path)
+
+def test_load_arena_checks_frame_rate(tmp_path):
+    path = str(tmp_path / "stimuli.arena")
+    make_data().save_arena(path)
+    with pytest.raises(ValueError):
+        pyscab.DataHandler(frame_rate=48000).load_arena(path)
+
+def test_not_arena_raises(tmp_path):
+    path = tmp_path / "a.arena"
+    path.write_bytes(b"not an arena")
+    with pytest.raises(ValueError):
+        pyscab.StimulusArena.load(str(path))
+
+def test_shared_arena_can_be_attached():
+    dh = make_data()
+    arena = dh.pack(shared=True)
+    try:
+        attached = pyscab.StimulusArena.attach(arena.name)
+        assert attached.ids == arena.ids
+        assert np.array_equal(attached.get(1), dh.get_data_by_id(1))
+        attached.close()
+    finally:
+        arena.close()
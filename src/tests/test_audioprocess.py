@@ -0,0 +1,103 @@
+import time
+import numpy as np
+import pytest
+import pyscab
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+def test_command_ring():
+    ring = pyscab.CommandRing(2, 3)
+    out = np.zeros(3)
+    try:
+        assert not ring.pop(out)
+        ring.push(np.array([1.0, 2.0, 3.0]))
+        ring.push(np.array([4.0, 5.0, 6.0]))
+        with pytest.raises(RuntimeError):
+            ring.push(np.zeros(3), timeout=0.01)
+        # consumer attached by name
+        consumer = pyscab.CommandRing(2, 3, name=ring.name)
+        assert consumer.pop(out) and out.tolist() == [1.0, 2.0, 3.0]
+        ring.push(np.array([7.0, 8.0, 9.0]))
+        assert consumer.pop(out) and out.tolist() == [4.0, 5.0, 6.0]
+        assert consumer.pop(out) and out.tolist() == [7.0, 8.0, 9.0]
+        assert not consumer.pop(out)
+        consumer.close()
+    finally:
+        ring.close()
+
+def test_play_on_null_backend():
+    ahc = pyscab.AudioProcess(backend='null', frames_per_buffer=256)
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.full((1000, 1), 100, dtype=np.int16))
+    dh.add_pcm(2, np.full((10, 2), 100, dtype=np.int16))
+    ahc.publish(dh)
+    ahc.open()
+    try:
+        assert ahc.device['name'] == 'null'
+        assert wait_until(lambda: ahc.get_time_info() is not None)
+        with pytest.raises(ValueError):
+            ahc.play(np.zeros((10, 1), dtype=np.int16), [1])
+        with pytest.raises(ValueError):
+            ahc.play(dh.get_data_by_id(1), [3])
+        frame = ahc.get_frame() + 2048
+        voice = ahc.play(dh.get_data_by_id(1), [1, 2], frame=frame)
+        assert wait_until(lambda: voice.onset_frame is not None)
+        assert voice.onset_frame == frame
+        # audio data added after open() is attached to the running process
+        dh.add_pcm(3, np.zeros((10, 1), dtype=np.int16))
+        ahc.publish(dh)
+        voice = ahc.play(dh.get_data_by_id(3), [2])
+        assert wait_until(lambda: voice.onset_frame is not None)
+    finally:
+        ahc.close()
+        ahc.terminate()
+
+def test_play_from_shared_arena():
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.full((100, 1), 100, dtype=np.int16))
+    arena = dh.pack(shared=True)
+    ahc = pyscab.AudioProcess(backend='null', frames_per_buffer=256)
+    ahc.open()
+    try:
+        ahc.publish(dh)
+        # the arena is attached as it is instead of being copied
+        assert dh.get_data_by_id(1).__array_interface__['data'][0] == arena.get(1).__array_interface__['data'][0]
+        voice = ahc.play(dh.get_data_by_id(1), [1])
+        assert wait_until(lambda: voice.onset_frame is not None)
+    finally:
+        ahc.close()
+        ahc.terminate()
+        arena.close()
+
+def test_overwritten_onset_raises():
+    ahc = pyscab.AudioProcess(backend='null', frames_per_buffer=256, onset_size=2)
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.full((10, 1), 100, dtype=np.int16))
+    ahc.publish(dh)
+    ahc.open()
+    try:
+        voices = [ahc.play(dh.get_data_by_id(1), [1]) for m in range(3)]
+        assert wait_until(lambda: voices[2].onset_frame is not None)
+        assert voices[1].onset_frame is not None
+        with pytest.raises(ValueError):
+            voices[0].onset_frame
+    finally:
+        ahc.close()
+        ahc.terminate()
+
+def test_hardware_latency_is_resolved_at_open():
+    ahc = pyscab.AudioProcess(backend=pyscab.NullBackend(latency=0.02), frames_per_buffer=256)
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: None, correct_hardware_buffer=True)
+    assert stc.offset == 256/44100
+    stc.open()
+    try:
+        assert stc.offset == 256/44100 + 0.02
+    finally:
+        stc.close()
+        ahc.terminate()
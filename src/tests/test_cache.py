@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pytest
+import pyscab
+
+WAV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "440Hz_stereo.wav")
+
+def test_put_and_get(tmp_path):
+    cache = pyscab.StimulusCache(str(tmp_path))
+    key = cache.make_key(source="a", volume=0.5)
+    assert cache.get(key) is None
+    data = np.arange(12, dtype=np.int16).reshape(6, 2)
+    stored = cache.put(key, data)
+    assert isinstance(stored, np.memmap) and not stored.flags.writeable
+    assert np.array_equal(cache.get(key), data)
+    assert cache.make_key(volume=0.5, source="a") == key
+    assert cache.make_key(source="a", volume=0.6) != key
+
+def test_file_hash_is_memoized(tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"abc")
+    cache = pyscab.StimulusCache(str(tmp_path / "cache"))
+    digest = cache.file_hash(str(path))
+    # memo is persisted in the cache directory
+    assert pyscab.StimulusCache(str(tmp_path / "cache")).file_hash(str(path)) == digest
+    path.write_bytes(b"abcd")
+    assert cache.file_hash(str(path)) != digest
+
+def test_lru_eviction(tmp_path):
+    data = np.zeros((1000, 2), dtype=np.int16)
+    cache = pyscab.StimulusCache(str(tmp_path))
+    keys = [cache.make_key(m=m) for m in range(4)]
+    cache.put(keys[0], data)
+    # room for 3 entries including headers of .npy files
+    cache.max_bytes = 3*os.path.getsize(cache._path(keys[0]))
+    for m, key in enumerate(keys[:3]):
+        cache.put(key, data)
+        # modification time is used as the last access time
+        os.utime(cache._path(key), (m, m))
+    cache.get(keys[0])
+    cache.put(keys[3], data)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[3]) is not None
+
+def test_load_through_cache(tmp_path):
+    cache = pyscab.StimulusCache(str(tmp_path))
+    dh = pyscab.DataHandler()
+    dh.load(1, WAV_PATH, volume=0.5)
+    cold = pyscab.DataHandler(cache=cache)
+    cold.load(1, WAV_PATH, volume=0.5)
+    n_entries = len(os.listdir(str(tmp_path)))
+    warm = pyscab.DataHandler(cache=cache)
+    warm.load(1, WAV_PATH, volume=0.5, mmap=True)
+    assert isinstance(warm.get_data_by_id(1), np.memmap)
+    assert np.array_equal(warm.get_data_by_id(1), dh.get_data_by_id(1))
+    assert np.array_equal(cold.get_data_by_id(1), dh.get_data_by_id(1))
+    assert len(os.listdir(str(tmp_path))) == n_entries
+
+def test_windowed_data_is_cached(tmp_path):
+    cache = pyscab.StimulusCache(str(tmp_path))
+    first = pyscab.DataHandler(cache=cache)
+    first.load(1, WAV_PATH)
+    first.apply_window(1, 0.01)
+    second = pyscab.DataHandler(cache=cache)
+    second.load(1, WAV_PATH)
+    second.apply_window(1, 0.01)
+    assert isinstance(second.get_data_by_id(1), np.memmap)
+    assert np.array_equal(first.get_data_by_id(1), second.get_data_by_id(1))
+
+def test_load_many_with_evicted_entries(tmp_path):
+    # each entry is larger than half of max_bytes, so each put evicts the previous entry
+    cache = pyscab.StimulusCache(str(tmp_path), max_bytes=200000)
+    volumes = [1.0, 0.8, 0.6, 0.4]
+    dh = pyscab.DataHandler(cache=cache)
+    dh.load_many([(m, WAV_PATH, volume) for m, volume in enumerate(volumes)], n_jobs=1, executor="process")
+    expected = pyscab.DataHandler()
+    for m, volume in enumerate(volumes):
+        expected.load(m, WAV_PATH, volume=volume)
+        assert np.array_equal(dh.get_data_by_id(m), expected.get_data_by_id(m))
@@ -0,0 +1,310 @@
+import os
+import wave
+import numpy as np
+import pytest
+import pyscab
+
+WAV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "440Hz_stereo.wav")
+
+def write_wav(path, data, frame_rate=44100):
+    with wave.open(str(path), 'wb') as wf:
+        wf.setnchannels(data.shape[1])
+        wf.setsampwidth(data.dtype.itemsize)
+        wf.setframerate(frame_rate)
+        wf.writeframes(data.tobytes())
+    return str(path)
+
+def test_read_wav_header():
+    header = pyscab.read_wav_header(WAV_PATH)
+    with wave.open(WAV_PATH, 'rb') as wf:
+        assert header['n_ch'] == wf.getnchannels()
+        assert header['frame_rate'] == wf.getframerate()
+        assert header['sample_width'] == wf.getsampwidth()
+        assert header['n_frames'] == wf.getnframes()
+
+def test_load_reads_interleaved_frames(tmp_path):
+    data = np.arange(20, dtype=np.int16).reshape(10, 2)
+    path = write_wav(tmp_path / "a.wav", data)
+    dh = pyscab.DataHandler()
+    dh.load(1, path)
+    assert np.array_equal(dh.get_data_by_id(1), data)
+    assert dh.get_n_ch_by_id(1) == 2
+    assert dh.get_nframes_by_id(1) == 10
+
+def test_load_uint8(tmp_path):
+    data = np.array([[0], [128], [255]], dtype=np.uint8)
+    dh = pyscab.DataHandler()
+    dh.load(1, write_wav(tmp_path / "a.wav", data))
+    assert dh.get_data_by_id(1).dtype == np.uint8
+    assert np.array_equal(dh.get_data_by_id(1), data)
+
+def test_mmap_is_read_only_view():
+    dh = pyscab.DataHandler()
+    dh.load(1, WAV_PATH)
+    dh.load(2, WAV_PATH, mmap=True)
+    mapped = dh.get_data_by_id(2)
+    assert isinstance(mapped, np.memmap)
+    assert not mapped.flags.writeable
+    assert np.array_equal(mapped, dh.get_data_by_id(1))
+
+def test_mmap_with_volume_raises():
+    dh = pyscab.DataHandler()
+    with pytest.raises(ValueError):
+        dh.load(1, WAV_PATH, volume=0.5, mmap=True)
+
+def test_duplicated_id_raises():
+    dh = pyscab.DataHandler()
+    dh.load(1, WAV_PATH)
+    with pytest.raises(ValueError):
+        dh.load(1, WAV_PATH)
+
+def test_not_wav_raises(tmp_path):
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"not a wav file")
+    with pytest.raises(ValueError):
+        pyscab.read_wav_header(str(path))
+
+def make_files(tmp_path, n_files):
+    paths = list()
+    for m in range(n_files):
+        data = np.full((10 + m, 2), 100*(m+1), dtype=np.int16)
+        paths.append(write_wav(tmp_path / ("%02d.wav" % m), data))
+    return paths
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_load_many(tmp_path, executor):
+    paths = make_files(tmp_path, 4)
+    dh = pyscab.DataHandler()
+    report = dh.load_many([(m, path, 0.5) for m, path in enumerate(paths)], n_jobs=2, executor=executor)
+    assert [entry['id'] for entry in report] == [0, 1, 2, 3]
+    assert [entry['n_frames'] for entry in report] == [10, 11, 12, 13]
+    for m in range(4):
+        assert np.all(dh.get_data_by_id(m) == 50*(m+1))
+
+def test_load_many_validates_ids_first(tmp_path):
+    paths = make_files(tmp_path, 2)
+    dh = pyscab.DataHandler()
+    dh.load(1, paths[0])
+    with pytest.raises(ValueError):
+        dh.load_many([(2, paths[0]), (1, paths[1])])
+    with pytest.raises(ValueError):
+        dh.load_many([(3, paths[0]), (3, paths[1])])
+    # none of the files were registered
+    dh.load_many([(2, paths[0]), (3, paths[1])])
+
+def test_load_many_unknown_executor(tmp_path):
+    paths = make_files(tmp_path, 1)
+    with pytest.raises(ValueError):
+        pyscab.DataHandler().load_many([(1, paths[0])], executor="gpu")
+
+def test_load_directory(tmp_path):
+    make_files(tmp_path, 3)
+    (tmp_path / "readme.txt").write_text("not audio")
+    dh = pyscab.DataHandler()
+    report = dh.load_directory(str(tmp_path), start_id=10, mmap=True)
+    assert [entry['id'] for entry in report] == [10, 11, 12]
+    assert [os.path.basename(entry['path']) for entry in report] == ["00.wav", "01.wav", "02.wav"]
+    assert isinstance(dh.get_data_by_id(12), np.memmap)
+
+def test_unknown_id_raises():
+    dh = pyscab.DataHandler()
+    with pytest.raises(ValueError):
+        dh.get_data_by_id(1)
+
+def test_remove():
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.zeros((10, 1), dtype=np.int16))
+    dh.add_pcm(2, np.ones((20, 2), dtype=np.int16))
+    dh.remove(1)
+    assert list(dh.stimuli.keys()) == [2]
+    assert dh.id == [2]
+    with pytest.raises(ValueError):
+        dh.get_data_by_id(1)
+    with pytest.raises(ValueError):
+        dh.remove(1)
+    # removed id can be used again
+    dh.add_pcm(1, np.zeros((5, 1), dtype=np.int16))
+    assert dh.get_nframes_by_id(1) == 5
+
+def test_replace(tmp_path):
+    paths = make_files(tmp_path, 2)
+    dh = pyscab.DataHandler()
+    dh.load(1, paths[0])
+    with pytest.raises(ValueError):
+        dh.load(1, paths[1])
+    dh.load(1, paths[1], replace=True)
+    assert dh.get_nframes_by_id(1) == 11
+    assert dh.get_path_by_id(1) == paths[1]
+    dh.add_pcm(1, np.zeros((3, 2), dtype=np.int16), replace=True)
+    assert dh.get_path_by_id(1) == "PCM"
+    dh.load_many([(1, paths[0]), (2, paths[1])], replace=True)
+    assert dh.get_nframes_by_id(1) == 10 and dh.get_nframes_by_id(2) == 11
+    assert dh.id == [1, 2]
+
+def peak_frequency(x, fs):
+    spectrum = np.abs(np.fft.rfft(x.astype(np.float64)))
+    return np.argmax(spectrum)*fs/x.shape[0]
+
+def sine(frequency, fs, duration=1.0, amplitude=10000):
+    t = np.arange(int(duration*fs))/fs
+    return np.rint(amplitude*np.sin(2*np.pi*frequency*t)).astype(np.int16)[:, np.newaxis]
+
+def test_resampling_keeps_frequency():
+    for fs, target in ((44100, 48000), (48000, 44100), (48000, 16000)):
+        y = pyscab.convert_pcm(sine(1000, fs), fs, target)
+        assert y.shape == (target, 1)
+        assert abs(peak_frequency(y[:, 0], target) - 1000) <= 1
+        assert abs(np.max(np.abs(y[100:-100])) - 10000) < 100
+
+def test_convert_format_and_channels():
+    x = np.array([[0, 32767], [-32768, 256]], dtype=np.int16)
+    y = pyscab.convert_pcm(x, 44100, dtype="UINT8", n_ch=1)
+    assert y.dtype == np.uint8
+    assert y[:, 0].tolist() == [192, 64]
+    y = pyscab.convert_pcm(np.array([[128], [255]], dtype=np.uint8), 44100, dtype="INT16", n_ch=2)
+    assert y.tolist() == [[0, 0], [32512, 32512]]
+    with pytest.raises(ValueError):
+        pyscab.convert_pcm(np.zeros((10, 2), dtype=np.int16), 44100, n_ch=3)
+
+def test_load_converts_to_targets(tmp_path):
+    path = write_wav(tmp_path / "a.wav", np.repeat(sine(1000, 48000), 2, axis=1), frame_rate=48000)
+    dh = pyscab.DataHandler(frame_rate=44100, format="UINT8", n_ch=1)
+    dh.load(1, path)
+    data = dh.get_data_by_id(1)
+    assert data.shape == (44100, 1) and data.dtype == np.uint8
+    assert abs(peak_frequency(data[:, 0].astype(np.int16) - 128, 44100) - 1000) <= 1
+    dh.add_pcm(2, np.zeros((10, 2), dtype=np.int16))
+    assert dh.get_data_by_id(2).shape == (10, 1)
+    assert np.all(dh.get_data_by_id(2) == 128)
+    with pytest.raises(ValueError):
+        dh.load_stream(3, path)
+
+def test_envelope():
+    data = np.full((1000, 2), 10000, dtype=np.int16)
+    out = pyscab.apply_envelope(data, 0.001, fs=100000)
+    n = 100
+    assert out is data
+    assert out[0, 0] == 0 and out[-1, 0] == 0
+    assert np.all(np.diff(out[:n, 0].astype(np.int64)) >= 0)
+    assert np.all(np.diff(out[-n:, 0].astype(np.int64)) <= 0)
+    assert np.all(out[n:-n] == 10000)
+    assert np.array_equal(out[:, 0], out[:, 1])
+
+def test_envelope_uint8_is_centered():
+    data = np.full((100, 1), 200, dtype=np.uint8)
+    out = pyscab.apply_envelope(data, 0.1, fs=100)
+    assert out[0, 0] == 128 and out[-1, 0] == 128
+    assert out[50, 0] == 200
+
+def test_envelope_too_long():
+    with pytest.raises(ValueError):
+        pyscab.apply_envelope(np.zeros((10, 1), dtype=np.int16), 0.01, fs=1000)
+
+def test_ramps_are_cached_and_read_only():
+    ramp = pyscab.get_ramp(0.01, fs=1000)
+    assert ramp.shape == (10, 1) and ramp.dtype == np.float32
+    assert pyscab.get_ramp(0.01, fs=1000) is ramp
+    assert not ramp.flags.writeable
+    for window in ('linear', 'cosine', 'hann', 'gaussian'):
+        ramp = pyscab.get_ramp(0.1, fs=1000, window=window)[:, 0]
+        assert np.all(np.diff(ramp) >= 0) and ramp[-1] <= 1
+    with pytest.raises(ValueError):
+        pyscab.get_ramp(0.01, window='square')
+
+def test_envelope_of_read_only_data_is_copied():
+    data = np.full((100, 1), 1000, dtype=np.int16)
+    data.flags.writeable = False
+    out = pyscab.apply_envelope(data, 0.01, fs=1000)
+    assert out is not data
+    assert np.all(data == 1000)
+    assert out[0, 0] == 0
+
+def test_apply_window_of_loaded_data(tmp_path):
+    path = write_wav(tmp_path / "a.wav", np.full((1000, 2), 1000, dtype=np.int16), frame_rate=1000)
+    dh = pyscab.DataHandler(frame_rate=1000)
+    dh.load(1, path)
+    dh.apply_window(1, 0.01, window='hann')
+    data = dh.get_data_by_id(1)
+    assert data[0, 0] == 0 and data[-1, 1] == 0
+    assert np.all(data[10:-10] == 1000)
+
+def test_generate_tones_matches_generate_pcm():
+    specs = [{'frequency': 440, 'duration': 0.1}, {'frequency': 1000, 'duration': 0.05, 'volume': 0.5},
+             {'frequency': 880, 'duration': 0.1, 'window': 'hann', 't_raise_fall': 0.02}]
+    for format in ('INT16', 'UINT8'):
+        tones = pyscab.generate_tones(specs, format=format)
+        assert [tone.shape for tone in tones] == [(4410, 1), (2205, 1), (4410, 1)]
+        for spec, tone in zip(specs, tones):
+            expected = pyscab.generate_pcm(1, spec['frequency'], spec['duration'], spec.get('volume', 1.0), format=format,
+                                           window=spec.get('window', 'linear'), t_raise_fall=spec.get('t_raise_fall', 0.01))
+            assert tone.dtype == expected.dtype
+            assert np.max(np.abs(tone[:, 0].astype(np.int64) - expected.reshape(-1).astype(np.int64))) <= 1
+    with pytest.raises(ValueError):
+        pyscab.generate_tones([{'frequency': 440, 'duration': 0.1, 'volume': 1.5}])
+
+def test_add_tones():
+    dh = pyscab.DataHandler()
+    dh.add_tones([{'id': 1, 'frequency': 440, 'duration': 0.1}, {'id': 2, 'frequency': 880, 'duration': 0.2}])
+    assert dh.get_n_ch_by_id(1) == 1
+    assert dh.get_nframes_by_id(2) == 8820
+    with pytest.raises(ValueError):
+        dh.add_tones([{'id': 3, 'frequency': 440, 'duration': 0.1}, {'id': 2, 'frequency': 440, 'duration': 0.1}])
+    # none of the tones were added
+    assert dh.id == [1, 2]
+    dh.add_tones([{'id': 2, 'frequency': 440, 'duration': 0.1}], replace=True)
+    assert dh.get_nframes_by_id(2) == 4410
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_load_many_keeps_data_mapped(tmp_path, executor):
+    paths = make_files(tmp_path, 2)
+    dh = pyscab.DataHandler()
+    dh.load_many([(m, path) for m, path in enumerate(paths)], n_jobs=2, executor=executor, mmap=True)
+    for m in range(2):
+        data = dh.get_data_by_id(m)
+        assert isinstance(data, np.memmap) and not data.flags.writeable
+        assert np.all(data == 100*(m+1))
+    cache = pyscab.StimulusCache(str(tmp_path / "cache"))
+    dh = pyscab.DataHandler(cache=cache)
+    dh.load_many([(m, path, 0.5) for m, path in enumerate(paths)], n_jobs=2, executor=executor)
+    for m in range(2):
+        data = dh.get_data_by_id(m)
+        assert isinstance(data, np.memmap) and not data.flags.writeable
+        assert np.all(data == 50*(m+1))
+
+def test_downsampling_removes_aliases():
+    # 10 kHz is above Nyquist frequency of 16 kHz, it would alias to 6 kHz without band-limiting.
+    y = pyscab.convert_pcm(sine(10000, 48000), 48000, 16000)
+    rms = np.sqrt(np.mean(y[1000:-1000].astype(np.float64)**2))
+    assert rms < 10
+
+def test_volume_saturates_on_both_paths(tmp_path):
+    x = np.array([[30000, -30000], [101, -101]], dtype=np.int16)
+    path = str(tmp_path / "a.wav")
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(44100)
+        wf.writeframes(x.tobytes())
+    direct, _ = pyscab.read_wav(path, volume=1.5)
+    assert direct.tolist() == [[32767, -32768], [152, -152]]
+    mono, _ = pyscab.read_wav(path, volume=1.5, n_ch=1)
+    assert mono.tolist() == [[0], [0]]
+    converted = pyscab.convert_pcm(x, 44100, volume=1.5)
+    assert np.array_equal(direct, converted)
+
+def test_volume_of_uint8_is_centered(tmp_path):
+    path = write_wav(tmp_path / "a.wav", np.array([[128], [228], [28]], dtype=np.uint8))
+    data, sw = pyscab.read_wav(path, volume=0.5)
+    assert data[:, 0].tolist() == [128, 178, 78]
+
+def test_add_pcm_copies_data():
+    tone = np.full((100, 1), 1000, dtype=np.int16)
+    dh = pyscab.DataHandler(frame_rate=1000)
+    dh.add_pcm(1, tone)
+    dh.add_pcm(2, tone)
+    dh.apply_window(1, 0.01)
+    # window is applied once, and neither the passed array nor the other id is changed
+    windowed = pyscab.apply_envelope(np.full((100, 1), 1000, dtype=np.int16), 0.01, fs=1000)
+    assert np.array_equal(dh.get_data_by_id(1), windowed)
+    assert np.all(tone == 1000)
+    assert np.all(dh.get_data_by_id(2) == 1000)
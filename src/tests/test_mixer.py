@@ -0,0 +1,263 @@
+import numpy as np
+import pyscab
+
+FRAME_RATE = 44100
+FRAMES_PER_BUFFER = 512
+
+def open_interface(n_ch=2, format="INT16", backend=None):
+    if backend is None:
+        backend = pyscab.NullBackend(threaded=False)
+    ahc = pyscab.AudioInterface(device_name='null', n_ch=n_ch, format=format, frame_rate=FRAME_RATE,
+                                frames_per_buffer=FRAMES_PER_BUFFER, backend=backend)
+    ahc.open()
+    return ahc
+
+def constant(value, n_frames, n_ch=1, dtype=np.int16):
+    return np.full((n_frames, n_ch), value, dtype=dtype)
+
+def mix(mixer, n_buffers, frame_count):
+    return np.concatenate([mixer.mix(frame_count).copy() for m in range(n_buffers)])
+
+def test_mix_sum_and_routing():
+    mixer = pyscab.Mixer(2, 64)
+    mixer.add(pyscab.ReadAudioChunk(constant(100, 200), 64, [1, 2]))
+    mixer.add(pyscab.ReadAudioChunk(constant(-30, 100), 64, [2]))
+    out = mix(mixer, 4, 64)
+    assert np.all(out[:100, 0] == 100)
+    assert np.all(out[:100, 1] == 70)
+    assert np.all(out[100:200, 1] == 100)
+    assert np.all(out[200:] == 0)
+    assert len(mixer.voices) == 0
+
+def test_stereo_data_is_routed_by_channel():
+    data = np.zeros((64, 2), dtype=np.int16)
+    data[:, 0] = 1
+    data[:, 1] = 2
+    mixer = pyscab.Mixer(3, 64)
+    mixer.add(pyscab.ReadAudioChunk(data, 64, [3, 1]))
+    out = mixer.mix(64)
+    assert np.all(out[:, 0] == 2)
+    assert np.all(out[:, 1] == 0)
+    assert np.all(out[:, 2] == 1)
+
+def test_finished_voice_keeps_others():
+    mixer = pyscab.Mixer(1, 16, max_voices=2)
+    values = [1, 10, 100, 1000]
+    for value, n_frames in zip(values, [16, 48, 32, 64]):
+        mixer.add(pyscab.ReadAudioChunk(constant(value, n_frames), 16, [1]))
+    assert mixer.max_voices == 4
+    out = mix(mixer, 4, 16)[:, 0]
+    assert np.all(out[:16] == 1111)
+    assert np.all(out[16:32] == 1110)
+    assert np.all(out[32:48] == 1010)
+    assert np.all(out[48:] == 1000)
+    assert len(mixer.voices) == 0
+
+def test_mix_uint8_is_centered():
+    mixer = pyscab.Mixer(1, 64, format=np.dtype("uint8"))
+    mixer.add(pyscab.ReadAudioChunk(constant(138, 64, dtype=np.uint8), 64, [1], format=np.dtype("uint8")))
+    mixer.add(pyscab.ReadAudioChunk(constant(133, 32, dtype=np.uint8), 64, [1], format=np.dtype("uint8")))
+    out = mixer.mix(64)
+    assert np.all(out[:32, 0] == 143)
+    assert np.all(out[32:, 0] == 138)
+    assert np.all(mixer.mix(64) == 128)
+
+def test_submitted_voices_start_at_next_mix():
+    mixer = pyscab.Mixer(1, 16)
+    voice = pyscab.ReadAudioChunk(constant(5, 20), 16, [1])
+    mixer.submit(voice)
+    assert mixer.get_n_active() == 0
+    assert np.all(mixer.mix(16) == 5)
+    assert mixer.get_n_active() == 1
+
+def test_finished_voices_are_retired_and_reaped():
+    mixer = pyscab.Mixer(1, 16)
+    voices = [pyscab.ReadAudioChunk(constant(1, n_frames), 16, [1]) for n_frames in [48, 16, 32]]
+    for voice in voices:
+        mixer.submit(voice)
+    mixer.mix(16)
+    # voice in the middle of the slots finished first
+    assert list(mixer.retired) == [voices[1]]
+    assert voices[1].finished and not voices[0].finished
+    assert mixer.voices == [voices[0], voices[2]]
+    mixer.mix(16)
+    assert list(mixer.retired) == [voices[1], voices[2]]
+    assert mixer.reap() == 2
+    assert len(mixer.retired) == 0
+    mixer.mix(16)
+    assert mixer.reap() == 1
+    assert all(voice.finished for voice in voices)
+
+def test_voice_is_read_only_view():
+    data = np.arange(20, dtype=np.int16).reshape(10, 2)
+    voice = pyscab.ReadAudioChunk(data, 4, [1, 2])
+    assert np.shares_memory(voice.data, data)
+    assert not voice.data.flags.writeable
+    assert data.flags.writeable
+    assert voice.routing == [0, 1]
+    assert pyscab.ReadAudioChunk(data[:, :1], 4, [1, 2, 3]).routing == [0, 0, 0]
+
+def test_read_chunk():
+    data = np.arange(20, dtype=np.int16).reshape(10, 2)
+    for ch, routing in (([1, 2], [0, 1]), ([2, 1, 3], [0, 1, 0])):
+        voice = pyscab.ReadAudioChunk(data[:, :len(set(routing))], 4, ch)
+        chunks = list()
+        while not voice.is_finished():
+            chunks.append(voice.read_chunk().copy())
+        assert len(chunks) == 3
+        read = np.concatenate(chunks)
+        assert np.array_equal(read[:10], data[:, routing])
+        # the last chunk is padded with zeros
+        assert np.all(read[10:] == 0)
+
+def test_volume_of_voice():
+    mixer = pyscab.Mixer(2, 64)
+    mixer.add(pyscab.ReadAudioChunk(constant(100, 64), 64, [1, 2], volume=0.5))
+    mixer.add(pyscab.ReadAudioChunk(constant(-30, 64), 64, [2], volume=2.0))
+    out = mixer.mix(64)
+    assert np.all(out[:, 0] == 50)
+    assert np.all(out[:, 1] == -10)
+
+def test_overflow_wraps_without_limiter():
+    mixer = pyscab.Mixer(1, 64)
+    for m in range(2):
+        mixer.add(pyscab.ReadAudioChunk(constant(30000, 64), 64, [1]))
+    assert np.all(mixer.mix(64) == np.int16(60000 - 65536))
+    assert mixer.n_clipped == 0
+
+def test_limiter_clips():
+    mixer = pyscab.Mixer(1, 64, limiter='clip')
+    for value in (30000, 30000, -1000):
+        mixer.add(pyscab.ReadAudioChunk(constant(value, 32), 64, [1]))
+    mixer.add(pyscab.ReadAudioChunk(constant(-30000, 64), 64, [1], volume=2.0))
+    out = mixer.mix(64)[:, 0]
+    assert np.all(out[:32] == -1000)
+    assert np.all(out[32:] == -32768)
+    assert mixer.n_clipped == 32
+
+def test_soft_limiter():
+    values = np.array([0, 10000, 26000, 30000, 40000, 60000, 100000], dtype=np.float64)
+    mixer = pyscab.Mixer(1, len(values), limiter='soft', threshold=0.8)
+    mixer.add(pyscab.ReadAudioChunk((values/4).astype(np.int16)[:, np.newaxis], len(values), [1], volume=4.0))
+    out = mixer.mix(len(values))[:, 0].astype(np.int64)
+    # samples below the threshold are not changed
+    assert out[:3].tolist() == [0, 10000, 26000]
+    assert np.all(np.diff(out[:5]) > 0) and np.all(np.diff(out) >= 0)
+    assert out[-1] == 32767
+    assert mixer.n_clipped == 3
+
+def test_limiter_uint8():
+    mixer = pyscab.Mixer(1, 16, format=np.dtype("uint8"), limiter='clip')
+    for m in range(2):
+        mixer.add(pyscab.ReadAudioChunk(constant(250, 16, dtype=np.uint8), 16, [1], format=np.dtype("uint8")))
+    assert np.all(mixer.mix(16) == 255)
+
+def test_voice_starts_at_start_frame():
+    mixer = pyscab.Mixer(1, 16)
+    voice = pyscab.ReadAudioChunk(constant(7, 10), 16, [1])
+    voice.start_frame = 21
+    mixer.submit(voice)
+    out = mix(mixer, 3, 16)[:, 0]
+    assert np.all(out[:21] == 0)
+    assert np.all(out[21:31] == 7)
+    assert np.all(out[31:] == 0)
+    assert mixer.frame == 48
+
+def test_scheduled_batch_is_started_in_order():
+    mixer = pyscab.Mixer(1, 16)
+    voices = list()
+    for value, start_frame in zip([1, 2, 4], [40, 3, 18]):
+        voice = pyscab.ReadAudioChunk(constant(value, 20), 16, [1])
+        voice.start_frame = start_frame
+        voices.append(voice)
+    mixer.schedule(voices)
+    out = mix(mixer, 5, 16)[:, 0]
+    expected = np.zeros(80, dtype=np.int16)
+    for value, start_frame in zip([1, 2, 4], [40, 3, 18]):
+        expected[start_frame:start_frame+20] += value
+    assert np.array_equal(out, expected)
+    assert len(mixer.timeline) == 0
+
+def test_late_voice_starts_at_next_buffer():
+    mixer = pyscab.Mixer(1, 16)
+    mix(mixer, 2, 16)
+    voice = pyscab.ReadAudioChunk(constant(3, 20), 16, [1])
+    voice.start_frame = 5
+    mixer.submit(voice)
+    out = mix(mixer, 2, 16)[:, 0]
+    assert np.all(out[:20] == 3)
+    assert np.all(out[20:] == 0)
+
+def test_onset_frame_is_recorded():
+    mixer = pyscab.Mixer(1, 16)
+    mix(mixer, 1, 16)
+    voices = [pyscab.ReadAudioChunk(constant(1, 4), 16, [1]) for m in range(2)]
+    voices[1].start_frame = 37
+    assert voices[0].onset_frame is None
+    for voice in voices:
+        mixer.submit(voice)
+    mix(mixer, 2, 16)
+    assert voices[0].onset_frame == 16
+    assert voices[1].onset_frame == 37
+
+def test_sample_accurate_onsets():
+    ahc = open_interface()
+    frames = [100, 512, 1000, 1537]
+    voices = list()
+    for frame in frames:
+        voices.append(ahc.play(constant(1000, 10), [1], frame=frame))
+    ahc.stream.process(8)
+    output = ahc.stream.get_output()
+    assert output.shape == (8*FRAMES_PER_BUFFER, 2)
+    assert [voice.onset_frame for voice in voices] == frames
+    onsets = np.flatnonzero(np.diff((output[:, 0] != 0).astype(np.int8)) == 1) + 1
+    assert onsets.tolist() == frames
+    assert np.all(output[:, 1] == 0)
+    ahc.close()
+    ahc.terminate()
+
+def test_null_stream_time():
+    ahc = open_interface(backend=pyscab.NullBackend(threaded=False, latency=0.01))
+    assert ahc.get_time_info() is None
+    ahc.stream.process(4)
+    assert ahc.get_frame() == 4*FRAMES_PER_BUFFER
+    assert abs(ahc.get_time() - 4*FRAMES_PER_BUFFER/FRAME_RATE) < 1e-9
+    dac_time = ahc.frame2dac_time(ahc.get_frame())
+    # output of the frame is delayed by one buffer and latency of the device
+    assert abs(dac_time - (ahc.frame2time(ahc.get_frame()) + FRAMES_PER_BUFFER/FRAME_RATE + 0.01)) < 1e-9
+    ahc.close()
+    ahc.terminate()
+
+def test_stop_with_fade():
+    ahc = open_interface()
+    n_fade = int(0.01*FRAME_RATE)
+    sounding = ahc.play(constant(1000, FRAME_RATE), [1], frame=0)
+    scheduled = ahc.play(constant(1000, 100), [2], frame=10000)
+    ahc.stream.process(5)
+    request = ahc.stop(fade=0.01)
+    ahc.stream.process(5)
+    output = ahc.stream.get_output()[:, 0].astype(np.int64)
+
+    assert request.frame == 5*FRAMES_PER_BUFFER
+    # played and skipped voices are told by onset_frame
+    assert sounding.onset_frame < request.frame
+    assert scheduled.onset_frame is None
+    assert np.all(output[:request.frame] == 1000)
+    fade = output[request.frame:request.frame+n_fade]
+    assert np.all(np.diff(fade) <= 0) and fade[0] < 1000 and fade[-1] < 10
+    assert np.all(output[request.frame+n_fade:] == 0)
+    assert np.all(ahc.stream.get_output()[:, 1] == 0)
+    ahc.close()
+    ahc.terminate()
+
+def test_read_chunk_returns_view_for_identity_routing():
+    data = np.arange(20, dtype=np.int16).reshape(10, 2)
+    voice = pyscab.ReadAudioChunk(data, 4, [1, 2])
+    chunk = voice.read_chunk()
+    assert np.shares_memory(chunk, data)
+    assert not np.shares_memory(voice.read_chunk(), chunk)
+    last = voice.read_chunk()
+    # last chunk is padded in its own buffer, so audio data is not overwritten
+    assert not np.shares_memory(last, data)
+    assert np.array_equal(last[:2], data[8:]) and np.all(last[2:] == 0)
+    assert np.array_equal(data, np.arange(20, dtype=np.int16).reshape(10, 2))
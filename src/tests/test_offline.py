@@ -0,0 +1,71 @@
+import wave
+import numpy as np
+import pytest
+import pyscab
+
+FRAME_RATE = 44100
+
+def make_data():
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.full((100, 1), 1000, dtype=np.int16))
+    dh.add_pcm(2, np.full((50, 2), -500, dtype=np.int16))
+    return dh
+
+def test_onsets_are_sample_accurate():
+    dh = make_data()
+    plans = [[0.0, 1, [1], 1], [0.01, 1, [1], 2], [0.1234, 1, [1], 3], [0.5, 2, [1, 2], 4]]
+    renderer = pyscab.OfflineRenderer(n_ch=2, frame_rate=FRAME_RATE, frames_per_buffer=256)
+    audio, markers = renderer.render(plans, dh)
+
+    frames = [int(round(plan[0]*FRAME_RATE)) for plan in plans]
+    assert markers['frame'].tolist() == frames
+    assert markers['marker'].tolist() == [1, 2, 3, 4]
+    assert audio.shape == (frames[-1] + 50, 2)
+    onsets = np.flatnonzero(np.diff(np.concatenate(([0], audio[:, 0] != 0)).astype(np.int8)) == 1)
+    assert onsets.tolist() == frames
+    for frame in frames[:3]:
+        assert np.all(audio[frame:frame+100, 0] == 1000)
+        assert np.all(audio[frame:frame+100, 1] == 0)
+    assert np.all(audio[frames[3]:, :] == -500)
+
+def test_overlapping_plans_are_mixed():
+    dh = make_data()
+    plans = [[0.0, 1, [1], 1], [50/FRAME_RATE, 1, [1], 2]]
+    audio, markers = pyscab.OfflineRenderer(n_ch=1, frame_rate=FRAME_RATE).render(plans, dh)
+    assert np.all(audio[:50, 0] == 1000)
+    assert np.all(audio[50:100, 0] == 2000)
+    assert np.all(audio[100:150, 0] == 1000)
+
+def test_render_to_file(tmp_path):
+    dh = make_data()
+    plans = [[0.0, 1, [1], 1], [0.02, 2, [1, 2], 2]]
+    renderer = pyscab.OfflineRenderer(n_ch=2, frame_rate=FRAME_RATE, frames_per_buffer=128)
+    audio, markers = renderer.render(plans, dh)
+    path = str(tmp_path / "session.wav")
+    none, markers_file = renderer.render(plans, dh, path=path)
+    assert none is None
+    assert np.array_equal(markers, markers_file)
+    with wave.open(path, 'rb') as wf:
+        assert wf.getnchannels() == 2 and wf.getframerate() == FRAME_RATE
+        written = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).reshape(-1, 2)
+    assert np.array_equal(audio, written)
+
+def test_invalid_channel_raises():
+    with pytest.raises(ValueError):
+        pyscab.OfflineRenderer(n_ch=1).render([[0.0, 1, [2], 1]], make_data())
+
+def test_frame_rate_mismatch_raises(tmp_path):
+    dh = make_data()
+    renderer = pyscab.OfflineRenderer(n_ch=2, frame_rate=48000)
+    plans = [[0.0, 1, [1], 1]]
+    with pytest.raises(ValueError):
+        next(renderer.render_iter(plans, dh))
+    path = tmp_path / "session.wav"
+    with pytest.raises(ValueError):
+        renderer.render(plans, dh, path=str(path))
+    assert not path.exists()
+    renderer = pyscab.OfflineRenderer(n_ch=2, frame_rate=FRAME_RATE)
+    dh_48k = pyscab.DataHandler(frame_rate=48000)
+    dh_48k.add_pcm(1, np.full((100, 1), 1000, dtype=np.int16))
+    with pytest.raises(ValueError):
+        renderer.render(pyscab.CompiledPlan(plans, dh_48k), dh)
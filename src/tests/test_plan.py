@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import pyscab
+
+def make_data():
+    dh = pyscab.DataHandler(frame_rate=1000)
+    dh.add_pcm(1, np.zeros((100, 1), dtype=np.int16))
+    dh.add_pcm(2, np.zeros((500, 2), dtype=np.int16))
+    return dh
+
+def test_records_are_sorted_and_resolved():
+    dh = make_data()
+    plans = [[0.3, 1, [1], 3], [0.0, 2, [1, 2], 1], [0.3, 2, [2], 4], [0.05, 1, [2], 2]]
+    plan = pyscab.CompiledPlan(plans, dh, n_ch=2)
+    assert len(plan) == 4
+    assert list(plan) == [plans[1], plans[3], plans[0], plans[2]]
+    assert plan.records['index'].tolist() == [1, 3, 0, 2]
+    assert plan.records['frame'].tolist() == [0, 50, 300, 300]
+    assert np.allclose(plan.records['end'], [0.5, 0.15, 0.4, 0.8])
+    assert plan.records['ch'].tolist() == [(1, 2), (2,), (1,), (2,)]
+    assert len(plan.buffers) == 2
+    assert plan.get_data(0) is dh.get_data_by_id(2)
+    assert plan.end_time == 0.8
+    # passed plans are not modified
+    assert plans[0] == [0.3, 1, [1], 3]
+
+def test_polyphony():
+    dh = make_data()
+    # second voice of id 1 starts exactly when the first one ends, which is not an overlap
+    plans = [[0.0, 1, [1], 1], [0.1, 1, [1], 2], [0.15, 2, [1], 3], [0.15, 1, [2], 4], [0.2, 1, [2], 5]]
+    plan = pyscab.CompiledPlan(plans, dh)
+    assert plan.max_polyphony == 3
+    assert plan.n_overlaps == 3
+    empty = pyscab.CompiledPlan([], dh)
+    assert len(empty) == 0 and empty.end_time == 0.0 and empty.max_polyphony == 0
+
+@pytest.mark.parametrize("bad", [[-0.1, 1, [1], 1], [float('nan'), 1, [1], 1], [float('inf'), 1, [1], 1],
+                                 [0.0, 3, [1], 1], [0.0, 1, [3], 1], [0.0, 1, [0], 1], [0.0, 1, [], 1]])
+def test_invalid_plan_raises(bad):
+    plans = [[0.0, 1, [1], 1], bad]
+    with pytest.raises(ValueError, match="plan 1"):
+        pyscab.CompiledPlan(plans, make_data(), n_ch=2)
+
+def test_channels_are_not_checked_without_n_ch():
+    plan = pyscab.CompiledPlan([[0.0, 1, [8], 1]], make_data())
+    assert len(plan) == 1
+
+def test_compile_and_play():
+    ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(paced=False), frame_rate=1000, frames_per_buffer=64)
+    sent = list()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append(val), correct_latency=False)
+    dh = make_data()
+    with pytest.raises(ValueError):
+        stc.compile([[0.0, 1, [3], 1]], dh)
+    plan = stc.compile([[0.02, 1, [2], 2], [0.0, 2, [1, 2], 1]], dh)
+    assert pyscab.get_required_time(plan, dh) == plan.end_time
+    stc.open()
+    stc.play(plan, dh, pause=0)
+    stc.close()
+    ahc.terminate()
+    assert sent == [1, 2]
+
+def test_resolve_after_compiling():
+    dh = make_data()
+    plan = pyscab.CompiledPlan([[0.0, 1, [1], 1], [0.1, 2, [1], 2], [0.2, 1, [2], 3]], dh)
+    assert plan.ids == [1, 2]
+    dh.add_pcm(1, np.ones((100, 1), dtype=np.int16), replace=True)
+    buffers = plan.resolve(dh)
+    assert buffers[0] is dh.get_data_by_id(1)
+    assert plan.get_data(0) is dh.get_data_by_id(1)
+    dh.add_pcm(2, np.ones((10, 2), dtype=np.int16), replace=True)
+    with pytest.raises(ValueError):
+        plan.resolve(dh)
+
+def test_compile_publish_and_play():
+    ahc = pyscab.AudioProcess(backend='null', frame_rate=1000, frames_per_buffer=64)
+    sent = list()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append(val), correct_latency=False)
+    dh = make_data()
+    plan = stc.compile([[0.0, 1, [1], 1], [0.02, 2, [1, 2], 2]], dh)
+    stc.open()
+    try:
+        # audio data is published after plans were compiled
+        ahc.publish(dh)
+        result = stc.play(plan, dh, pause=0)
+    finally:
+        stc.close()
+        ahc.terminate()
+    assert sent == [1, 2]
+    assert len(result['played']) == 2
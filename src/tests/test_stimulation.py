@@ -0,0 +1,300 @@
+import time
+import threading
+import numpy as np
+import pytest
+import pyscab
+
+class ClockInterface(object):
+    # audio interface which only records played audio data on the clock of time.perf_counter()
+    frame_rate = 44100
+    frames_per_buffer = 512
+    num_channels = 2
+    dac_latency = 0.01
+
+    def __init__(self):
+        self.played = list()
+        self.t0 = None
+
+    def open(self):
+        self.t0 = time.perf_counter()
+
+    def close(self):
+        pass
+
+    def get_time_info(self):
+        return {'current_time': self.get_time()}
+
+    def get_time(self):
+        return time.perf_counter() - self.t0
+
+    def play(self, data, ch, *args, **kwargs):
+        self.played.append((self.get_time(), data, ch))
+        voice = pyscab.ReadAudioChunk(data, self.frames_per_buffer, ch)
+        voice.onset_frame = int(self.get_time()*self.frame_rate)
+        return voice
+
+    def get_frame(self):
+        return int(self.get_time()*self.frame_rate)
+
+    def frame2dac_time(self, frame):
+        return frame/self.frame_rate + self.dac_latency
+
+def make_data():
+    dh = pyscab.DataHandler()
+    for id in range(1, 4):
+        dh.add_pcm(id, np.full((441, 1), id, dtype=np.int16))
+    return dh
+
+def test_all_due_plans_are_played_in_order():
+    # several plans become due in the same pass of the loop
+    plans = [[0.03, 3, [2], 5], [0.0, 1, [1], 1], [0.0, 2, [2], 2], [0.0, 3, [1], 3], [0.02, 1, [1], 4], [0.02, 2, [1], 4.5]]
+    original = [list(plan) for plan in plans]
+    ahc = ClockInterface()
+    markers = list()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: markers.append(val), correct_latency=False)
+    stc.open()
+    stc.play(plans, make_data(), pause=0)
+    stc.close()
+    assert markers == [1, 2, 3, 4, 4.5, 5]
+    assert [int(data[0, 0]) for t, data, ch in ahc.played] == [1, 2, 3, 1, 2, 3]
+    assert [list(ch) for t, data, ch in ahc.played] == [[1], [2], [1], [1], [1], [2]]
+    # passed plans are not modified
+    assert plans == original
+    onsets = [t for t, data, ch in ahc.played]
+    assert onsets[3] >= 0.02 and onsets[5] >= 0.03
+
+def test_session_ends_at_the_end_of_audio_data():
+    ahc = ClockInterface()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: None, correct_latency=False)
+    stc.open()
+    start = time.perf_counter()
+    stc.play([[0.0, 1, [1], 1], [0.05, 1, [1], 2]], make_data(), pause=0)
+    elapsed = time.perf_counter() - start
+    stc.close()
+    assert stc.share[0] == 2
+    assert 0.06 <= elapsed < 1.0
+
+def test_dispatcher_sends_markers_in_order_of_deadline():
+    sent = list()
+    dispatcher = pyscab.MarkerDispatcher(lambda val: sent.append(val))
+    dispatcher.start()
+    now = time.perf_counter()
+    for delay, val in ((0.03, 3), (0.01, 1), (0.02, 2)):
+        dispatcher.send_at(now + delay, val)
+    dispatcher.stop()
+    assert sent == [1, 2, 3]
+    log = dispatcher.clear_log()
+    assert [entry[0] for entry in log] == [1, 2, 3]
+    for val, scheduled, actual in log:
+        assert actual >= scheduled
+        assert scheduled == now + 0.01*val
+    assert dispatcher.log == []
+
+def test_dispatcher_sends_due_markers_in_one_batch():
+    batches = list()
+    dispatcher = pyscab.MarkerDispatcher(None, marker_send_batch=lambda vals: batches.append(vals))
+    deadline = time.perf_counter() + 0.02
+    for val in (1, 2, 3):
+        dispatcher.send_at(deadline, val)
+    dispatcher.send_at(deadline + 0.02, 4)
+    dispatcher.stop()
+    assert batches == [[1, 2, 3], [4]]
+    assert [entry[0] for entry in dispatcher.log] == [1, 2, 3, 4]
+
+def test_dispatcher_stop_drains_queue():
+    sent = list()
+    dispatcher = pyscab.MarkerDispatcher(lambda val: sent.append(val))
+    dispatcher.send_after(0.05, 1)
+    dispatcher.stop()
+    # remaining marker is still sent at its deadline
+    assert sent == [1]
+    val, scheduled, actual = dispatcher.log[0]
+    assert actual >= scheduled
+
+def test_latency_corrected_markers():
+    ahc = ClockInterface()
+    sent = list()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append((val, time.perf_counter())), correct_latency=True)
+    stc.open()
+    start = time.perf_counter()
+    stc.play([[0.0, 1, [1], 1], [0.02, 2, [1], 2]], make_data(), pause=0)
+    stc.close()
+    assert [val for val, t in sent] == [1, 2]
+    assert [entry[0] for entry in stc.marker_dispatcher.log] == [1, 2]
+    assert sent[0][1] - start >= stc.offset
+
+def test_markers_at_dac_time():
+    ahc = ClockInterface()
+    sent = list()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append(val), correct_latency='dac')
+    stc.open()
+    stc.play([[0.0, 1, [1], 1], [0.02, 2, [1], 2]], make_data(), pause=0)
+    stc.close()
+    assert sent == [1, 2]
+    for (val, scheduled, actual), (t, data, ch) in zip(stc.marker_dispatcher.log, ahc.played):
+        onset_frame = int(t*ahc.frame_rate)
+        assert abs(scheduled - (onset_frame/ahc.frame_rate + ahc.dac_latency)) < 1e-3
+        assert actual >= scheduled
+
+def test_sample_accurate_play_on_null_backend():
+    ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(paced=False), frames_per_buffer=256)
+    sent = list()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append(val), correct_latency=False)
+    stc.open()
+    plans = [[0.0, 1, [1], 1], [0.0123, 2, [1], 2], [0.05, 3, [2], 3]]
+    stc.play(plans, make_data(), pause=0, sample_accurate=True)
+    output = ahc.stream.get_output()
+    stc.close()
+    assert sent == [1, 2, 3]
+    onsets = [np.flatnonzero(output[:, ch-1] == value)[0] for ch, value in ((1, 1), (1, 2), (2, 3))]
+    frames = [int(round(plan[0]*ahc.frame_rate)) for plan in plans]
+    assert [onset - onsets[0] for onset in onsets] == frames
+
+def test_lateness_of_onsets_is_recorded():
+    ahc = ClockInterface()
+    ahc.telemetry = pyscab.Telemetry()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: None, correct_latency=False)
+    stc.open()
+    stc.play([[0.0, 1, [1], 1], [0.01, 2, [1], 2]], make_data(), pause=0)
+    stc.close()
+    onsets = ahc.telemetry.get_onsets()
+    assert onsets[:, 0].tolist() == [0.0, 0.01]
+    assert np.all(onsets[:, 1] >= 0)
+
+def test_stop_skips_plans():
+    dh = pyscab.DataHandler()
+    dh.add_pcm(1, np.full((2205, 2), 1000, dtype=np.int16))
+    ahc = pyscab.AudioInterface(frames_per_buffer=512, backend=pyscab.NullBackend(paced=True))
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: None, correct_latency=False, fade_out=0.01)
+    plans = [[0.0, 1, [1], 1], [0.2, 1, [2], 2], [1.2, 1, [1], 3], [1.5, 1, [2], 4]]
+    stc.open()
+    timer = threading.Timer(0.6, stc.stop)
+    timer.start()
+    result = stc.play(plans, dh, sample_accurate=True)
+    timer.join()
+    stc.close()
+    ahc.terminate()
+    assert result['stopped']
+    assert result['played'] == plans[:2]
+    assert result['skipped'] == plans[2:]
+
+def test_stop_by_share():
+    ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(), frames_per_buffer=512)
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: None, correct_latency=False)
+    plans = [[0.0, 1, [1], 1], [2.0, 1, [1], 2]]
+    stc.open()
+    timer = threading.Timer(0.2, lambda: stc.share.__setitem__(0, 0))
+    timer.start()
+    start = time.perf_counter()
+    result = stc.play(plans, make_data(), pause=0)
+    timer.join()
+    stc.close()
+    ahc.terminate()
+    assert time.perf_counter() - start < 1.0
+    assert result['played'] == plans[:1]
+    assert result['skipped'] == plans[1:]
+
+def null_controller(sent):
+    ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(), frames_per_buffer=256)
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append(val), correct_latency=False)
+    return ahc, stc
+
+def test_play_plans_from_generator():
+    pulled = list()
+    def generate():
+        for m in range(4):
+            pulled.append(time.perf_counter())
+            yield [0.05*m, m % 3 + 1, [1], m]
+    sent = list()
+    ahc, stc = null_controller(sent)
+    stc.open()
+    start = time.perf_counter()
+    result = stc.play(generate(), make_data(), pause=0, lookahead=0.02)
+    elapsed = time.perf_counter() - start
+    stc.close()
+    ahc.terminate()
+    assert sent == [0, 1, 2, 3]
+    # plans pulled from iterator are not kept
+    assert result['played'] is None and result['skipped'] is None
+    assert result['n_played'] == 4 and result['n_skipped'] == 0 and not result['stopped']
+    # plans are pulled only as they approach their time
+    assert pulled[-1] - pulled[0] > 0.05
+    # session ends after the last audio data
+    assert elapsed >= 0.15 + 0.01
+
+def test_play_plans_from_async_generator():
+    import asyncio
+    async def generate():
+        for m in range(3):
+            await asyncio.sleep(0.01)
+            yield [0.03*m, 1, [2], m]
+    sent = list()
+    ahc, stc = null_controller(sent)
+    stc.open()
+    result = stc.play(generate(), make_data(), pause=0, lookahead=0.02, sample_accurate=True)
+    stc.close()
+    ahc.terminate()
+    assert sent == [0, 1, 2]
+    assert result['n_played'] == 3
+
+def test_invalid_plan_from_generator_raises():
+    def generate():
+        yield [0.0, 1, [1], 1]
+        # the first plan is played before the bad plan is pulled
+        time.sleep(0.05)
+        yield [0.1, 9, [1], 2]
+    sent = list()
+    ahc, stc = null_controller(sent)
+    stc.open()
+    with pytest.raises(ValueError):
+        stc.play(generate(), make_data(), pause=0, lookahead=0.01)
+    stc.close()
+    ahc.terminate()
+    assert sent == [1]
+
+def test_markers_due_together_are_sent_in_one_batch():
+    ahc = ClockInterface()
+    batches = list()
+    stc = pyscab.StimulationController(ahc, marker_send=None, correct_latency=True,
+                                       marker_send_batch=lambda vals: batches.append(vals))
+    stc.open()
+    stc.play([[0.0, 1, [1], 1], [0.0, 2, [2], 2], [0.03, 3, [1], 3]], make_data(), pause=0)
+    stc.close()
+    assert batches == [[1, 2], [3]]
+
+def test_pending_markers_are_sent_before_closing():
+    class ClosingInterface(ClockInterface):
+        dac_latency = 0.05
+        def close(self):
+            # time of closed stream can not be read
+            self.t0 = None
+    ahc = ClosingInterface()
+    sent = list()
+    stc = pyscab.StimulationController(ahc, marker_send=lambda val: sent.append(val), correct_latency='dac')
+    stc.open()
+    stc.play([[0.0, 1, [1], 1]], make_data(), pause=0)
+    stc.close()
+    assert sent == [1]
+
+def test_results_of_iterator_are_reported_while_playing():
+    def generate():
+        for m in range(20):
+            yield [0.02*m, 1, [1], m]
+    reported = list()
+    sent = list()
+    ahc, stc = null_controller(sent)
+    stc.open()
+    timer = threading.Timer(0.25, stc.stop)
+    timer.start()
+    result = stc.play(generate(), make_data(), pause=0, lookahead=0.02,
+                      on_result=lambda plan, played: reported.append((plan[3], played, time.perf_counter())))
+    end = time.perf_counter()
+    timer.join()
+    stc.close()
+    ahc.terminate()
+    assert result['stopped']
+    assert result['n_played'] + result['n_skipped'] == len(reported)
+    assert [marker for marker, played, t in reported if played] == list(range(result['n_played']))
+    assert all(not played for marker, played, t in reported[result['n_played']:])
+    # plans are reported as soon as they were started, not at the end of play()
+    assert reported[0][2] < end - 0.1
@@ -0,0 +1,112 @@
+import os
+import time
+import numpy as np
+import pyscab
+
+WAV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "440Hz_stereo.wav")
+
+def read_all(reader, n_ch, block_frames=1000):
+    chunks = list()
+    while reader.consumed < reader.n_frames:
+        rows = np.zeros((n_ch, block_frames), dtype=reader.ring.dtype)
+        n = reader.read(rows, block=True)
+        chunks.append(rows[:, :n].T)
+    return np.concatenate(chunks)
+
+def test_reader_reads_whole_file_through_small_ring():
+    dh = pyscab.DataHandler()
+    dh.load(1, WAV_PATH)
+    stream = pyscab.WavStream(WAV_PATH, ring_frames=4096, block_frames=1024)
+    assert stream.shape == dh.get_data_by_id(1).shape
+    reader = stream.open()
+    assert reader.ring.shape == (4096, 2)
+    read = read_all(reader, 2)
+    reader.close()
+    assert np.array_equal(read, dh.get_data_by_id(1))
+
+def test_read_chunk_of_stream():
+    dh = pyscab.DataHandler()
+    dh.load(1, WAV_PATH)
+    dh.load_stream(2, WAV_PATH, ring_frames=8192)
+    loaded = pyscab.ReadAudioChunk(dh.get_data_by_id(1), 4096, [2, 1])
+    streamed = pyscab.make_voice(dh.get_data_by_id(2), 4096, [2, 1])
+    assert isinstance(streamed, pyscab.StreamingAudioChunk)
+    assert streamed.stream is None
+    while not loaded.is_finished():
+        assert np.array_equal(streamed.read_chunk(), loaded.read_chunk())
+    assert streamed.is_finished()
+    streamed.close()
+    assert streamed.stream is None
+
+def test_streamed_data_is_played_as_loaded():
+    dh = pyscab.DataHandler()
+    dh.load(1, WAV_PATH)
+    dh.load_stream(2, WAV_PATH)
+    outputs = list()
+    for id in (1, 2):
+        ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(threaded=False), frames_per_buffer=512)
+        ahc.open()
+        voice = ahc.play(dh.get_data_by_id(id), [1, 2], frame=2048)
+        if id == 2:
+            # reader is opened before the voice is started, and fills its ring buffer meanwhile
+            assert voice.stream is not None
+            while voice.stream.written < voice.n_frames:
+                time.sleep(0.001)
+        ahc.stream.process(-(-(41257 + 2048)//512))
+        outputs.append(ahc.stream.get_output())
+        assert voice.finished
+        ahc.close()
+        ahc.terminate()
+        # reader is closed when the voice is reaped
+        assert voice.stream is None
+    assert np.array_equal(outputs[0], outputs[1])
+
+def test_streamed_data_is_rendered_as_loaded():
+    dh = pyscab.DataHandler()
+    dh.load(1, WAV_PATH)
+    dh.load_stream(2, WAV_PATH)
+    renderer = pyscab.OfflineRenderer(n_ch=2)
+    loaded, _ = renderer.render([[0.1*m, 1, [1, 2], m] for m in range(3)], dh)
+    streamed, _ = renderer.render([[0.1*m, 2, [1, 2], m] for m in range(3)], dh)
+    assert np.array_equal(loaded, streamed)
+
+def test_mixer_does_not_open_streams():
+    dh = pyscab.DataHandler()
+    dh.load_stream(1, WAV_PATH)
+    mixer = pyscab.Mixer(2, 512, stream_lookahead=4096)
+    voices = [pyscab.make_voice(dh.get_data_by_id(1), 512, [1, 2]) for m in range(2)]
+    voices[0].start_frame = 1024
+    voices[1].start_frame = 100000
+    mixer.schedule(voices)
+    for m in range(4):
+        mixer.mix(512)
+    # readers are opened only by open_streams(), which is called outside of the callback
+    assert all(voice.stream is None for voice in voices)
+    assert mixer.get_n_active() == 0
+    assert mixer.open_streams() == 1
+    assert voices[0].stream is not None and voices[1].stream is None
+    mixer.mix(512)
+    assert mixer.get_n_active() == 1
+    # streams which are not opened yet are dropped by stop()
+    mixer.stop()
+    mixer.mix(512)
+    assert mixer.open_streams() == 0
+    assert mixer.reap() == 2
+    assert all(voice.stream is None for voice in voices)
+
+def test_scheduled_stream_is_opened_by_thread():
+    dh = pyscab.DataHandler()
+    dh.load_stream(1, WAV_PATH)
+    ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(threaded=False), frames_per_buffer=512)
+    ahc.open()
+    # started beyond stream_lookahead (65536 frames by default)
+    voice = ahc.play(dh.get_data_by_id(1), [1, 2], frame=65536 + 4096)
+    assert voice.stream is None
+    ahc.stream.process(16)
+    deadline = time.time() + 5.0
+    while voice.stream is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert voice.stream is not None
+    ahc.close()
+    ahc.terminate()
+    assert voice.stream is None
@@ -0,0 +1,55 @@
+import numpy as np
+import pyscab
+
+def test_ring_buffer_keeps_latest_records():
+    telemetry = pyscab.Telemetry(size=4, size_onsets=2)
+    for m in range(6):
+        telemetry.record_callback(float(m), 0.001*m, m, 0)
+    callbacks = telemetry.get_callbacks()
+    assert telemetry.get_n_callbacks() == 6
+    assert callbacks[:, 0].tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert callbacks[:, 2].tolist() == [2, 3, 4, 5]
+    for m in range(3):
+        telemetry.record_onset(float(m), 0.001)
+    assert telemetry.get_onsets()[:, 0].tolist() == [1.0, 2.0]
+
+def test_status_flags_and_summary():
+    telemetry = pyscab.Telemetry()
+    telemetry.set_budget(0.01)
+    # output underflow and priming output
+    telemetry.record_callback(0.0, 0.002, 1, 4 | 16)
+    telemetry.record_callback(0.01, 0.005, 3, 4)
+    counts = telemetry.get_status_counts()
+    assert counts['output_underflow'] == 2
+    assert counts['priming_output'] == 1
+    assert counts['input_overflow'] == 0
+    summary = telemetry.summary()
+    assert summary['n_callbacks'] == 2
+    assert summary['duration_max'] == 0.005
+    assert summary['load_max'] == 0.5
+    assert summary['n_active_max'] == 3
+    telemetry.reset()
+    assert telemetry.get_n_callbacks() == 0
+    assert telemetry.summary()['budget'] == 0.01
+
+def test_shared_telemetry_can_be_attached():
+    telemetry = pyscab.Telemetry(size=8, shared=True)
+    try:
+        telemetry.record_callback(1.0, 0.001, 2, 0)
+        attached = pyscab.Telemetry.attach(telemetry.name)
+        assert attached.size == 8
+        assert np.array_equal(attached.get_callbacks(), telemetry.get_callbacks())
+        attached.close()
+    finally:
+        telemetry.close()
+
+def test_callbacks_are_recorded_by_audio_interface():
+    ahc = pyscab.AudioInterface(backend=pyscab.NullBackend(threaded=False), frames_per_buffer=256, telemetry=True)
+    ahc.open()
+    ahc.stream.process(3)
+    callbacks = ahc.telemetry.get_callbacks()
+    ahc.close()
+    ahc.terminate()
+    assert callbacks.shape == (3, 3)
+    assert np.allclose(callbacks[:, 0], np.arange(3)*256/44100)
+    assert ahc.telemetry.summary()['budget'] == 256/44100